@@ -3,6 +3,8 @@
 import argparse
 
 from src.analysis import analyze_file
+from src.performance import (add_profile_args, apply_profile, load_profile,
+                             profile_from_args)
 
 
 def parse_args():
@@ -23,6 +25,13 @@ def parse_args():
     parser.add_argument('-t', '--threshold', type=float,
                         default=0.6666,
                         help='threshold for neutral label. Any score below the threshold (positive or negative) is considered neutral.')
+    parser.add_argument('-o', '--outfile', type=str,
+                        default='',
+                        help='output file. A columnar store is written if it ends with .parquet or .arrow. If empty, the input file is updated.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/default.yaml',
+                        help='configuration file whose performance section is used.')
+    add_profile_args(parser)
     opt = parser.parse_args()
 
     return opt
@@ -32,4 +41,7 @@ if __name__ == '__main__':
     # Load parameters
     opt = parse_args()
 
-    analyze_file(opt.srcfile, opt.version, opt.threshold)
+    profile = profile_from_args(load_profile(opt.config), opt)
+    apply_profile(profile)
+
+    analyze_file(opt.srcfile, opt.version, opt.threshold, opt.outfile, profile['xla'])
@@ -2,7 +2,7 @@
 '''
 import argparse
 
-from src.format import json2csv
+from src.format import convert_json_files
 
 
 def parse_args():
@@ -16,10 +16,13 @@ def parse_args():
     parser = argparse.ArgumentParser(
         description='Converts a JSON file into a CSV file.')
     parser.add_argument('path', type=str,
-                        help='path to JSON file.')
+                        help='path to JSON file, folder of JSON files or glob pattern (quoted).')
     parser.add_argument('-c', '--csv', type=str,
                         default='output.csv',
-                        help='CSV output file to have conversion.')
+                        help='CSV output file to have conversion. Output folder if several JSON files are given.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=0,
+                        help='number of files converted in parallel. If 0, uses the number of CPUs.')
     opt = parser.parse_args()
 
     return opt
@@ -29,4 +32,4 @@ if __name__ == '__main__':
     # Load parameters
     opt = parse_args()
 
-    json2csv(opt.path, opt.csv)
+    convert_json_files(opt.path, opt.csv, jobs=opt.jobs)
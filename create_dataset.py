@@ -26,6 +26,11 @@ def parse_args():
     parser.add_argument('-v', '--verbose', type=bool,
                         default=True,
                         help='option to show statistics on data when creating.')
+    parser.add_argument('-f', '--format', type=str,
+                        default='csv', choices=['csv', 'parquet'],
+                        help='format of the train and test splits.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='merge annotated files again instead of using the cache.')
     opt = parser.parse_args()
 
     return opt
@@ -35,4 +40,5 @@ if __name__ == '__main__':
     # Load parameters
     opt = parse_args()
 
-    create_dataset(opt.infolder, opt.outfolder, opt.test_ratio, opt.verbose)
+    create_dataset(opt.infolder, opt.outfolder, opt.ratio, opt.verbose, opt.format,
+                   not opt.no_cache)
@@ -0,0 +1,44 @@
+'''Remove near-duplicate messages before analysis and annotation.
+'''
+import argparse
+
+from src.dedup import dedup_file, propagate_labels
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Collapse near-duplicate messages of a JSON file, or propagate labels back to all messages.')
+    parser.add_argument('srcfile', type=str,
+                        help='JSON file of messages.')
+    parser.add_argument('-o', '--output', type=str,
+                        default='output.json',
+                        help='output file. JSON file of representatives, or labelled file with -l.')
+    parser.add_argument('-m', '--mapping', type=str,
+                        default='mapping.json',
+                        help='JSON file mapping each message to its representative.')
+    parser.add_argument('-t', '--threshold', type=float,
+                        default=0.8,
+                        help='Jaccard similarity above which 2 messages are near-duplicates.')
+    parser.add_argument('-l', '--labels', type=str,
+                        default='',
+                        help='analyzed JSON or annotated CSV of representatives. If given, labels are propagated to all messages of srcfile.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters
+    opt = parse_args()
+
+    if opt.labels:
+        propagate_labels(opt.srcfile, opt.labels, opt.mapping, opt.output)
+    else:
+        dedup_file(opt.srcfile, opt.output, opt.mapping, opt.threshold)
@@ -0,0 +1,49 @@
+'''Take a raw source (export, capture or web page) to a scored file in one pass.
+'''
+import argparse
+
+from src.format import READERS
+from src.pipeline import ingest
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Read, normalize, deduplicate, analyze and write messages in a single streamed pass.')
+    parser.add_argument('srcfile', type=str,
+                        help='path or url to the source.')
+    parser.add_argument('-o', '--outfile', type=str,
+                        default='output.csv',
+                        help='output file. Format depends on extension: .csv, .json, .jsonl, .parquet or .arrow.')
+    parser.add_argument('-f', '--format', type=str,
+                        default='', choices=[''] + sorted(READERS),
+                        help='format of the source. Detected if not given.')
+    parser.add_argument('-d', '--dedup', type=str,
+                        default='exact', choices=['none', 'exact', 'near'],
+                        help='deduplication of messages.')
+    parser.add_argument('-v', '--version', type=int,
+                        default=0,
+                        help='version of analyzer. 0 is CamemBERT, 1 is transformers\' default, -1 skips analysis.')
+    parser.add_argument('-t', '--threshold', type=float,
+                        default=0.6666,
+                        help='threshold for neutral label.')
+    parser.add_argument('-b', '--batch', type=int,
+                        default=16,
+                        help='number of messages analyzed at once.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters
+    opt = parse_args()
+
+    ingest(opt.srcfile, opt.outfile, opt.format, opt.version,
+           opt.threshold, opt.dedup, opt.batch)
@@ -0,0 +1,43 @@
+'''Connect to several IRC servers at once to gather messages from their channels.
+'''
+import argparse
+
+import yaml
+
+from src.connection import IrcHarvester
+from src.format import JsonArrayWriter
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Gather data (messages) from channels on several IRC servers in a single process.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/harvest.yaml',
+                        help='configuration file listing servers and channels.')
+    parser.add_argument('-f', '--file', type=str,
+                        default='',
+                        help='path to JSON file to store messages in. Overrides the configuration file.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters and config file
+    opt = parse_args()
+
+    with open(opt.config, 'r') as f:
+        config = yaml.load(f, yaml.FullLoader)
+
+    # Messages of a previous capture in the same file are kept
+    writer = JsonArrayWriter(opt.file or config['file'], resume=True)
+    harvester = IrcHarvester(config['servers'], config['nickname'], writer,
+                             config.get('backoff'), config.get('report', 60))
+    harvester.start()
@@ -0,0 +1,63 @@
+'''Load test of the live path against local mock chat servers.
+'''
+import argparse
+import csv
+
+from src.loadtest import format_result, run_load, sustained
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Feeds a local mock website or IRC server at increasing rates and measures the live path.')
+    parser.add_argument('-m', '--mode', type=str,
+                        default='http', choices=['http', 'irc'],
+                        help='http runs ronde.py headless on a mock website, irc runs irc_connection.py on a mock IRC server.')
+    parser.add_argument('-r', '--rates', type=float,
+                        default=[1, 2, 5, 10], nargs='+',
+                        help='messages per second fed to the source, one run per rate.')
+    parser.add_argument('-d', '--duration', type=float,
+                        default=60,
+                        help='duration (in seconds) of each run.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/default.yaml',
+                        help='configuration of ronde.py. Display is disabled during the test.')
+    parser.add_argument('--corpus', type=str,
+                        default='data/pre/chaat.json',
+                        help='messages file fed to the source. If empty, messages are synthetic.')
+    parser.add_argument('-o', '--outfile', type=str,
+                        default='',
+                        help='CSV file to write the results to.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters
+    opt = parse_args()
+
+    results = []
+    for rate in opt.rates:
+        result = run_load(opt.mode, rate, opt.duration, opt.config, opt.corpus)
+        print(format_result(result))
+        results.append(result)
+
+    kept_up = [x['rate'] for x in results if sustained(x)]
+    if kept_up:
+        print('Highest rate sustained: {:g} msg/s'.format(max(kept_up)))
+    else:
+        print('No rate sustained')
+
+    if opt.outfile:
+        columns = ['mode', 'rate', 'throughput', 'backlog_growth', 'lag', 'lag_max', 'rss', 'rss_max', 'log']
+        with open(opt.outfile, 'w', newline='') as f:
+            writer = csv.DictWriter(f, columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
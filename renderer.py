@@ -0,0 +1,31 @@
+'''Renderer of frames published by ronde.py, without any model.
+'''
+import argparse
+
+from src.renderer import create_renderer
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Shows frames published by ronde.py -p, and sends them to OSC and MIDI.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/default.yaml',
+                        help='Configuration file for the display, outputs and bus.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    # Load parameters and config file
+    opt = parse_args()
+
+    renderer = create_renderer(opt.config)
+    renderer.mainloop()
@@ -1,11 +1,18 @@
-'''Simple GUI for La Ronde de Nuit project.
+'''Simple GUI for La Ronde de Nuit project, and single command line of its scripts.
+
+    python ronde.py [-c config] [-f file] [-p]
+    python ronde.py <command> [args]
+
+See src.cli for the list of commands.
 '''
 import argparse
+import sys
+from typing import List
 
-from src.gui import create_ronde_gui
+from src.cli import describe_commands, main
 
 
-def parse_args():
+def parse_args(argv: List[str]):
     '''Define an argument parser and returns the corresponding dictionary.
 
     Returns
@@ -14,26 +21,40 @@ def parse_args():
         dictionary of input arguments
     '''
     parser = argparse.ArgumentParser(
-        description='Runs La Ronde de Nuit demo.')
+        prog='ronde.py',
+        description='Runs La Ronde de Nuit demo.',
+        epilog=describe_commands(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('-c', '--config', type=str,
                         default='config/default.yaml',
                         help='Configuration file for the demonstration.')
     parser.add_argument('-f', '--file', type=str,
                         default='https://nightwatch.couzinetjacques.com/ReqMsg_01.php',
                         help='file or website to read data from. If empty, this will open a file browser to select a file.')
-    opt = parser.parse_args()
+    parser.add_argument('-p', '--publish', action='store_true',
+                        help='publish frames on the bus (bus section of the configuration) for renderer.py.')
+    opt = parser.parse_args(argv)
 
     return opt
 
 
-if __name__ == "__main__":
+def run(argv: List[str]) -> None:
+    '''Run the GUI.
+    '''
     # Load parameters and config file
-    opt = parse_args()
+    opt = parse_args(argv)
 
-    # Create the GUI
-    ronde = create_ronde_gui(opt.config, opt.file)
+    # Imported here so that other commands do not load the GUI dependencies
+    from src.gui import create_ronde_gui
+    from src.performance import apply_profile, load_profile
+    apply_profile(load_profile(opt.config))
 
-    # Init messages 
+    # Create the GUI
+    ronde = create_ronde_gui(opt.config, opt.file, opt.publish)
 
     # Run the mainloop
     ronde.mainloop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:], run)
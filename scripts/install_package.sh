@@ -1,4 +1,4 @@
 pip install tensorflow transformers torch keras
 pip install tk tqdm scipy scikit-image
-pip install setuptools requests pyaml pandas numpy
+pip install setuptools requests pyaml pandas numpy pyarrow
 pip install colour datasets ftfy irc python-osc python-rtmidi mido sentencepiece
@@ -0,0 +1,59 @@
+'''Render a recorded source offline, faster than real time, without model.
+'''
+import argparse
+
+from src.config import load_config
+from src.simulate import render, save_strip, save_timeline, save_video
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Runs the colors and transitions of La Ronde de Nuit over a recorded source, with no waits.')
+    parser.add_argument('source', type=str,
+                        help='analyzed messages file, or folder / glob pattern of captured HTML pages.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/default.yaml',
+                        help='configuration file (colors, manager and models threshold).')
+    parser.add_argument('-l', '--labels', type=str,
+                        default='',
+                        help='analyzed messages file whose analyses are replayed. Default is the source.')
+    parser.add_argument('-m', '--model', type=str,
+                        default='camembert',
+                        help='model whose recorded analyses are replayed, such as camembert or default.')
+    parser.add_argument('-o', '--outfile', type=str,
+                        default='',
+                        help='NumPy archive (.npz) to save the timeline of frames to.')
+    parser.add_argument('-i', '--image', type=str,
+                        default='',
+                        help='image file to save the timeline as a strip to.')
+    parser.add_argument('-v', '--video', type=str,
+                        default='',
+                        help='video file to save the timeline to (requires ffmpeg).')
+    parser.add_argument('-s', '--speed', type=float,
+                        default=1.0,
+                        help='playback speed of the video compared to the display.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == "__main__":
+    # Load parameters and config file
+    opt = parse_args()
+    config = load_config(opt.config).raw
+
+    timeline = render(config, opt.source, opt.labels, opt.model)
+
+    if opt.outfile:
+        save_timeline(timeline, opt.outfile)
+    if opt.image:
+        save_strip(timeline, opt.image)
+    if opt.video:
+        save_video(timeline, opt.video, speed=opt.speed)
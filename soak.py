@@ -0,0 +1,58 @@
+'''Long-running soak test of the headless pipeline, with memory growth tracking.
+'''
+import argparse
+import sys
+
+from src.soak import format_report, run_soak
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Runs the headless pipeline against a local mock website and reports memory growth per hour.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/default.yaml',
+                        help='configuration of the pipeline. Display is disabled during the test.')
+    parser.add_argument('-d', '--duration', type=float,
+                        default=4,
+                        help='duration of the test (in hours).')
+    parser.add_argument('-i', '--interval', type=float,
+                        default=60,
+                        help='delay (in seconds) between 2 samples.')
+    parser.add_argument('-w', '--warmup', type=float,
+                        default=300,
+                        help='time (in seconds) before growth is measured.')
+    parser.add_argument('-r', '--rate', type=float,
+                        default=1.0,
+                        help='messages per second fed to the mock website.')
+    parser.add_argument('--corpus', type=str,
+                        default='data/pre/chaat.json',
+                        help='messages file fed to the mock website. If empty, messages are synthetic.')
+    parser.add_argument('-b', '--budget', type=float,
+                        default=10.0,
+                        help='maximal RSS growth (in MB per hour). The test fails over it.')
+    parser.add_argument('--replay', action='store_true',
+                        help='replay analyses recorded in the corpus instead of loading the model.')
+    parser.add_argument('-o', '--outfile', type=str,
+                        default='soak.json',
+                        help='JSON file to write the report and samples to.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters
+    opt = parse_args()
+
+    report = run_soak(opt.config, opt.duration * 3600, opt.interval, opt.rate, opt.corpus,
+                      opt.warmup, opt.budget, opt.replay, opt.outfile)
+    print(format_report(report))
+
+    sys.exit(0 if report['passed'] else 1)
@@ -0,0 +1,303 @@
+'''Incremental retraining and selection of the next messages to annotate.
+
+Each annotation round:
+    * warm-starts from the previously exported model (results folder)
+    * trains a few epochs on annotations not seen yet, mixed with replayed
+      seen annotations so that the model does not forget them
+    * ranks unlabeled messages by uncertainty of the updated model and writes
+      the most uncertain ones in a CSV to annotate next
+
+Annotations already trained on are identified by a hash of their message and
+label, stored in seen.json next to the model. A full retraining records its
+train split there too (see src.retrain.select_best_checkpoint).
+'''
+import csv
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import tensorflow as tf
+from sklearn.model_selection import train_test_split
+from transformers import (CamembertTokenizerFast,
+                          TFCamembertForSequenceClassification,
+                          create_optimizer)
+
+from .dataset import merge_information
+from .dedup import normalize_message
+from .encoding import (EncodedShards, bucket_boundaries, bucketed_dataset,
+                       encode_split, length_percentile)
+from .format import find_files, read_messages
+from .retrain import compile_model, load_train_config
+from .store import STORE_EXTENSIONS
+
+
+def annotation_hash(message: str,
+                    label: str) -> str:
+    '''Returns a hash identifying an annotation.
+    '''
+    return hashlib.sha1('{}\x00{}'.format(message, label).encode('utf8')).hexdigest()
+
+
+def read_seen(path: str) -> Set[str]:
+    '''Returns the hashes of the annotations a model was trained on.
+    '''
+    if not os.path.isfile(path):
+        return set()
+    with open(path) as f:
+        return set(json.load(f))
+
+
+def write_seen(path: str,
+               seen: Iterable[str]) -> None:
+    '''Write the hashes of the annotations a model was trained on.
+    '''
+    with open(path, 'w') as f:
+        json.dump(sorted(set(seen)), f)
+
+
+def select_samples(texts: List[str],
+                   labels: List[str],
+                   seen: Set[str],
+                   replay: float = 1.0,
+                   seed: int = 0) -> Tuple[List[int], List[int]]:
+    '''Select new annotations and replayed seen ones.
+
+    Args
+    ----
+    texts : list of str
+        annotated messages
+    labels : list of str
+        labels of the messages
+    seen : set of str
+        hashes of the annotations already trained on
+    replay : float, optional
+        number of replayed seen annotations per new annotation.
+        Default is 1.0.
+    seed : int, optional
+        seed of the replay sampling.
+        Default is 0.
+
+    Returns
+    -------
+    list of int
+        indices of the new annotations
+    list of int
+        indices of the replayed annotations
+    '''
+    new, old = [], []
+    for i, (text, label) in enumerate(zip(texts, labels)):
+        (old if annotation_hash(text, label) in seen else new).append(i)
+
+    count = min(int(round(replay * len(new))), len(old))
+    replayed = np.random.default_rng(seed).choice(old, count, replace=False).tolist() if count else []
+    return new, replayed
+
+
+def incremental_retrain(folder: str,
+                        token_model: str = 'camembert-base',
+                        sentiment_model: str = 'tblard/tf-allocine',
+                        config: Optional[Dict[str, Any]] = None
+                        ) -> Optional[TFCamembertForSequenceClassification]:
+    '''Update the exported model with annotations added since its training.
+
+    If no model was exported yet, training starts from sentiment_model and
+    every annotation is new.
+
+    Args
+    ----
+    folder : str
+        folder containing the annotated CSVs (or stores), such as data/annotated
+    token_model : str, optional
+        Model used for tokenisation.
+        Default is 'camembert-base'.
+    sentiment_model : str, optional
+        Model used when no model was exported yet.
+        Default is 'tblard/tf-allocine'.
+    config : dict, optional
+        training configuration (see config/train.yaml). If None, default values are used.
+        Default is None.
+
+    Returns
+    -------
+    TFCamembertForSequenceClassification or None
+        updated model, also saved in the output folder. None if there is no new annotation.
+    '''
+    config = config or load_train_config()
+    params, data, incremental = config['training'], config['data'], config['incremental']
+    output = config['output']
+    seenfile = os.path.join(output, 'seen.json')
+
+    annotations = merge_information(folder)
+    texts = annotations['sequence'].to_list()
+    labels = annotations['label'].to_list()
+
+    warm = os.path.isfile(os.path.join(output, 'config.json'))
+    seen = read_seen(seenfile) if warm else set()
+    new, replayed = select_samples(texts, labels, seen, incremental['replay'], params['seed'])
+    if not new:
+        print('No new annotation in {}'.format(folder))
+        return None
+    print('{} new annotations, {} replayed, starting from {}'.format(
+        len(new), len(replayed), output if warm else sentiment_model))
+
+    indices = new + replayed
+    # Same label encoding as get_split
+    sample_texts = [texts[i] for i in indices]
+    sample_labels = [0 if labels[i] == 'negative' else 1 for i in indices]
+    train_texts, val_texts, train_labels, val_labels = train_test_split(
+        sample_texts, sample_labels, test_size=params['validation'], random_state=params['seed'])
+
+    train_shards = EncodedShards(encode_split(train_texts, train_labels, token_model, data['cache']))
+    val_shards = EncodedShards(encode_split(val_texts, val_labels, token_model, data['cache']))
+
+    max_length = length_percentile(train_shards, data['length_percentile'])
+    boundaries = bucket_boundaries(np.minimum(train_shards.lengths(), max_length), data['buckets'])
+    train_dataset = bucketed_dataset(train_shards, params['train_batch_size'], max_length,
+                                     boundaries, data['shuffle'], params['seed'])
+    val_dataset = bucketed_dataset(val_shards, params['eval_batch_size'], max_length, boundaries)
+
+    steps = -(-len(train_shards) // params['train_batch_size']) + len(boundaries)
+    model = TFCamembertForSequenceClassification.from_pretrained(output if warm else sentiment_model)
+    optimizer, _ = create_optimizer(
+        init_lr=incremental['learning_rate'],
+        num_train_steps=steps * incremental['epochs'],
+        num_warmup_steps=0,
+        weight_decay_rate=params['weight_decay'])
+    compile_model(model, optimizer, config['performance']['xla'])
+
+    callbacks = []
+    if params['patience']:
+        callbacks.append(tf.keras.callbacks.EarlyStopping(
+            monitor='val_loss', patience=params['patience'], min_delta=params['min_delta'],
+            restore_best_weights=True))
+    model.fit(train_dataset, validation_data=val_dataset,
+              epochs=incremental['epochs'], callbacks=callbacks)
+
+    model.save_pretrained(output)
+    seen.update(annotation_hash(texts[i], labels[i]) for i in new)
+    write_seen(seenfile, seen)
+
+    return model
+
+
+def iter_pool(pool: str,
+              exclude: Set[str]) -> Iterator[Dict[str, Any]]:
+    '''Yields unlabeled messages of a folder, once per normalized message.
+
+    Args
+    ----
+    pool : str
+        folder, file or glob pattern of JSON files or stores
+    exclude : set of str
+        normalized messages to skip, such as annotated ones
+
+    Returns
+    -------
+    iterator of dict
+        messages structured as dictionary
+    '''
+    exclude = set(exclude)
+    for path in find_files(pool, ('.json', '.jsonl') + STORE_EXTENSIONS):
+        for elem in read_messages(path):
+            text = normalize_message(elem.get('message') or '')
+            if text and text not in exclude:
+                exclude.add(text)
+                yield elem
+
+
+def predict_probabilities(model: TFCamembertForSequenceClassification,
+                          tokenizer: CamembertTokenizerFast,
+                          texts: List[str],
+                          batch_size: int = 64) -> np.ndarray:
+    '''Returns the label probabilities of messages.
+
+    Messages are batched by length so that batches are barely padded.
+
+    Args
+    ----
+    model : TFCamembertForSequenceClassification
+        model to run
+    tokenizer : CamembertTokenizerFast
+        tokenizer of the model
+    texts : list of str
+        messages
+    batch_size : int, optional
+        number of messages per batch.
+        Default is 64.
+
+    Returns
+    -------
+    np.ndarray
+        probabilities of each label, one row per message
+    '''
+    probs = np.zeros((len(texts), model.config.num_labels), dtype=np.float32)
+    order = np.argsort([len(x) for x in texts], kind='stable')
+
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        encodings = tokenizer([texts[i] for i in batch], truncation=True,
+                              padding=True, return_tensors='tf')
+        logits = model(encodings).logits
+        probs[batch] = tf.nn.softmax(logits, axis=-1).numpy()
+
+    return probs
+
+
+def next_annotation_batch(folder: str,
+                          token_model: str = 'camembert-base',
+                          config: Optional[Dict[str, Any]] = None) -> int:
+    '''Write the most uncertain unlabeled messages in a CSV to annotate.
+
+    Uncertainty is the margin between the 2 most likely labels: the smaller,
+    the more uncertain. Messages already annotated in folder, or identical once
+    normalized to another candidate, are skipped.
+
+    Args
+    ----
+    folder : str
+        folder containing the annotated CSVs (or stores)
+    token_model : str, optional
+        Model used for tokenisation.
+        Default is 'camembert-base'.
+    config : dict, optional
+        training configuration (see config/train.yaml). If None, default values are used.
+        Default is None.
+
+    Returns
+    -------
+    int
+        number of messages written
+    '''
+    config = config or load_train_config()
+    incremental = config['incremental']
+
+    annotated = {normalize_message(x) for x in merge_information(folder)['sequence'].to_list()}
+    candidates = list(iter_pool(incremental['pool'], annotated))
+    if not candidates:
+        print('No unlabeled message in {}'.format(incremental['pool']))
+        return 0
+
+    model = TFCamembertForSequenceClassification.from_pretrained(config['output'])
+    tokenizer = CamembertTokenizerFast.from_pretrained(token_model)
+    probs = predict_probabilities(model, tokenizer, [x['message'] for x in candidates],
+                                  config['training']['eval_batch_size'])
+
+    top = np.sort(probs, axis=-1)
+    margins = top[:, -1] - top[:, -2]
+    ranking = np.argsort(margins, kind='stable')[:incremental['batch']]
+
+    os.makedirs(os.path.dirname(incremental['next_batch']) or '.', exist_ok=True)
+    with open(incremental['next_batch'], 'w', encoding='utf-8', newline='') as f:
+        # Same layout as annotated CSVs, with an empty label to fill
+        csvwriter = csv.writer(f, delimiter=';')
+        csvwriter.writerow(['message', 'model label', 'model score', 'uncertainty', 'label'])
+        for i in ranking:
+            label = model.config.id2label[int(probs[i].argmax())].lower()
+            csvwriter.writerow([candidates[i]['message'], label,
+                                '{:.4f}'.format(top[i, -1]), '{:.4f}'.format(1 - margins[i]), ''])
+
+    print('{} messages to annotate written in {} (out of {} candidates)'.format(
+        len(ranking), incremental['next_batch'], len(candidates)))
+    return len(ranking)
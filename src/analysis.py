@@ -3,10 +3,15 @@
 import json
 from typing import List, Tuple
 
+import numpy as np
+import tensorflow as tf
 from tqdm import tqdm
 from transformers import (AutoTokenizer, TFAutoModelForSequenceClassification,
                           pipeline)
 
+from .format import iter_json_array
+from .store import (is_store, iter_store, model_names, store_columns,
+                    write_store)
 
 
 class SentimentAnalyzer():
@@ -25,17 +30,33 @@ class SentimentAnalyzer():
         'neutral' as a label.
     nlp : Model
         the actual sentiment analysis model
+    xla : bool
+        if True, messages are analyzed by an XLA-compiled forward pass instead of the pipeline
+    forward : tf.function
+        XLA-compiled forward pass of the model, if xla is True
     '''
+    # Token lengths messages are padded to with XLA. Each one is compiled once.
+    LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
 
     def __init__(self,
                  version: int = 0,
-                 threshold: float = 0.6666) -> None:
+                 threshold: float = 0.6666,
+                 xla: bool = False) -> None:
         '''Initialization
         '''
         self.version = version
         self.threshold = threshold
+        self.xla = xla
         self.select_model()
 
+        if self.xla and not isinstance(self.nlp.model, tf.keras.Model):
+            print('XLA is only available for TensorFlow models: {} runs without it'.format(self.name))
+            self.xla = False
+        if self.xla:
+            self.forward = tf.function(
+                lambda ids, mask: self.nlp.model(input_ids=ids, attention_mask=mask).logits,
+                jit_compile=True)
+
     def select_model(self):
         '''Returns a sentiment analysis model.
 
@@ -65,7 +86,8 @@ class SentimentAnalyzer():
         # Default settings
         elif self.version == 1:
             self.name = 'default'
-            self.nlp = pipeline("sentiment-analysis")
+            # TensorFlow model, even if PyTorch is installed too
+            self.nlp = pipeline("sentiment-analysis", framework='tf')
 
     def analyze(self,
                 msg: str) -> Tuple[float, str]:
@@ -86,6 +108,9 @@ class SentimentAnalyzer():
             0 means using CamemBERT model, 1 is the default pipeline for sentiment-analysis.
             Defaults is 0.
         '''
+        if self.xla:
+            return self.analyze_batch([msg])[0]
+
         result = self.nlp(msg)[0]
 
         score = result['score']
@@ -93,20 +118,101 @@ class SentimentAnalyzer():
 
         return score, label.lower()
 
+    def analyze_batch(self,
+                      msgs: List[str]) -> List[Tuple[float, str]]:
+        '''Runs the sentiment-analysis pipeline on several messages at once.
+
+        Args
+        ----
+        msgs : list of str
+            messages to analyze
+
+        Returns
+        -------
+        list of tuple
+            score and label of each message
+        '''
+        if self.xla:
+            return self.analyze_compiled(msgs)
+
+        results = []
+        for result in self.nlp(msgs):
+            score = result['score']
+            label = 'NEUTRAL' if score < self.threshold else result['label']
+            results.append((score, label.lower()))
+
+        return results
+
+    def analyze_compiled(self,
+                         msgs: List[str]) -> List[Tuple[float, str]]:
+        '''Runs the XLA-compiled model on several messages at once.
+
+        Messages are padded to the smallest length bucket holding the longest
+        one, so that XLA only compiles one graph per bucket.
+
+        Args
+        ----
+        msgs : list of str
+            messages to analyze
+
+        Returns
+        -------
+        list of tuple
+            score and label of each message, as analyze_batch
+        '''
+        tokenizer = self.nlp.tokenizer
+        limit = min(tokenizer.model_max_length, self.LENGTH_BUCKETS[-1])
+        longest = max(len(x) for x in tokenizer(msgs, truncation=True, max_length=limit)['input_ids'])
+        length = next(x for x in self.LENGTH_BUCKETS if x >= longest)
+
+        encodings = tokenizer(msgs, truncation=True, max_length=length,
+                              padding='max_length', return_tensors='np')
+        logits = self.forward(tf.constant(encodings['input_ids'], tf.int32),
+                              tf.constant(encodings['attention_mask'], tf.int32)).numpy()
+
+        probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probs /= probs.sum(axis=-1, keepdims=True)
+
+        results = []
+        for prob in probs:
+            score = float(prob.max())
+            label = self.nlp.model.config.id2label[int(prob.argmax())]
+            label = 'NEUTRAL' if score < self.threshold else label
+            results.append((score, label.lower()))
+
+        return results
+
 
 def analyze_file(srcfile: str,
                  version: int = 0,
-                 threshold: float = 0.6666) -> None:
+                 threshold: float = 0.6666,
+                 outfile: str = '',
+                 xla: bool = False) -> None:
     '''Analyze a messages in a JSON file.
 
+    If the source or the output is a columnar store (.parquet or .arrow),
+    messages are streamed from the source and written in the store by batches.
+
     Args
     ----
     srcfile : file
         path to the file to analyze
     version : int
         version
+    threshold : float
+        threshold for neutral label
+    outfile : str, optional
+        path to the output file. If empty, the source file is updated.
+        Default is ''.
+    xla : bool, optional
+        if True, the model is compiled with XLA.
+        Default is False.
     '''
-    analyzer = SentimentAnalyzer(version, threshold)
+    analyzer = SentimentAnalyzer(version, threshold, xla)
+
+    if is_store(srcfile) or is_store(outfile):
+        analyze_store(analyzer, srcfile, outfile or srcfile)
+        return
 
     with open(srcfile, 'r') as f:
         data = json.load(f)
@@ -124,10 +230,42 @@ def analyze_file(srcfile: str,
                 }
             })
 
-            with open(srcfile, 'w') as f:
+            with open(outfile or srcfile, 'w') as f:
                 json.dump(data, f, indent=4)
 
 
+def analyze_store(analyzer: SentimentAnalyzer,
+                  srcfile: str,
+                  outfile: str) -> None:
+    '''Analyze messages of a JSON file or a store into a store.
+
+    Args
+    ----
+    analyzer : SentimentAnalyzer
+        model to analyze messages with
+    srcfile : str
+        JSON file or store to analyze
+    outfile : str
+        store to write messages and their analysis to
+    '''
+    records = iter_store(srcfile) if is_store(srcfile) else iter_json_array(srcfile)
+
+    def analyzed():
+        for elem in tqdm(records):
+            if 'message' in elem and analyzer.name not in elem:
+                score, label = analyzer.analyze(elem['message'])
+                elem[analyzer.name] = {'label': label, 'score': score}
+            yield elem
+
+    # Models of the source are kept along the new one
+    models = None
+    if is_store(srcfile):
+        models = [x for x in model_names(store_columns(srcfile))
+                  if x != analyzer.name] + [analyzer.name]
+
+    write_store(analyzed(), outfile, models)
+
+
 def get_tokens(sentence,
                model="tblard/tf-allocine") -> List[str]:
     '''Returns token of a given sentence using specific model.
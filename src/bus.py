@@ -0,0 +1,191 @@
+'''Local publish / subscribe bus of analyzed frames, over UDP multicast.
+
+One analysis node (ronde.py --publish) publishes each displayed frame. Any
+number of renderers (renderer.py), on the same host or on the local network,
+subscribe to the same multicast group and show the same frames, without
+loading any model.
+
+Each frame is a JSON datagram:
+    {"session": <id>, "seq": <n>, "time": <publication time>, "msg": ...,
+     "pseudo": ..., "fg": ..., "bg": ..., "label": ..., "score": ...}
+
+The session is a random id of the publisher, so a restarted publisher is
+recognized even if its first frames are lost.
+
+This module only uses the standard library, so renderers stay light.
+'''
+import json
+import os
+import socket
+import struct
+import time
+from typing import Any, Dict, Iterator, Optional
+
+DEFAULT_BUS: Dict[str, Any] = {
+    'group': '239.255.42.99',
+    'port': 5005,
+    'ttl': 1,
+}
+
+# Largest payload of a datagram, longer messages are cut
+MAX_DATAGRAM = 65000
+
+
+class Publisher():
+    '''Publishes frames to a multicast group.
+
+    Attributes
+    ----------
+    address : tuple
+        multicast group and port
+    sock : socket.socket
+        UDP socket
+    session : str
+        random id of the publisher, changing when it restarts
+    seq : int
+        sequence number of the last frame published
+    '''
+
+    def __init__(self,
+                 config: Optional[Dict[str, Any]] = None) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        config : dict, optional
+            'bus' section of the configuration, with 'group', 'port' and 'ttl' keys.
+            If None, default values are used.
+            Default is None.
+        '''
+        config = {**DEFAULT_BUS, **(config or {})}
+        self.address = (config['group'], config['port'])
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # TTL of 1 keeps frames on the local network
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, config['ttl'])
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.session = os.urandom(8).hex()
+        self.seq = 0
+
+    def publish(self,
+                msg: str,
+                pseudo: str,
+                fg: Any,
+                bg: Any,
+                label: str,
+                score: float) -> None:
+        '''Publish a frame.
+
+        Args
+        ----
+        msg : str
+            message
+        pseudo : str
+            pseudo of the message's author
+        fg : str or Color
+            text color
+        bg : str or Color
+            background color
+        label : str
+            label of the message
+        score : float
+            score of the message
+        '''
+        self.seq += 1
+        frame = {'session': self.session, 'seq': self.seq, 'time': time.time(), 'msg': msg,
+                 'pseudo': pseudo, 'fg': str(fg), 'bg': str(bg), 'label': label, 'score': float(score)}
+        data = json.dumps(frame, ensure_ascii=False).encode('utf8')
+        while len(data) > MAX_DATAGRAM and frame['msg']:
+            # Cut in proportion of its encoded size, escaped characters included, at a UTF-8 boundary
+            raw = frame['msg'].encode('utf8')
+            encoded = len(json.dumps(frame['msg'], ensure_ascii=False).encode('utf8'))
+            keep = int(len(raw) * (1 - (len(data) - MAX_DATAGRAM) / encoded))
+            frame['msg'] = raw[:max(keep, 0)].decode('utf8', errors='ignore')
+            data = json.dumps(frame, ensure_ascii=False).encode('utf8')
+        try:
+            self.sock.sendto(data, self.address)
+        except OSError as e:
+            # No route to the group, such as without network: frames are lost, display goes on
+            print('Frame not published: {}'.format(e))
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class Subscriber():
+    '''Receives frames published to a multicast group.
+
+    Frames older than the last one received (reordered datagrams) are skipped.
+    A frame of another session means the publisher restarted: sequence numbers
+    start again.
+
+    Attributes
+    ----------
+    sock : socket.socket
+        UDP socket, member of the multicast group
+    session : str or None
+        session of the last frame received
+    seq : int
+        sequence number of the last frame received
+    '''
+
+    def __init__(self,
+                 config: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None) -> None:
+        '''Join the multicast group.
+
+        Args
+        ----
+        config : dict, optional
+            'bus' section of the configuration, with 'group' and 'port' keys.
+            If None, default values are used.
+            Default is None.
+        timeout : float, optional
+            maximal wait (in seconds) for a frame. If None, receive blocks.
+            Default is None.
+        '''
+        config = {**DEFAULT_BUS, **(config or {})}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # Several renderers can listen on the same host
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(('', config['port']))
+
+        membership = struct.pack('4s4s', socket.inet_aton(config['group']), socket.inet_aton('0.0.0.0'))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.sock.settimeout(timeout)
+        self.session: Optional[str] = None
+        self.seq = 0
+
+    def receive(self) -> Optional[Dict[str, Any]]:
+        '''Returns the next frame, or None if the timeout expired.
+        '''
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM + 1)
+            except socket.timeout:
+                return None
+
+            try:
+                frame = json.loads(data.decode('utf8'))
+            except ValueError:
+                continue
+
+            if frame.get('session') != self.session:
+                self.session = frame.get('session')
+                self.seq = 0
+            if frame.get('seq', 0) > self.seq:
+                self.seq = frame['seq']
+                return frame
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        '''Yields frames as they are received. Stops when the timeout expires.
+        '''
+        while True:
+            frame = self.receive()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self) -> None:
+        self.sock.close()
@@ -0,0 +1,200 @@
+'''Single command line of La Ronde de Nuit: python ronde.py <command> [args].
+
+Each command runs one of the scripts of the repository, which is only imported
+when its command is run: tools which never touch a model, such as conversion
+or capture, do not load TensorFlow, transformers or torch. Without command,
+ronde.py runs the GUI as before.
+
+With --profile-startup, the command is imported in a new interpreter with
+python -X importtime, without being run, and the import time of each package
+is printed. Modules the command imports later on, such as the model, are
+imported too (see DEFERRED):
+
+    python ronde.py --profile-startup convert
+'''
+import os
+import runpy
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Root of the repository, holding the scripts
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Command run when none is given
+DEFAULT = 'run'
+
+# Flag printing the import time of a command instead of running it
+PROFILE_FLAG = '--profile-startup'
+
+# Script (or module, for the GUI) and description of each command
+COMMANDS: Dict[str, Tuple[str, str]] = {
+    'run': ('src.gui', 'run the GUI or the headless engine (default command)'),
+    'render': ('renderer.py', 'show frames published by another node, without model'),
+    'capture': ('irc_connection.py', 'capture messages of IRC channels'),
+    'harvest': ('irc_harvest.py', 'capture messages of several IRC servers'),
+    'read': ('online_read.py', 'capture messages of an online text file'),
+    'whatsapp': ('whatsapp2json.py', 'convert a WhatsApp export to JSON'),
+    'dedup': ('deduplicate.py', 'deduplicate messages and propagate labels'),
+    'convert': ('convert2csv.py', 'convert JSON messages to CSV'),
+    'ingest': ('ingest.py', 'normalize, deduplicate and analyze any source'),
+    'dataset': ('create_dataset.py', 'create training and test splits'),
+    'analyze': ('analyze_file.py', 'analyze the sentiment of messages'),
+    'train': ('train.py', 'retrain the sentiment analysis model'),
+    'sweep': ('sweep.py', 'sweep training hyperparameters'),
+    'tune': ('tune_performance.py', 'tune the CPU performance profile'),
+    'simulate': ('simulate.py', 'render a recorded source offline'),
+    'loadtest': ('loadtest.py', 'load test with local mock chat servers'),
+    'soak': ('soak.py', 'track memory growth of the headless pipeline'),
+}
+
+# Modules imported by a command once it runs, such as the sentiment analysis model
+DEFERRED: Dict[str, Tuple[str, ...]] = {
+    'run': ('src.performance', 'src.analysis'),
+    'ingest': ('src.analysis',),
+    'dataset': ('sklearn.model_selection',),
+    'sweep': ('src.retrain',),
+    'tune': ('src.analysis', 'src.retrain'),
+    'simulate': ('skimage.io',),
+    'soak': ('src.engine', 'src.gui', 'src.simulate', 'src.analysis'),
+}
+
+
+def describe_commands() -> str:
+    '''Returns the list of commands, for the help of ronde.py.
+    '''
+    lines = ['commands (python ronde.py <command> -h for their arguments):']
+    for name, (_, description) in COMMANDS.items():
+        lines.append('  {:<10} {}'.format(name, description))
+    lines.append('')
+    lines.append('{} before a command prints its import time instead of running it.'.format(PROFILE_FLAG))
+    return '\n'.join(lines)
+
+
+def run_script(name: str,
+               argv: List[str]) -> None:
+    '''Run the script of a command as if it was run directly, with its own arguments.
+    '''
+    script = os.path.join(ROOT, COMMANDS[name][0])
+    sys.argv = [script] + argv
+    runpy.run_path(script, run_name='__main__')
+
+
+def parse_importtime(lines: List[str]) -> List[Tuple[str, int, int, int]]:
+    '''Returns the imports of the output of python -X importtime.
+
+    Returns
+    -------
+    list of tuple
+        name, depth of nested import, self and cumulative time (in us) of each import
+    '''
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # Header line
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), depth, int(fields[0]), int(fields[1])))
+    return imports
+
+
+def import_breakdown(imports: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    '''Returns the import time (in us) of each top-level package, sorted from the slowest.
+
+    Self times are summed, so a package imported by another one is counted on its own.
+    '''
+    packages: Dict[str, int] = {}
+    for name, _, self_time, _ in imports:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_time
+    return dict(sorted(packages.items(), key=lambda x: x[1], reverse=True))
+
+
+def profile_startup(name: str,
+                    top: int = 15) -> int:
+    '''Import a command in a new interpreter with -X importtime and print its import time.
+
+    Deferred modules of the command are imported after it (see DEFERRED).
+
+    Args
+    ----
+    name : str
+        command to profile
+    top : int, optional
+        number of packages printed.
+        Default is 15.
+
+    Returns
+    -------
+    int
+        exit code of the interpreter
+    '''
+    target = COMMANDS[name][0]
+    deferred = DEFERRED.get(name, ())
+    if target.endswith('.py'):
+        # Not run as __main__, so only its imports are executed
+        code = 'import importlib, runpy, sys; runpy.run_path(sys.argv[1], run_name="__startup__"); '
+        target = os.path.join(ROOT, target)
+    else:
+        code = 'import importlib, sys; importlib.import_module(sys.argv[1]); '
+    code += '[importlib.import_module(x) for x in sys.argv[2:]]'
+
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code, target, *deferred],
+                             cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    elapsed = time.perf_counter() - start
+
+    lines = process.stderr.splitlines()
+    imports = parse_importtime(lines)
+    total = sum(x[3] for x in imports if x[1] == 0)
+    packages = import_breakdown(imports)
+
+    print('Startup of {}: {:.3f} s, {:.3f} s of imports ({} modules)'.format(
+        name, elapsed, total / 1e6, len(imports)))
+    if deferred:
+        print('Including modules imported once it runs: {}'.format(', '.join(deferred)))
+    for package, package_time in list(packages.items())[:top]:
+        print('  {:<24} {:8.1f} ms {:5.1f} %'.format(
+            package, package_time / 1000, 100 * package_time / max(total, 1)))
+
+    if process.returncode:
+        # Import errors, such as missing dependencies
+        errors = [x for x in lines if not x.startswith('import time:')]
+        print('\n'.join(errors), file=sys.stderr)
+    return process.returncode
+
+
+def main(argv: List[str],
+         default: Callable[[List[str]], None]) -> None:
+    '''Run the command given by the arguments of ronde.py.
+
+    Args
+    ----
+    argv : list of str
+        arguments of ronde.py, without the script name
+    default : callable
+        function running the GUI with its arguments, for the 'run' command or
+        when no command is given
+    '''
+    profile = PROFILE_FLAG in argv
+    if profile:
+        argv = [x for x in argv if x != PROFILE_FLAG]
+
+    name = DEFAULT
+    if argv and not argv[0].startswith('-'):
+        name = argv.pop(0)
+        if name not in COMMANDS:
+            sys.exit('Unknown command: {}\n\n{}'.format(name, describe_commands()))
+
+    if profile:
+        sys.exit(profile_startup(name))
+    if name == DEFAULT:
+        default(argv)
+    else:
+        run_script(name, argv)
@@ -0,0 +1,404 @@
+'''Typed configuration of La Ronde de Nuit, and reload of its YAML file.
+
+The YAML configuration is parsed into a RondeConfig, whose sections are
+dataclasses checked when loaded: a wrong type or value raises a ConfigError
+naming the key, instead of failing later on a frame.
+
+A ConfigWatcher checks the modification time of the file. Once changed, the
+file is parsed again and only a valid configuration is returned, so a file
+being edited never breaks a running display.
+'''
+import os
+import time
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+from colour import Color
+
+
+class ConfigError(ValueError):
+    '''Raised when a configuration has a missing, mistyped or invalid value.
+    '''
+    pass
+
+
+def _check(condition: bool,
+           key: str,
+           message: str) -> None:
+    '''Raise a ConfigError about key if condition is False.
+    '''
+    if not condition:
+        raise ConfigError('{}: {}'.format(key, message))
+
+
+def _number(value: Any,
+            key: str,
+            kind: type = float) -> Any:
+    '''Returns value as an int or a float, raising a ConfigError if it is not a number.
+    '''
+    _check(isinstance(value, (int, float)) and not isinstance(value, bool),
+           key, 'expected a number, got {!r}'.format(value))
+    if kind is int:
+        _check(float(value).is_integer(), key, 'expected an integer, got {!r}'.format(value))
+    return kind(value)
+
+
+def _bool(value: Any,
+          key: str) -> bool:
+    '''Returns value, raising a ConfigError if it is not a boolean.
+    '''
+    _check(isinstance(value, bool), key, 'expected True or False, got {!r}'.format(value))
+    return value
+
+
+def _colors(value: Any,
+            key: str) -> List[str]:
+    '''Returns a color or a list of colors as a list, raising a ConfigError on unknown colors.
+    '''
+    values = [value] if isinstance(value, str) else value
+    _check(isinstance(values, list) and len(values) > 0, key, 'expected a color or a list of colors')
+    for color in values:
+        try:
+            Color(color)
+        except (ValueError, AttributeError, TypeError):
+            raise ConfigError('{}: unknown color {!r}'.format(key, color))
+    return list(values)
+
+
+@dataclass
+class ColorsConfig():
+    '''Colors section: text (fg) and background (bg) colors, from positive to negative.
+    '''
+    fg: List[str]
+    bg: List[str]
+
+    def __post_init__(self) -> None:
+        self.fg = _colors(self.fg, 'colors.fg')
+        self.bg = _colors(self.bg, 'colors.bg')
+
+
+@dataclass
+class ManagerConfig():
+    '''Manager section: color transitions and reads of the source.
+
+    Delays are in ms, except report which is in seconds.
+    '''
+    steps: int = 100
+    transition: float = 10
+    toLoop: bool = False
+    last_messages: int = -1
+    poll_min: float = 500
+    poll_max: float = 30000
+    backoff: float = 2.0
+    queue: int = 64
+    report: float = 0
+
+    def __post_init__(self) -> None:
+        self.steps = _number(self.steps, 'manager.steps', int)
+        self.transition = _number(self.transition, 'manager.transition')
+        self.toLoop = _bool(self.toLoop, 'manager.toLoop')
+        self.last_messages = _number(self.last_messages, 'manager.last_messages', int)
+        self.poll_min = _number(self.poll_min, 'manager.poll_min')
+        self.poll_max = _number(self.poll_max, 'manager.poll_max')
+        self.backoff = _number(self.backoff, 'manager.backoff')
+        self.queue = _number(self.queue, 'manager.queue', int)
+        self.report = _number(self.report, 'manager.report')
+
+        _check(self.steps >= 0, 'manager.steps', 'should be positive or 0')
+        _check(self.transition >= 0, 'manager.transition', 'should be positive or 0')
+        _check(self.last_messages >= -1, 'manager.last_messages', 'should be -1 or more')
+        _check(self.poll_min > 0, 'manager.poll_min', 'should be positive')
+        _check(self.poll_max >= self.poll_min, 'manager.poll_max', 'should be at least poll_min')
+        _check(self.backoff >= 1, 'manager.backoff', 'should be at least 1')
+        _check(self.queue > 0, 'manager.queue', 'should be positive')
+        _check(self.report >= 0, 'manager.report', 'should be positive or 0')
+
+
+@dataclass
+class DisplayConfig():
+    '''Display section: what the window shows.
+    '''
+    colors: bool = True
+    text: bool = False
+
+    def __post_init__(self) -> None:
+        self.colors = _bool(self.colors, 'display.colors')
+        self.text = _bool(self.text, 'display.text')
+
+
+@dataclass
+class PrintConfig():
+    '''Print section: what is printed in the command line.
+    '''
+    text: bool = True
+    mode: str = 'demo'
+
+    def __post_init__(self) -> None:
+        self.text = _bool(self.text, 'print.text')
+        _check(self.mode in ('demo', 'debug'), 'print.mode', 'should be demo or debug')
+
+
+@dataclass
+class ModelsConfig():
+    '''Models section: sentiment analysis model.
+    '''
+    version: int = 0
+    threshold: float = 0.66
+
+    def __post_init__(self) -> None:
+        self.version = _number(self.version, 'models.version', int)
+        self.threshold = _number(self.threshold, 'models.threshold')
+        _check(self.version in (0, 1), 'models.version', 'should be 0 or 1')
+        _check(0 <= self.threshold <= 1, 'models.threshold', 'should be between 0 and 1')
+
+
+@dataclass
+class MidiConfig():
+    '''MIDI section: output ports and control change numbers.
+    '''
+    nb_port: int = 1
+    label_cc_nb: int = 10
+    score_int_cc_nb: int = 11
+    score_float_cc_nb: int = 12
+
+    def __post_init__(self) -> None:
+        for f in fields(self):
+            key = 'midi.' + f.name
+            value = _number(getattr(self, f.name), key, int)
+            _check(0 <= value <= 127, key, 'should be between 0 and 127')
+            setattr(self, f.name, value)
+
+
+@dataclass
+class OscConfig():
+    '''OSC section: receiving hosts and color stream rate (in Hz).
+    '''
+    ip: List[str] = field(default_factory=lambda: ['127.0.0.1'])
+    port: List[int] = field(default_factory=lambda: [5000])
+    stream: float = 0
+
+    def __post_init__(self) -> None:
+        _check(isinstance(self.ip, list) and all(isinstance(x, str) for x in self.ip),
+               'osc.ip', 'expected a list of addresses')
+        _check(isinstance(self.port, list), 'osc.port', 'expected a list of ports')
+        self.port = [_number(x, 'osc.port', int) for x in self.port]
+        _check(len(self.ip) == len(self.port), 'osc.port', 'should have as many ports as osc.ip addresses')
+        self.stream = _number(self.stream, 'osc.stream')
+        _check(self.stream >= 0, 'osc.stream', 'should be positive or 0')
+
+
+@dataclass
+class BusConfig():
+    '''Bus section: multicast group frames are published on (see src.bus).
+    '''
+    group: str = '239.255.42.99'
+    port: int = 5005
+    ttl: int = 1
+
+    def __post_init__(self) -> None:
+        _check(isinstance(self.group, str), 'bus.group', 'expected an address')
+        self.port = _number(self.port, 'bus.port', int)
+        self.ttl = _number(self.ttl, 'bus.ttl', int)
+
+
+@dataclass
+class PerformanceConfig():
+    '''Performance section: CPU settings (see src.performance).
+    '''
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    xla: bool = False
+    cpus: List[int] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.intra_op_threads = _number(self.intra_op_threads, 'performance.intra_op_threads', int)
+        self.inter_op_threads = _number(self.inter_op_threads, 'performance.inter_op_threads', int)
+        self.xla = _bool(self.xla, 'performance.xla')
+        _check(isinstance(self.cpus, list), 'performance.cpus', 'expected a list of CPUs')
+        self.cpus = [_number(x, 'performance.cpus', int) for x in self.cpus]
+
+
+@dataclass
+class MetricsConfig():
+    '''Metrics section: local endpoint and summary of pipeline metrics (see src.metrics).
+    '''
+    port: int = 0
+    summary: float = 0
+
+    def __post_init__(self) -> None:
+        self.port = _number(self.port, 'metrics.port', int)
+        self.summary = _number(self.summary, 'metrics.summary')
+        _check(0 <= self.port < 65536, 'metrics.port', 'should be a port, or 0')
+        _check(self.summary >= 0, 'metrics.summary', 'should be positive or 0')
+
+
+# Sections of a RondeConfig, with their class. Sections with a default value may be missing.
+SECTIONS = {
+    'colors': ColorsConfig,
+    'manager': ManagerConfig,
+    'display': DisplayConfig,
+    'print': PrintConfig,
+    'models': ModelsConfig,
+    'midi': MidiConfig,
+    'osc': OscConfig,
+    'bus': BusConfig,
+    'performance': PerformanceConfig,
+    'metrics': MetricsConfig,
+}
+REQUIRED = ('colors', 'manager', 'display', 'print', 'models', 'midi', 'osc')
+
+# Sections which are only read when the process starts
+RESTART_SECTIONS = ('bus', 'performance', 'metrics')
+
+
+@dataclass
+class RondeConfig():
+    '''Configuration of La Ronde de Nuit.
+
+    Attributes
+    ----------
+    colors, manager, display, print, models, midi, osc, bus, performance, metrics
+        sections of the configuration
+    raw : dict
+        configuration as read from the YAML file, for functions taking a dictionary
+    '''
+    colors: ColorsConfig
+    manager: ManagerConfig
+    display: DisplayConfig
+    print: PrintConfig
+    models: ModelsConfig
+    midi: MidiConfig
+    osc: OscConfig
+    bus: BusConfig
+    performance: PerformanceConfig
+    metrics: MetricsConfig
+    raw: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def from_dict(cls,
+                  config: Dict[str, Any]) -> 'RondeConfig':
+        '''Build and check a configuration from a dictionary.
+
+        Raises
+        ------
+        ConfigError
+            if a section or a value is missing or invalid
+        '''
+        if not isinstance(config, dict):
+            raise ConfigError('configuration should be a mapping of sections')
+
+        sections = {}
+        for name, section in SECTIONS.items():
+            values = config.get(name)
+            if values is None:
+                _check(name not in REQUIRED, name, 'missing section')
+                values = {}
+            _check(isinstance(values, dict), name, 'expected a mapping')
+
+            known = {f.name for f in fields(section)}
+            unknown = set(values) - known
+            _check(not unknown, name, 'unknown keys {}'.format(sorted(unknown)))
+            try:
+                sections[name] = section(**values)
+            except TypeError as e:
+                raise ConfigError('{}: {}'.format(name, e))
+
+        return cls(raw=config, **sections)
+
+    def changed(self,
+                other: 'RondeConfig') -> Tuple[str, ...]:
+        '''Returns the names of the sections which differ from another configuration.
+        '''
+        return tuple(name for name in SECTIONS if getattr(self, name) != getattr(other, name))
+
+
+def load_config(path: str) -> RondeConfig:
+    '''Load and check a YAML configuration.
+
+    Args
+    ----
+    path : str
+        path to the YAML configuration
+
+    Returns
+    -------
+    RondeConfig
+        the configuration
+
+    Raises
+    ------
+    ConfigError
+        if the file can not be parsed or the configuration is invalid
+    '''
+    with open(path, 'r') as f:
+        try:
+            config = yaml.load(f, yaml.FullLoader)
+        except yaml.YAMLError as e:
+            raise ConfigError('{}: {}'.format(path, e))
+    return RondeConfig.from_dict(config)
+
+
+class ConfigWatcher():
+    '''Watches a YAML configuration and returns it again once changed.
+
+    The file is only checked (one stat call) once every interval, so check can
+    be called on every frame.
+
+    Attributes
+    ----------
+    path : str
+        path to the YAML configuration
+    interval : float
+        minimal delay (in seconds) between 2 checks of the file
+    mtime : float
+        modification time of the last version read
+    '''
+
+    def __init__(self,
+                 path: str,
+                 interval: float = 1.0) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        path : str
+            path to the YAML configuration
+        interval : float, optional
+            minimal delay (in seconds) between 2 checks of the file.
+            Default is 1.0.
+        '''
+        self.path = path
+        self.interval = interval
+        self.mtime = self.modified()
+        self.checked = time.monotonic()
+
+    def modified(self) -> float:
+        '''Returns the modification time of the file, or 0 if it does not exist.
+        '''
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return 0.0
+
+    def check(self) -> Optional[RondeConfig]:
+        '''Returns the new configuration if the file changed since the last check, None otherwise.
+
+        An invalid configuration is reported and ignored: the current one is
+        kept until the file is fixed.
+        '''
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return None
+        self.checked = now
+
+        mtime = self.modified()
+        if not mtime or mtime == self.mtime:
+            return None
+        self.mtime = mtime
+
+        try:
+            return load_config(self.path)
+        except (ConfigError, OSError) as e:
+            print('Configuration not reloaded, {}'.format(e))
+            return None
@@ -1,13 +1,22 @@
 """Functions related to data online download.
 """
+import asyncio
+import hashlib
+import io
 import json
 import os
-from typing import List, Dict
+import signal
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 import irc.bot
+import irc.client
+import irc.client_aio
 import irc.strings
 import requests
 
+from .format import JsonArrayWriter
+
 
 class IrcBot(irc.bot.SingleServerIRCBot):
     '''Bot to get messages from IRC channels.
@@ -121,22 +130,284 @@ class IrcBot(irc.bot.SingleServerIRCBot):
         print('Messages read in {}: {}'.format(channel, self.index[channel]))
 
 
+class ChannelRates():
+    '''Counts messages per channel to report message rates.
+
+    Attributes
+    ----------
+    total : dict
+        number of messages read per channel since the start
+    window : dict
+        number of messages read per channel since the last report
+    last : float
+        time of the last report
+    '''
+
+    def __init__(self) -> None:
+        self.total: Dict[str, int] = {}
+        self.window: Dict[str, int] = {}
+        self.last = time.monotonic()
+
+    def add(self,
+            channel: str) -> None:
+        '''Count a new message read in a channel.
+
+        Args
+        ----
+        channel : str
+            channel in which the message has been read
+        '''
+        self.total[channel] = self.total.get(channel, 0) + 1
+        self.window[channel] = self.window.get(channel, 0) + 1
+
+    def report(self) -> Dict[str, float]:
+        '''Returns message rates since the last report and resets the window.
+
+        Returns
+        -------
+        dict
+            number of messages per minute for each channel
+        '''
+        now = time.monotonic()
+        elapsed = max(now - self.last, 1e-6)
+        rates = {channel: 60 * count / elapsed
+                 for channel, count in self.window.items()}
+
+        self.window = {channel: 0 for channel in self.window}
+        self.last = now
+        return rates
+
+
+class IrcHarvester():
+    '''Gathers messages from several IRC servers in a single process.
+
+    Every server runs on the same asyncio loop through irc package's AioReactor.
+    Messages from all connections are written into the same JSON file. A lost
+    connection is retried with an exponential backoff.
+
+    Attributes
+    ----------
+    servers : list of dict
+        servers to connect to. Each dictionary should have:
+          - 'host', the name of the server
+          - 'port', the port to connect to
+          - 'channels', the list of channel names to join
+    nickname : str
+        bot name on the servers
+    writer : JsonArrayWriter
+        writer shared by all connections
+    backoff : tuple of float
+        initial and maximal delays (in seconds) between 2 connection attempts
+    report : float
+        time (in seconds) between 2 reports of message rates. No report if 0.
+    rates : ChannelRates
+        message counter per channel
+    '''
+
+    def __init__(self,
+                 servers: List[Dict[str, Any]],
+                 nickname: str,
+                 writer: JsonArrayWriter,
+                 backoff: Optional[Dict[str, float]] = None,
+                 report: float = 60) -> None:
+        '''Initialize the harvester.
+
+        Args
+        ----
+        servers : list of dict
+            servers to connect to with their 'host', 'port' and 'channels'.
+        nickname : str
+            bot name on the servers
+        writer : JsonArrayWriter
+            writer shared by all connections
+        backoff : dict, optional
+            'initial' and 'max' delays (in seconds) between 2 connection attempts.
+            Default is 1 and 300 seconds.
+        report : float, optional
+            time (in seconds) between 2 reports of message rates.
+            Default is 60.
+        '''
+        backoff = backoff or {}
+        self.servers = servers
+        self.nickname = nickname
+        self.writer = writer
+        self.backoff = (backoff.get('initial', 1), backoff.get('max', 300))
+        self.report = report
+        self.rates = ChannelRates()
+
+        irc.client_aio.AioConnection.buffer_class.encoding = "latin-1"
+
+        self.reactor: Optional[irc.client_aio.AioReactor] = None
+        self.connections: Dict[Any, Dict[str, Any]] = {}
+        self.lost: Dict[Any, asyncio.Event] = {}
+        self.delays: Dict[Any, float] = {}
+
+    def on_welcome(self,
+                   c,
+                   e):
+        '''Join the server's channels when logging into it.
+        '''
+        server = self.connections[c]
+        for channel in server['channels']:
+            c.join(channel)
+            print('Logged into {}@{}:{}'.format(
+                channel, server['host'], server['port']))
+
+        # Successful login resets the backoff
+        self.delays[c] = self.backoff[0]
+
+    def on_pubmsg(self,
+                  c,
+                  e):
+        '''Store a message when published on a server.
+        '''
+        channel = e.target.lower()
+        self.writer.append({
+            'message': e.arguments[0],
+            'channel': channel})
+        self.rates.add(channel)
+
+    def on_disconnect(self,
+                      c,
+                      e):
+        '''Wake up the connection task so it reconnects.
+        '''
+        if c in self.lost:
+            self.lost[c].set()
+
+    async def connect(self,
+                      server: Dict[str, Any]) -> None:
+        '''Keeps a connection alive to a server.
+
+        Args
+        ----
+        server : dict
+            server configuration with its 'host', 'port' and 'channels'.
+        '''
+        c = self.reactor.server()
+        self.connections[c] = server
+        self.lost[c] = asyncio.Event()
+        self.delays[c] = self.backoff[0]
+
+        while True:
+            self.lost[c].clear()
+            try:
+                await c.connect(server['host'], server['port'], self.nickname)
+            except (OSError, irc.client.ServerConnectionError) as err:
+                print('Connection to {}:{} failed ({})'.format(
+                    server['host'], server['port'], err))
+            else:
+                await self.lost[c].wait()
+                print('Connection to {}:{} lost'.format(
+                    server['host'], server['port']))
+
+            print('Retrying {}:{} in {}s'.format(
+                server['host'], server['port'], self.delays[c]))
+            await asyncio.sleep(self.delays[c])
+            self.delays[c] = min(2 * self.delays[c], self.backoff[1])
+
+    async def report_rates(self) -> None:
+        '''Print message rates of each channel periodically.
+        '''
+        while True:
+            await asyncio.sleep(self.report)
+            rates = self.rates.report()
+            print('Messages per minute: {} (total: {})'.format(
+                ', '.join('{} {:.1f}'.format(channel, rate)
+                          for channel, rate in sorted(rates.items())) or 'none',
+                self.writer.count))
+
+    async def run(self) -> None:
+        '''Connect to all servers and gather messages until cancelled.
+        '''
+        self.reactor = irc.client_aio.AioReactor(
+            loop=asyncio.get_running_loop())
+        self.reactor.add_global_handler('welcome', self.on_welcome)
+        self.reactor.add_global_handler('pubmsg', self.on_pubmsg)
+        self.reactor.add_global_handler('disconnect', self.on_disconnect)
+
+        try:
+            # Stopped as on Ctrl+C, so the JSON array is closed
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):
+            # Not available on Windows
+            pass
+
+        tasks = [self.connect(server) for server in self.servers]
+        if self.report:
+            tasks.append(self.report_rates())
+
+        await asyncio.gather(*tasks)
+
+    def start(self) -> None:
+        '''Run the harvester until interrupted (Ctrl+C or SIGTERM).
+        '''
+        try:
+            asyncio.run(self.run())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        finally:
+            self.writer.close()
+
+
+class ChunkReader(io.RawIOBase):
+    '''Read-only binary stream over an iterator of bytes chunks.
+
+    It allows a streamed download to be read through io.TextIOWrapper, i.e.
+    with the same decoding and newline handling as a local file.
+    '''
+
+    def __init__(self,
+                 chunks: Iterator[bytes]) -> None:
+        super().__init__()
+        self.chunks = chunks
+        self.pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.pending:
+            self.pending = next(self.chunks, b'')
+            if not self.pending:
+                return 0
+
+        size = min(len(b), len(self.pending))
+        b[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+class FileChangedError(IOError):
+    '''Raised when an online file changes while it is downloaded.
+    '''
+
+
 class OnlineTxtParser():
     '''Class to extract and parse a txt file online.
 
+    The file is streamed by chunks and converted on the fly: it is neither
+    held in memory nor written to a temporary file.
+
     Attributes
     ----------
     url : str
         url to the txt file
-    file : str
-        temporary file to write txt file into
     json : str
         final JSON output file
+    chunk_size : int
+        size (in bytes) of the chunks read from the response
+    retries : int
+        number of times an interrupted download is resumed before giving up
+    offset : int
+        number of bytes of the file received so far
     '''
 
     def __init__(self,
                  url: str,
-                 jsonfile: str = 'output.json') -> None:
+                 jsonfile: str = 'output.json',
+                 chunk_size: int = 1 << 16,
+                 retries: int = 5) -> None:
         '''Initialize the parser with url and json file.
 
         Args
@@ -147,52 +418,123 @@ class OnlineTxtParser():
         json : str, optional
             final JSON output file.
             Default is 'output.json'
+        chunk_size : int, optional
+            size (in bytes) of the chunks read from the response.
+            Default is 64 kB.
+        retries : int, optional
+            number of times an interrupted download is resumed.
+            Default is 5.
         '''
         self.url = url
-        self.file = 'tmp.txt'
         self.json = jsonfile
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.offset = 0
+
+    def download_txt_online(self) -> Iterator[bytes]:
+        '''Download a text file online by chunks.
+
+        An interrupted download is resumed where it stopped using an HTTP Range
+        request. If the server ignores the range, already received bytes are
+        skipped.
+
+        The range is conditioned (If-Range) on the ETag or Last-Modified date of
+        the first response. If the file changed meanwhile, the server sends the
+        whole new file and FileChangedError is raised, as received bytes are
+        from another version.
 
-    def download_txt_online(self) -> None:
-        '''Download a text file online.
+        Returns
+        -------
+        iterator of bytes
+            chunks of the file
         '''
-        r = requests.get(self.url, allow_redirects=True)
-        open(self.file, 'wb').write(r.content)
+        self.offset = 0
+        attempts = 0
+        validator = None
+
+        while True:
+            # Identity encoding keeps offsets consistent with the Range header
+            headers = {'Accept-Encoding': 'identity'}
+            if self.offset:
+                headers['Range'] = 'bytes={}-'.format(self.offset)
+                if validator:
+                    headers['If-Range'] = validator
+
+            try:
+                with requests.get(self.url, headers=headers, stream=True,
+                                  allow_redirects=True, timeout=30) as r:
+                    # Whole file had already been received
+                    if r.status_code == 416:
+                        return
+                    r.raise_for_status()
+
+                    if not self.offset:
+                        # Weak ETags can not be used in If-Range
+                        etag = r.headers.get('ETag', '')
+                        validator = etag if etag and not etag.startswith('W/') else r.headers.get('Last-Modified')
+                    elif r.status_code != 206 and validator:
+                        raise FileChangedError('{} changed during its download'.format(self.url))
+
+                    skip = self.offset if r.status_code != 206 else 0
+                    for chunk in r.iter_content(self.chunk_size):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip -= len(chunk)
+                                continue
+                            chunk, skip = chunk[skip:], 0
+
+                        self.offset += len(chunk)
+                        yield chunk
+                return
+
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as err:
+                attempts += 1
+                if attempts > self.retries:
+                    raise
+                print('Download interrupted after {} bytes ({}), resuming'.format(
+                    self.offset, err))
 
     def read_txt_file(self,
-                      length: int = -1) -> List[Dict[str, str]]:
-        '''Parse txt file.
+                      lines: Iterable[str],
+                      length: int = -1) -> Iterator[Dict[str, str]]:
+        '''Parse lines of a txt file, skipping duplicated lines.
+
+        Lines already read are remembered by their hash only.
 
         Args
         ----
+        lines : iterable of str
+            lines of the txt file
         length : optional, int
             number of messages to extract. If -1, extract all messages.
             Default is -1.
 
         Returns
         -------
-        list of dictionary
-            list of messages structured as dictionary.
+        iterator of dictionary
+            messages structured as dictionary.
         '''
-        result = []
-        msgs = []
-        with open(self.file, 'r', encoding='utf8') as f:
-            line = f.readline()
+        seen = set()
 
-            while line and length:
-                if line and line not in msgs:
-                    result.append({'message': line})
-                    msgs.append(line)
-                    length -= 1
+        for line in lines:
+            if not length:
+                break
 
-                line = f.readline()
-
-        return result
+            key = hashlib.blake2b(line.encode('utf8'), digest_size=16).digest()
+            if key not in seen:
+                seen.add(key)
+                length -= 1
+                yield {'message': line}
 
     def convert_txt_file(self,
                          length: int = -1) -> None:
-        '''Convert txt file to JSON file.
+        '''Convert the online txt file to JSON file.
 
-        Each line of the txt line is a new sentence.
+        Each line of the txt line is a new sentence. Messages are written in
+        the JSON file as soon as they are read. If the file changes during its
+        download, it is converted again from its beginning.
 
         Args
         ----
@@ -200,13 +542,22 @@ class OnlineTxtParser():
             number of messages to extract. If -1, extract all messages.
             Default is -1.
         '''
-        data = self.read_txt_file(length)
-
-        with open(self.json, 'w') as f:
-            json.dump(data, f, indent=4)
+        for attempt in range(self.retries + 1):
+            chunks = ChunkReader(self.download_txt_online())
+            lines = io.TextIOWrapper(io.BufferedReader(chunks), encoding='utf8')
+
+            try:
+                with JsonArrayWriter(self.json, flush_every=1000) as writer:
+                    for data in self.read_txt_file(lines, length):
+                        writer.append(data)
+                return
+            except FileChangedError as err:
+                # Messages of the previous version are overwritten
+                if attempt == self.retries:
+                    raise
+                print('{}, converting it again'.format(err))
 
     def get_online_file(self) -> None:
         '''Download file at url and converts it to JSON file.
         '''
-        self.download_txt_online()
         self.convert_txt_file()
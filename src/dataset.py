@@ -1,9 +1,16 @@
 import glob
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
-import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+import pyarrow as pa
+
+from .store import STORE_EXTENSIONS, is_store, read_store
+
+# Changing how annotations are merged should invalidate cached merges
+CACHE_VERSION = '1'
 
 
 def print_ratio(data: pd.DataFrame,
@@ -40,44 +47,103 @@ def get_statistics(data: pd.DataFrame,
     print_ratio(data, "Negative")
 
 
-def merge_information(path: str) -> pd.DataFrame:
+def read_annotations(path: str) -> pd.DataFrame:
+    '''Read messages and labels of an annotated CSV or store.
+
+    Args
+    ----
+    path : str
+        path to the annotated file
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with message and label columns
+    '''
+    if is_store(path):
+        return read_store(path, ['message', 'label']).to_pandas()
+
+    # CSVs are delimited with semicolumns (;)
+    # CSVs should have message and label columns
+    options = dict(delimiter=';', usecols=['message', 'label'],
+                   dtype={'message': 'string', 'label': 'string'})
+    try:
+        return pd.read_csv(path, engine='pyarrow', **options)
+    except pa.ArrowInvalid:
+        # pyarrow engine does not handle line breaks inside messages
+        return pd.read_csv(path, engine='c', **options)
+
+
+def cache_key(files: List[str]) -> str:
+    '''Returns a key identifying a list of files and their current content.
+
+    Args
+    ----
+    files : list of str
+        paths to the files
+
+    Returns
+    -------
+    str
+        hash of the paths, sizes and modification times of the files
+    '''
+    h = hashlib.sha256(CACHE_VERSION.encode('utf8'))
+    for elem in sorted(files):
+        stat = os.stat(elem)
+        h.update('{}:{}:{}\n'.format(os.path.abspath(elem), stat.st_size,
+                                     stat.st_mtime_ns).encode('utf8'))
+    return h.hexdigest()[:16]
+
+
+def merge_information(path: str,
+                      cache: bool = True) -> pd.DataFrame:
     '''Merge information from csv in the same folder.
 
+    Files are read in parallel. The merged DataFrame is cached in a Parquet file
+    of the folder's .cache directory, which is reused as long as no file is
+    added, removed or modified.
+
     Args
     ----
     path : str
         path to the folder containing all the csv 
+    cache : bool, optional
+        Weither to use the cache.
+        Default is True.
 
     Returns
     -------
     pd.DataFrame
         DataFrame containing the messages and their label from each CSV
     '''
-    # Define lower fonction for an array
-    lower = np.vectorize(str.lower)
+    files = [x for ext in ('.csv',) + STORE_EXTENSIONS
+             for x in glob.glob(os.path.join(path, '*' + ext))]
 
-    # Init columns
-    sequences = []
-    labels = []
+    cachefile = os.path.join(path, '.cache', 'merged-{}.parquet'.format(cache_key(files)))
+    if cache and os.path.isfile(cachefile):
+        return pd.read_parquet(cachefile)
 
-    # CSVs are delimited with semicolumns (;)
-    # CSVs should have message and label columns
-    for elem in glob.glob(os.path.join(path, '*.csv')):
-        data = pd.read_csv(elem, delimiter=';')
-        data = data.dropna()  # Skipped annotation are converted to NaN
-        sequences += data['message'].to_list()
-        labels += data['label'].to_list()
+    with ThreadPoolExecutor(min(32, len(files) or 1)) as executor:
+        frames = list(executor.map(read_annotations, files))
+
+    data = pd.concat(frames, ignore_index=True) if frames else \
+        pd.DataFrame({'message': pd.Series(dtype='string'), 'label': pd.Series(dtype='string')})
+    data = data.dropna()  # Skipped annotation are converted to NaN
 
     # Create the dataframe
-    df = pd.DataFrame()
-    df.insert(0, 'label', lower(labels))
-    df.insert(0, 'sequence', sequences)
+    df = pd.DataFrame({'sequence': data['message'].to_numpy(),
+                       'label': data['label'].str.strip().str.lower().to_numpy()})
+
+    if cache:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        df.to_parquet(cachefile, index=False)
     return df
 
 
 def create_csv_splits(data: pd.DataFrame,
                       path: str,
-                      test_ratio: float = 0.3) -> None:
+                      test_ratio: float = 0.3,
+                      fmt: str = 'csv') -> None:
     '''Create CSV files for training and testing.
 
     Args
@@ -89,18 +155,29 @@ def create_csv_splits(data: pd.DataFrame,
     test_ratio : float, optional
         percentage of data that will be used for testing.
         Default is 0.3.
+    fmt : str, optional
+        format of the splits. Can either be 'csv' or 'parquet'.
+        Default is 'csv'.
     '''
+    # Imported here as it is the slowest import, only needed for splits
+    from sklearn.model_selection import train_test_split
     train, test = train_test_split(data, test_size=test_ratio)
 
     os.makedirs(path, exist_ok=True)
-    train.to_csv(os.path.join(path, 'train.csv'), index=False)
-    test.to_csv(os.path.join(path, 'test.csv'), index=False)
+    if fmt == 'parquet':
+        train.to_parquet(os.path.join(path, 'train.parquet'), index=False)
+        test.to_parquet(os.path.join(path, 'test.parquet'), index=False)
+    else:
+        train.to_csv(os.path.join(path, 'train.csv'), index=False)
+        test.to_csv(os.path.join(path, 'test.csv'), index=False)
 
 
 def create_dataset(infolder: str,
                    outfolder: str,
                    test_ratio: float = 0.3,
-                   verbose: bool = True) -> None:
+                   verbose: bool = True,
+                   fmt: str = 'csv',
+                   cache: bool = True) -> None:
     '''Creates a dataset of retraining based on annotated CSVs.
 
     Args
@@ -115,21 +192,58 @@ def create_dataset(infolder: str,
     verbose : bool, optional
         Weither to show additional information while running.
         Default is True.
+    fmt : str, optional
+        format of the splits. Can either be 'csv' or 'parquet'.
+        Default is 'csv'.
+    cache : bool, optional
+        Weither to reuse the merged annotations of a previous run.
+        Default is True.
     '''
-    data = merge_information(infolder)
+    data = merge_information(infolder, cache)
     if verbose:
         get_statistics(data)
 
-    create_csv_splits(data, outfolder, test_ratio)
+    create_csv_splits(data, outfolder, test_ratio, fmt)
+
+
+def find_split(folder: str,
+               name: str) -> str:
+    '''Returns the path to a split, whatever its format.
+
+    Args
+    ----
+    folder : str
+        folder containing the splits
+    name : str
+        name of the split, such as 'train' or 'test'
+
+    Returns
+    -------
+    str
+        path to the split. CSV is the default if no file is found.
+    '''
+    for ext in STORE_EXTENSIONS:
+        path = os.path.join(folder, name + ext)
+        if os.path.isfile(path):
+            return path
+    return os.path.join(folder, name + '.csv')
+
+
+def read_split(path: str) -> pd.DataFrame:
+    '''Read a split from a CSV file or a store, with its 'sequence' and 'label' columns.
+    '''
+    if is_store(path):
+        return read_store(path, ['sequence', 'label']).to_pandas()
+    return pd.read_csv(path)
 
 
 def get_split(path):
-    '''Get a split from a CSV file.
+    '''Get a split from a CSV file or a store.
 
     Args
     ----
     path : str
-        path to the CSV file
+        path to the CSV file or the store
 
     Returns
     -------
@@ -139,7 +253,7 @@ def get_split(path):
     texts = []
     labels = []
 
-    data = pd.read_csv(path)
+    data = read_split(path)
     data.loc[data['label'] != 'neutral']
     texts = data['sequence'].to_list()
     labels = [0 if x == 'negative' else 1 for x in data['label'].to_list()]
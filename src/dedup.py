@@ -0,0 +1,405 @@
+'''Near-duplicate detection of messages based on MinHash and LSH.
+'''
+import csv
+import json
+import re
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import ftfy
+import numpy as np
+
+from .format import JsonArrayWriter, remove_irc_formatting
+
+# Prime larger than any 32 bits hash, used for universal hashing
+PRIME = np.uint64((1 << 32) + 15)
+
+MENTION = re.compile(r'@\S+|^\s*<[^>]*>|^\s*\S+:\s', re.UNICODE)
+NON_WORD = re.compile(r'[^\w\s]|_', re.UNICODE)
+SPACES = re.compile(r'\s+', re.UNICODE)
+
+
+def normalize_message(msg: str,
+                      pseudos: Optional[Set[str]] = None) -> str:
+    '''Normalize a message so that near-duplicates look alike.
+
+    Formatting, case, punctuation, emoji, mentions and known pseudos are removed.
+
+    Args
+    ----
+    msg : str
+        message to normalize
+    pseudos : set of str, optional
+        lowercase pseudos to remove from the message.
+        Default is None.
+
+    Returns
+    -------
+    str
+        normalized message
+    '''
+    msg = ftfy.ftfy(remove_irc_formatting(msg)).lower()
+    msg = MENTION.sub(' ', msg)
+    msg = NON_WORD.sub(' ', msg)
+
+    words = SPACES.split(msg.strip())
+    if pseudos:
+        words = [word for word in words if word not in pseudos]
+
+    return ' '.join(words)
+
+
+def best_bands(num_perm: int,
+               threshold: float) -> Tuple[int, int]:
+    '''Returns the LSH bands and rows whose similarity threshold is the closest to a target.
+
+    Two signatures share a band with probability 1 - (1 - s^r)^b, which has
+    its steepest point around (1/b)^(1/r).
+
+    Args
+    ----
+    num_perm : int
+        number of permutations of the MinHash signature
+    threshold : float
+        target Jaccard similarity
+
+    Returns
+    -------
+    tuple of int
+        number of bands and number of rows per band
+    '''
+    divisors = [r for r in range(1, num_perm + 1) if num_perm % r == 0]
+    rows = min(divisors,
+               key=lambda r: abs((r / num_perm) ** (1 / r) - threshold))
+    return num_perm // rows, rows
+
+
+class NearDuplicateIndex():
+    '''Index of messages to find near-duplicates.
+
+    Each message is compared to the representatives of the clusters already
+    indexed. Identical normalized messages are matched through a dictionary,
+    other ones through MinHash signatures of their character shingles stored
+    in LSH bands. A candidate is accepted if the estimated Jaccard similarity
+    is above the threshold.
+
+    Attributes
+    ----------
+    threshold : float
+        Jaccard similarity above which 2 messages are near-duplicates
+    shingle : int
+        length of the character shingles
+    bands : int
+        number of LSH bands
+    rows : int
+        number of signature values in each band
+    pseudos : set of str
+        lowercase pseudos removed when normalizing messages
+    exact : dict
+        representative index of each normalized message
+    buckets : list of dict
+        representative indices for each band value
+    signatures : list of np.ndarray
+        MinHash signature of each representative having words
+    ids : list of int
+        cluster index of each signature
+    count : int
+        number of messages added
+    representatives : int
+        number of clusters
+    near : int
+        number of messages matched through LSH (not identical once normalized)
+    '''
+
+    def __init__(self,
+                 threshold: float = 0.8,
+                 num_perm: int = 64,
+                 shingle: int = 3,
+                 pseudos: Optional[Iterable[str]] = None,
+                 seed: int = 0) -> None:
+        '''Initialize the index.
+
+        Args
+        ----
+        threshold : float, optional
+            Jaccard similarity above which 2 messages are near-duplicates.
+            Default is 0.8.
+        num_perm : int, optional
+            number of permutations of the MinHash signature.
+            Default is 64.
+        shingle : int, optional
+            length of the character shingles.
+            Default is 3.
+        pseudos : iterable of str, optional
+            pseudos removed when normalizing messages.
+            Default is None.
+        seed : int, optional
+            seed of the permutations.
+            Default is 0.
+        '''
+        self.threshold = threshold
+        self.shingle = shingle
+        self.bands, self.rows = best_bands(num_perm, threshold)
+        self.pseudos = {x.lower() for x in pseudos or []}
+
+        rng = np.random.default_rng(seed)
+        # Coefficients below 2^32 keep a * x + b within 64 bits
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+
+        self.exact: Dict[str, int] = {}
+        self.buckets: List[Dict[bytes, List[int]]] = [
+            {} for _ in range(self.bands)]
+        self.signatures: List[np.ndarray] = []
+        self.ids: List[int] = []
+
+        self.count = 0
+        self.representatives = 0
+        self.near = 0
+
+    def signature(self,
+                  text: str) -> np.ndarray:
+        '''Compute the MinHash signature of a normalized message.
+
+        Args
+        ----
+        text : str
+            normalized message
+
+        Returns
+        -------
+        np.ndarray
+            MinHash signature
+        '''
+        size = max(len(text) - self.shingle + 1, 1)
+        hashes = np.fromiter(
+            (zlib.crc32(text[i:i + self.shingle].encode('utf8'))
+             for i in range(size)),
+            dtype=np.uint64, count=size)
+
+        values = (np.outer(hashes, self.a) + self.b) % PRIME
+        return values.min(axis=0).astype(np.uint32)
+
+    def add(self,
+            msg: str) -> Tuple[int, bool]:
+        '''Add a message to the index.
+
+        Args
+        ----
+        msg : str
+            message to add
+
+        Returns
+        -------
+        int
+            index of the cluster the message belongs to
+        bool
+            True if the message is the representative of a new cluster
+        '''
+        self.count += 1
+        text = normalize_message(msg, self.pseudos)
+
+        # Messages without any word (only emoji or punctuation) are kept
+        if not text:
+            return self.new_cluster(None, None), True
+
+        if text in self.exact:
+            return self.exact[text], False
+
+        signature = self.signature(text)
+        keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes()
+                for i in range(self.bands)]
+
+        candidates = set()
+        for bucket, key in zip(self.buckets, keys):
+            candidates.update(bucket.get(key, []))
+
+        for candidate in sorted(candidates):
+            similarity = np.mean(self.signatures[candidate] == signature)
+            if similarity >= self.threshold:
+                self.near += 1
+                self.exact[text] = self.ids[candidate]
+                return self.ids[candidate], False
+
+        cluster = self.new_cluster(text, signature)
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(len(self.signatures) - 1)
+
+        return cluster, True
+
+    def new_cluster(self,
+                    text: Optional[str],
+                    signature: Optional[np.ndarray]) -> int:
+        '''Register a new cluster.
+
+        Args
+        ----
+        text : str or None
+            normalized message of the representative. None if it has no word.
+        signature : np.ndarray or None
+            MinHash signature of the representative
+
+        Returns
+        -------
+        int
+            index of the new cluster
+        '''
+        cluster = self.representatives
+        self.representatives += 1
+
+        if text is not None:
+            self.exact[text] = cluster
+            self.signatures.append(signature)
+            self.ids.append(cluster)
+
+        return cluster
+
+    def summary(self) -> str:
+        '''Returns a summary of the work removed by deduplication.
+
+        Returns
+        -------
+        str
+            printable summary
+        '''
+        removed = self.count - self.representatives
+        ratio = removed / self.count if self.count else 0
+        return ('{} messages, {} kept, {} removed ({} identical once normalized, '
+                '{} near-duplicates): {:.1%} less to score and annotate').format(
+                    self.count, self.representatives, removed,
+                    removed - self.near, self.near, ratio)
+
+
+def deduplicate(records: Iterable[Dict[str, Any]],
+                index: NearDuplicateIndex,
+                mapping: List[int]) -> Iterator[Dict[str, Any]]:
+    '''Yields the representative of each cluster of near-duplicate messages.
+
+    Args
+    ----
+    records : iterable of dict
+        messages structured as dictionary with a 'message' key
+    index : NearDuplicateIndex
+        index of near-duplicates
+    mapping : list of int
+        list filled with the cluster index of each record
+
+    Returns
+    -------
+    iterator of dict
+        first record of each cluster
+    '''
+    for record in records:
+        cluster, new = index.add(record['message'])
+        mapping.append(cluster)
+        if new:
+            yield record
+
+
+def dedup_file(srcfile: str,
+               outfile: str,
+               mapfile: str,
+               threshold: float = 0.8,
+               num_perm: int = 64) -> None:
+    '''Remove near-duplicate messages of a JSON file.
+
+    The mapping file stores, for each message of the source file, the index of
+    its representative in the output file. It is used to propagate labels back.
+
+    Args
+    ----
+    srcfile : str
+        JSON file of messages
+    outfile : str
+        JSON file that will contain one message per cluster
+    mapfile : str
+        JSON file that will contain the mapping
+    threshold : float, optional
+        Jaccard similarity above which 2 messages are near-duplicates.
+        Default is 0.8.
+    num_perm : int, optional
+        number of permutations of the MinHash signature.
+        Default is 64.
+    '''
+    with open(srcfile, encoding='utf-8') as f:
+        data = json.load(f)
+
+    pseudos = {elem[key] for elem in data for key in ('pseudo', 'user')
+               if elem.get(key)}
+    index = NearDuplicateIndex(threshold, num_perm, pseudos=pseudos)
+    mapping: List[int] = []
+
+    with JsonArrayWriter(outfile, flush_every=1000) as writer:
+        for elem in deduplicate(data, index, mapping):
+            writer.append(elem)
+
+    with open(mapfile, 'w') as f:
+        json.dump(mapping, f)
+
+    print(index.summary())
+
+
+def propagate_labels(srcfile: str,
+                     labelfile: str,
+                     mapfile: str,
+                     outfile: str) -> None:
+    '''Copy labels of cluster representatives to every message of the cluster.
+
+    Labels can come from:
+      - a JSON file (output of dedup_file, analyzed afterward). Every key which is
+        not in the source message is copied. Output is a JSON file.
+      - an annotated CSV file with a 'message' column. Representatives are
+        matched by their normalized message and every other column is copied.
+        Output is a CSV file with the same delimiter.
+
+    Args
+    ----
+    srcfile : str
+        JSON file of messages, before deduplication
+    labelfile : str
+        JSON or CSV file containing the labels of the representatives
+    mapfile : str
+        JSON file containing the mapping created by dedup_file
+    outfile : str
+        output file
+    '''
+    with open(srcfile, encoding='utf-8') as f:
+        data = json.load(f)
+    with open(mapfile) as f:
+        mapping = json.load(f)
+
+    if labelfile.endswith('.json'):
+        with open(labelfile, encoding='utf-8') as f:
+            labels = json.load(f)
+
+        with JsonArrayWriter(outfile, flush_every=1000) as writer:
+            for elem, cluster in zip(data, mapping):
+                writer.append({**labels[cluster], **elem})
+        return
+
+    def key(msg: str) -> str:
+        # Messages without any word (only emoji or punctuation) are matched as is
+        return normalize_message(msg) or msg
+
+    # Representative of each cluster, in the order of the deduplicated file
+    representatives: Dict[int, str] = {}
+    for elem, cluster in zip(data, mapping):
+        representatives.setdefault(cluster, key(elem['message']))
+
+    with open(labelfile, encoding='utf-8', newline='') as f:
+        dialect = csv.Sniffer().sniff(f.readline())
+        f.seek(0)
+        reader = csv.DictReader(f, dialect=dialect)
+        columns = [x for x in reader.fieldnames if x != 'message']
+        annotations = {key(row['message']): row
+                       for row in reader}
+
+    with open(outfile, 'w', encoding='utf-8', newline='') as f:
+        csvwriter = csv.writer(f, delimiter=dialect.delimiter)
+        csvwriter.writerow(['message'] + columns)
+
+        for elem, cluster in zip(data, mapping):
+            row = annotations.get(representatives[cluster])
+            if row:
+                csvwriter.writerow(
+                    [elem['message']] + [row[x] for x in columns])
@@ -0,0 +1,145 @@
+'''Data-parallel training on several worker processes, local or on several hosts.
+
+Workers are described by a list of host:port, the same on every worker, and
+the index of the current worker in this list. Worker 0 is the chief: it is
+the only one writing checkpoints, logs and the exported model.
+'''
+import json
+import os
+import socket
+import subprocess
+import sys
+from typing import List, Optional
+
+import tensorflow as tf
+
+
+def parse_workers(workers: str) -> List[str]:
+    '''Returns the addresses of a comma separated list of workers, such as 'host1:2222,host2:2222'.
+    '''
+    return [x.strip() for x in workers.split(',') if x.strip()]
+
+
+def create_strategy(workers: str = '',
+                    index: int = 0) -> tf.distribute.Strategy:
+    '''Returns the distribution strategy of a worker.
+
+    Must be called before any other TensorFlow operation, as it starts the
+    collective communication of the worker.
+
+    Args
+    ----
+    workers : str, optional
+        comma separated list of workers (host:port). If empty, training runs on this process only.
+        Default is ''.
+    index : int, optional
+        index of this worker in the list.
+        Default is 0.
+
+    Returns
+    -------
+    tf.distribute.Strategy
+        MultiWorkerMirroredStrategy if workers are given, default strategy otherwise
+    '''
+    addresses = parse_workers(workers)
+    if not addresses:
+        return tf.distribute.get_strategy()
+
+    os.environ['TF_CONFIG'] = json.dumps({
+        'cluster': {'worker': addresses},
+        'task': {'type': 'worker', 'index': index},
+    })
+    return tf.distribute.MultiWorkerMirroredStrategy()
+
+
+def is_chief(strategy: tf.distribute.Strategy) -> bool:
+    '''Returns if the current worker is the chief (worker 0), or if training is not distributed.
+    '''
+    resolver = getattr(strategy, 'cluster_resolver', None)
+    if resolver is None or not resolver.cluster_spec().as_dict():
+        return True
+    return resolver.task_type in ('chief', None) or \
+        (resolver.task_type == 'worker' and resolver.task_id == 0)
+
+
+def free_ports(count: int) -> List[int]:
+    '''Returns ports currently free on localhost.
+    '''
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        sockets.append(sock)
+    ports = [x.getsockname()[1] for x in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def launch_workers(count: int,
+                   argv: List[str],
+                   script: str = 'train.py',
+                   logs: str = 'logs') -> int:
+    '''Start workers on localhost and wait for them.
+
+    CPUs are split between workers, each worker being pinned to its share.
+    The chief prints in the console, other workers in logs/worker-<index>.log.
+
+    Args
+    ----
+    count : int
+        number of workers
+    argv : list of str
+        arguments of the script, without workers, index and launch ones
+    script : str, optional
+        training script run by each worker.
+        Default is 'train.py'.
+    logs : str, optional
+        folder of the logs of the workers.
+        Default is 'logs'.
+
+    Returns
+    -------
+    int
+        0 if every worker succeeded, the first non-zero exit code otherwise
+    '''
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else list(range(os.cpu_count() or 1))
+    threads = max(len(cpus) // count, 1)
+    workers = ','.join('localhost:{}'.format(x) for x in free_ports(count))
+    os.makedirs(logs, exist_ok=True)
+
+    processes = []
+    for index in range(count):
+        share = cpus[index * threads:(index + 1) * threads] or cpus
+        # Arguments given by the user come after, so they override the CPU split
+        command = [sys.executable, script,
+                   '--intra', str(len(share)), '--cpus', ','.join(str(x) for x in share),
+                   *argv, '--workers', workers, '--index', str(index)]
+        log = None if index == 0 else open(os.path.join(logs, 'worker-{}.log'.format(index)), 'w')
+        processes.append((subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT if log else None), log))
+
+    code = 0
+    for process, log in processes:
+        process.wait()
+        if log:
+            log.close()
+        code = code or process.returncode
+    return code
+
+
+def strip_launch_args(argv: List[str],
+                      options: Optional[List[str]] = None) -> List[str]:
+    '''Returns command line arguments without the launcher options and their values.
+    '''
+    options = options or ['-l', '--launch', '-w', '--workers', '--index']
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in options:
+            skip = True
+        elif not any(arg.startswith(x + '=') for x in options):
+            result.append(arg)
+    return result
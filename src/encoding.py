@@ -0,0 +1,332 @@
+'''Pre-tokenized, memory-mapped cache of training data.
+
+Texts are tokenized once and stored in shards of NumPy files:
+    * <shard>-input_ids.npy: token ids of all sequences, concatenated
+    * <shard>-attention_mask.npy: attention mask of all sequences, concatenated
+    * <shard>-offsets.npy: start of each sequence in the 2 previous arrays
+    * <shard>-labels.npy: label of each sequence
+
+Sequences are stored without padding. Shards are memory-mapped when read,
+so the padded matrix of the whole split is never held in memory.
+'''
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+from transformers import CamembertTokenizerFast
+
+
+def data_hash(texts: List[str],
+              labels: List[int]) -> str:
+    '''Returns a hash of texts and their labels.
+    '''
+    h = hashlib.sha256()
+    for text, label in zip(texts, labels):
+        h.update(text.encode('utf8'))
+        h.update('\x00{}\x00'.format(label).encode('utf8'))
+    return h.hexdigest()
+
+
+def encode_split(texts: List[str],
+                 labels: List[int],
+                 token_model: str = 'camembert-base',
+                 cache_dir: str = 'cache/encodings',
+                 max_length: Optional[int] = None,
+                 shard_size: int = 10000,
+                 batch_size: int = 1000) -> str:
+    '''Tokenize a split into memory-mapped shards, unless already cached.
+
+    The cache is keyed by the tokenizer, the maximal length and a hash of the
+    data, so the tokenizer is not even loaded when the split is cached.
+
+    Args
+    ----
+    texts : list of str
+        texts of the split
+    labels : list of int
+        labels of the split
+    token_model : str, optional
+        model used for tokenisation. It should be a pretrained from CamembertTokenizerFast class.
+        Default is 'camembert-base'.
+    cache_dir : str, optional
+        folder containing the cached splits.
+        Default is 'cache/encodings'.
+    max_length : int, optional
+        maximal number of tokens of a sequence. If None, the tokenizer's maximum is used.
+        Default is None.
+    shard_size : int, optional
+        number of sequences per shard.
+        Default is 10000.
+    batch_size : int, optional
+        number of texts tokenized at once.
+        Default is 1000.
+
+    Returns
+    -------
+    str
+        folder of the cached split
+    '''
+    key = hashlib.sha256('{}\n{}\n{}'.format(
+        token_model, max_length, data_hash(texts, labels)).encode('utf8')).hexdigest()[:16]
+    path = os.path.join(cache_dir, key)
+    if os.path.isfile(os.path.join(path, 'meta.json')):
+        return path
+
+    tokenizer = CamembertTokenizerFast.from_pretrained(token_model)
+
+    # Written in a temporary folder so an interrupted encoding is not reused.
+    # The folder is specific to the process, as trials of a sweep encode concurrently.
+    tmp = '{}.tmp-{}'.format(path, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    shards = []
+    longest = 0
+    for start in range(0, len(texts), shard_size):
+        ids: List[List[int]] = []
+        masks: List[List[int]] = []
+        for i in range(start, min(start + shard_size, len(texts)), batch_size):
+            encodings = tokenizer(texts[i:min(i + batch_size, start + shard_size)],
+                                  truncation=True, max_length=max_length)
+            ids += encodings['input_ids']
+            masks += encodings['attention_mask']
+
+        lengths = np.array([len(x) for x in ids], dtype=np.int64)
+        longest = max(longest, int(lengths.max()))
+
+        name = 'shard-{:05d}'.format(len(shards))
+        np.save(os.path.join(tmp, name + '-input_ids.npy'),
+                np.fromiter((x for seq in ids for x in seq), dtype=np.int32, count=int(lengths.sum())))
+        np.save(os.path.join(tmp, name + '-attention_mask.npy'),
+                np.fromiter((x for seq in masks for x in seq), dtype=np.int8, count=int(lengths.sum())))
+        np.save(os.path.join(tmp, name + '-offsets.npy'),
+                np.concatenate([[0], np.cumsum(lengths)]))
+        np.save(os.path.join(tmp, name + '-labels.npy'),
+                np.array(labels[start:start + shard_size], dtype=np.int32))
+        shards.append(name)
+
+    meta = {'token_model': token_model,
+            'max_length': max_length,
+            'count': len(texts),
+            'longest': longest,
+            'pad_token_id': tokenizer.pad_token_id,
+            'shards': shards}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+
+    if os.path.isfile(os.path.join(path, 'meta.json')):
+        # Another process cached the same split meanwhile
+        shutil.rmtree(tmp, ignore_errors=True)
+        return path
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+class EncodedShards():
+    '''Reader of a split encoded by encode_split.
+
+    Attributes
+    ----------
+    path : str
+        folder of the cached split
+    meta : dict
+        description of the split (number of sequences, longest sequence, padding token, shards)
+    shards : list of dict
+        memory-mapped arrays of each shard
+    '''
+
+    def __init__(self,
+                 path: str) -> None:
+        '''Memory-map the shards of a split.
+
+        Args
+        ----
+        path : str
+            folder of the cached split
+        '''
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+
+        self.shards = [
+            {x: np.load(os.path.join(path, '{}-{}.npy'.format(name, x)), mmap_mode='r')
+             for x in ('input_ids', 'attention_mask', 'offsets', 'labels')}
+            for name in self.meta['shards']]
+
+    def __len__(self) -> int:
+        return self.meta['count']
+
+    def lengths(self) -> np.ndarray:
+        '''Returns the number of tokens of each sequence.
+        '''
+        if not self.shards:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.diff(x['offsets']) for x in self.shards])
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray, int]]:
+        '''Yields input ids, attention mask and label of each sequence, unpadded.
+        '''
+        for shard in self.shards:
+            offsets = shard['offsets']
+            for i, label in enumerate(shard['labels']):
+                yield (shard['input_ids'][offsets[i]:offsets[i + 1]],
+                       shard['attention_mask'][offsets[i]:offsets[i + 1]],
+                       int(label))
+
+
+def length_percentile(shards: EncodedShards,
+                      percentile: float) -> int:
+    '''Returns a maximal length covering a percentile of the sequences.
+
+    Args
+    ----
+    shards : EncodedShards
+        encoded split
+    percentile : float
+        percentage of sequences which should not be truncated
+
+    Returns
+    -------
+    int
+        maximal number of tokens
+    '''
+    lengths = shards.lengths()
+    if not len(lengths):
+        return 2
+    return max(int(np.ceil(np.percentile(lengths, percentile))), 2)
+
+
+def bucket_boundaries(lengths: np.ndarray,
+                      buckets: int) -> List[int]:
+    '''Returns length boundaries splitting sequences into buckets of similar size.
+
+    Args
+    ----
+    lengths : np.ndarray
+        number of tokens of each sequence
+    buckets : int
+        number of buckets
+
+    Returns
+    -------
+    list of int
+        upper (exclusive) length of each bucket but the last one
+    '''
+    if buckets < 2 or not len(lengths):
+        return []
+    quantiles = np.quantile(lengths, np.linspace(0, 1, buckets + 1)[1:-1])
+    return sorted({int(x) + 1 for x in quantiles if int(x) + 1 < lengths.max() + 1})
+
+
+def padding_ratio(lengths: np.ndarray,
+                  boundaries: List[int],
+                  batch_size: int,
+                  seed: int = 0) -> Tuple[float, int]:
+    '''Estimate the share of padding tokens of length-bucketed batches.
+
+    Batches are simulated as in tf.data bucket_by_sequence_length: sequences
+    are shuffled, dispatched in their bucket and padded to the longest
+    sequence of their batch.
+
+    Args
+    ----
+    lengths : np.ndarray
+        number of tokens of each sequence
+    boundaries : list of int
+        bucket boundaries. No boundary means a single bucket.
+    batch_size : int
+        number of sequences per batch
+    seed : int, optional
+        seed of the shuffling.
+        Default is 0.
+
+    Returns
+    -------
+    float
+        share of padding tokens
+    int
+        number of batches
+    '''
+    if not len(lengths):
+        return 0.0, 0
+
+    lengths = np.random.default_rng(seed).permutation(lengths)
+    buckets = np.digitize(lengths, boundaries)
+
+    padded, batches = 0, 0
+    for bucket in np.unique(buckets):
+        values = lengths[buckets == bucket]
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            padded += batch.max() * len(batch)
+            batches += 1
+
+    return 1 - lengths.sum() / padded, batches
+
+
+def bucketed_dataset(shards: EncodedShards,
+                     batch_size: int,
+                     max_length: int,
+                     boundaries: List[int],
+                     shuffle: int = 0,
+                     seed: int = 0) -> tf.data.Dataset:
+    '''Returns batches of sequences of similar length, padded to their longest sequence.
+
+    Sequences longer than max_length are truncated, keeping their last
+    (end of sequence) token. Unpadded sequences are cached after the first
+    epoch, shuffled, grouped by length and prefetched.
+
+    Args
+    ----
+    shards : EncodedShards
+        encoded split
+    batch_size : int
+        number of sequences per batch
+    max_length : int
+        maximal number of tokens of a sequence
+    boundaries : list of int
+        bucket boundaries (see bucket_boundaries)
+    shuffle : int, optional
+        size of the shuffle buffer. If 0, sequences are not shuffled.
+        Default is 0.
+    seed : int, optional
+        seed of the shuffling.
+        Default is 0.
+
+    Returns
+    -------
+    tf.data.Dataset
+        dataset of ({'input_ids', 'attention_mask'}, labels) batches
+    '''
+    def generate():
+        for ids, mask, label in shards:
+            if len(ids) > max_length:
+                ids = np.concatenate([ids[:max_length - 1], ids[-1:]])
+                mask = mask[:max_length]
+            yield {'input_ids': np.asarray(ids, dtype=np.int32),
+                   'attention_mask': np.asarray(mask, dtype=np.int32)}, label
+
+    dataset = tf.data.Dataset.from_generator(generate, output_signature=(
+        {'input_ids': tf.TensorSpec((None,), tf.int32),
+         'attention_mask': tf.TensorSpec((None,), tf.int32)},
+        tf.TensorSpec((), tf.int32))).cache()
+
+    if shuffle:
+        dataset = dataset.shuffle(shuffle, seed=seed, reshuffle_each_iteration=True)
+
+    pad = shards.meta['pad_token_id']
+    dataset = dataset.bucket_by_sequence_length(
+        element_length_func=lambda x, y: tf.shape(x['input_ids'])[0],
+        bucket_boundaries=boundaries,
+        bucket_batch_sizes=[batch_size] * (len(boundaries) + 1),
+        padding_values=({'input_ids': tf.constant(pad, tf.int32),
+                         'attention_mask': tf.constant(0, tf.int32)},
+                        tf.constant(0, tf.int32)))
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,282 @@
+'''Asyncio engine running La Ronde de Nuit without GUI.
+
+Fetching, analysis and output run as cooperating tasks:
+    * fetch polls the source when the analysis runs out of messages. If the
+      source has nothing new, the delay before polling again grows up to a
+      maximum, so a quiet chat costs almost no CPU nor requests.
+    * analyze waits until messages are available and analyzes them one by one.
+    * output sends each analyzed message, one per transition. Outputs are
+      paced by a FrameClock, so they do not drift, and late transition
+      frames are skipped.
+    * watch applies changes of the configuration file (see RondeGUI.reload).
+
+Blocking calls of the manager (HTTP requests, model inference) run in a single
+worker thread, so the manager is never accessed concurrently and the event
+loop stays free for other I/O.
+'''
+import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import METRICS
+from .scheduler import FrameClock
+
+
+class HeadlessEngine():
+    '''Runs fetch, analyze and output tasks until stopped.
+
+    Attributes
+    ----------
+    ronde : RondeGUI
+        application whose manager and outputs are used
+    poll_min : float
+        delay (in seconds) before polling the source again once it had new messages
+    poll_max : float
+        maximal delay (in seconds) between 2 polls of a quiet source
+    backoff : float
+        factor applied to the delay each time the source has nothing new
+    transition : float
+        delay (in seconds) between 2 outputs
+    loop_source : bool
+        if False, a file source is read once and the engine stops at its end
+    queue : asyncio.Queue
+        analyzed messages waiting to be output
+    available : asyncio.Event
+        set when the manager has messages to analyze
+    starved : asyncio.Event
+        set when the manager has no message left
+    stop : asyncio.Event
+        set to stop the engine
+    finished : bool
+        True once a file source, which is not looped over, has been read
+    executor : ThreadPoolExecutor
+        single thread running the blocking calls of the manager
+    clock : FrameClock
+        clock pacing outputs on monotonic deadlines
+    behind : int
+        number of late frames the manager should skip
+    dropped : int
+        number of frames skipped by the manager since the last frame shown
+    '''
+
+    def __init__(self,
+                 ronde: Any,
+                 config: Dict[str, Any]) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        ronde : RondeGUI
+            application whose manager and outputs are used
+        config : dict
+            'manager' section of the configuration, with 'transition', 'toLoop',
+            'poll_min', 'poll_max', 'backoff' and 'queue' keys
+        '''
+        self.ronde = ronde
+        self.queue_size = config.get('queue', 64)
+        self.last_messages = config.get('last_messages', -1)
+        self.clock = FrameClock(config['transition'] / 1000, config.get('report', 0))
+        self.configure(config)
+        self.behind = 0
+        self.dropped = 0
+        # Set by run. A shutdown requested before is applied when it starts.
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.requested = False
+
+    def configure(self,
+                  config: Dict[str, Any]) -> None:
+        '''Apply a new 'manager' section to polls and transitions.
+
+        The queue size and last_messages are only read at initialization.
+        '''
+        self.poll_min = config.get('poll_min', 500) / 1000
+        self.poll_max = config.get('poll_max', 30000) / 1000
+        self.backoff = config.get('backoff', 2.0)
+        self.transition = config['transition'] / 1000
+        self.loop_source = config.get('toLoop', False)
+        if self.clock.interval != self.transition:
+            self.clock.set_interval(self.transition)
+        self.clock.report = config.get('report', 0)
+
+    async def call(self,
+                   fn: Callable,
+                   *args) -> Any:
+        '''Run a blocking function in the manager thread.
+        '''
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def sleep(self,
+                    delay: float) -> bool:
+        '''Sleep unless the engine is stopped meanwhile.
+
+        Returns
+        -------
+        bool
+            True if the engine was stopped
+        '''
+        try:
+            await asyncio.wait_for(self.stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        return self.stop.is_set()
+
+    async def fetch(self) -> None:
+        '''Poll the source each time the manager runs out of messages.
+        '''
+        manager = self.ronde.manager
+        url = self.ronde.url
+        first = True
+        delay = self.poll_min
+
+        while not self.stop.is_set():
+            await self.starved.wait()
+            if not first and not self.loop_source and not self.ronde.is_online():
+                # Messages already analyzed are still output before stopping
+                self.finished = True
+                self.available.set()
+                return
+
+            await self.call(manager.parse_data, url)
+            if first and self.last_messages > -1:
+                await self.call(manager.set_start, self.last_messages)
+            first = False
+
+            if manager.has_messages():
+                delay = self.poll_min
+                self.starved.clear()
+                self.available.set()
+                # Polls are not more frequent than poll_min, even on a busy chat
+                if await self.sleep(self.poll_min):
+                    return
+            else:
+                if await self.sleep(delay):
+                    return
+                delay = min(delay * self.backoff, self.poll_max)
+
+    async def analyze(self) -> None:
+        '''Analyze messages as soon as they are available.
+        '''
+        manager = self.ronde.manager
+        while not self.stop.is_set():
+            await self.available.wait()
+            if self.behind:
+                dropped = await self.call(manager.skip_frames, self.behind)
+                self.clock.drop(dropped)
+                self.dropped += dropped
+                self.behind = 0
+
+            data = await self.call(manager.next_data)
+            if data is None and self.finished:
+                await self.queue.put(None)
+                return
+            if data is None:
+                self.available.clear()
+                self.starved.set()
+                continue
+            # Blocks when outputs are late, so analysis does not run too far ahead
+            await self.queue.put((data, manager.arrival))
+            METRICS.set('queue', self.queue.qsize())
+
+    async def output(self) -> None:
+        '''Send analyzed messages, one per transition.
+        '''
+        while not self.stop.is_set():
+            if self.queue.empty():
+                # Idle time is not counted as late frames
+                self.clock.reset()
+            item = await self.queue.get()
+            if item is None:
+                print('End of {}'.format(self.ronde.url))
+                self.stop.set()
+                return
+
+            self.behind += self.clock.tick() - 1
+            data, arrival = item
+            msg, pseudo, fg, bg, label, score = data
+            with METRICS.time('output'):
+                self.ronde.sendOut(label, score, fg, bg)
+                self.ronde.publish(msg, pseudo, fg, bg, label, score)
+            with METRICS.time('display'):
+                self.ronde.update_text(msg, pseudo, label, score)
+            # Frames skipped by the manager are counted with the next frame shown
+            self.ronde.shown_frame(self.dropped, arrival)
+            self.dropped = 0
+            if await self.sleep(self.clock.delay()):
+                return
+
+    async def watch(self) -> None:
+        '''Apply changes of the configuration file, between 2 analyses.
+        '''
+        watcher = self.ronde.watcher
+        if not watcher:
+            return
+        while not await self.sleep(watcher.interval):
+            # Run in the manager thread, so no analysis uses the manager meanwhile
+            settings = await self.call(self.ronde.reload)
+            if settings:
+                self.configure(settings.raw['manager'])
+
+    async def run(self) -> None:
+        '''Run the engine until it is stopped by SIGINT, SIGTERM or the end of a file.
+        '''
+        loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self.available = asyncio.Event()
+        self.starved = asyncio.Event()
+        self.starved.set()
+        self.stop = asyncio.Event()
+        self.finished = False
+        self.loop = loop
+        if self.requested:
+            self.stop.set()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='manager')
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Not available on Windows: KeyboardInterrupt is handled by asyncio.run
+                pass
+
+        tasks = [asyncio.ensure_future(x) for x in (self.fetch(), self.analyze(), self.output(), self.watch())]
+        try:
+            await self.stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Waits for the current blocking call, such as an analysis, to end
+            self.executor.shutdown(wait=True)
+            self.ronde.close()
+            print('Engine stopped')
+
+    def shutdown(self) -> None:
+        '''Stop the engine from another thread, even before it runs.
+        '''
+        self.requested = True
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.stop.set)
+            except RuntimeError:
+                # Loop already closed: the engine stopped
+                pass
+
+
+def run_headless(ronde: Any,
+                 config: Optional[Dict[str, Any]] = None) -> None:
+    '''Run an application without GUI until it is stopped.
+
+    Args
+    ----
+    ronde : RondeGUI
+        application to run
+    config : dict, optional
+        'manager' section of the configuration. If None, the one of the application is used.
+        Default is None.
+    '''
+    engine = HeadlessEngine(ronde, config or ronde.config['manager'])
+    try:
+        asyncio.run(engine.run())
+    except KeyboardInterrupt:
+        pass
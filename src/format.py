@@ -1,18 +1,34 @@
 '''Parse and format WhatsApp chat history into a JSON file.
 '''
+import collections
 import csv
+import glob
+import io
+import itertools
 import json
+import mmap
+import os
 import re
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 from html.parser import HTMLParser
-from typing import Dict, List
+from typing import (IO, Any, Callable, Deque, Dict, Iterable, Iterator, List,
+                    Optional, Tuple)
 
 import ftfy
+import requests
+
+from .store import STORE_EXTENSIONS, is_store, iter_store
 
 
 # -------- #
 # WhatsApp #
 # -------- #
-def parse_whatsapp_line(line: str) -> Dict[str, str]:
+WHATSAPP_HEADER = re.compile(
+    r'\u200e?\[(?P<date>[^\] ,]+),? (?P<time>[^\]]*)\] '
+    r'(?:(?P<user>[^:\n]*): )?(?P<message>.*)', re.DOTALL)
+
+
+def parse_whatsapp_line(line: str) -> Optional[Dict[str, str]]:
     '''Parse a WhatsApp history chat line.
 
     Line structure is:
@@ -25,29 +41,86 @@ def parse_whatsapp_line(line: str) -> Dict[str, str]:
 
     Returns
     -------
-    dictionary
+    dictionary or None
         message structured as dictionary such as:
             'user' is the name of message sender
             'message' is the sent message
             'date' is day the message was sent
             'time' is the time the message was sent
+        None if the line does not start a new message.
     '''
-    data = {}
-    value = line.split(']')
+    match = WHATSAPP_HEADER.match(line)
+    if not match:
+        return None
 
-    data['date'] = value[0][1:11]
-    data['time'] = value[0][12:]
+    data = match.groupdict()
+    data['user'] = data['user'] or ''
+    return data
 
-    if len(value) > 1:
-        valvalue = value[1][1:].split(':')
-        if len(valvalue) > 1:
-            data['user'] = valvalue[0]
-            data['message'] = valvalue[1][1:]
-        else:
-            data['user'] = ''
-            data['message'] = valvalue[0]
 
-    return data
+def iter_whatsapp_lines(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    '''Parse WhatsApp chat history lines into messages.
+
+    Continuation lines are appended to the message they belong to. Consecutive
+    messages of the same user are not merged (see merge_whatsapp_messages).
+
+    Args
+    ----
+    lines : iterable of str
+        lines of a WhatsApp chat history
+
+    Returns
+    -------
+    iterator of dictionary
+        messages structured as dictionary.
+        See parse_whatsapp_line function for further information on dictionary structure.
+    '''
+    data: Optional[Dict[str, str]] = None
+
+    for line in lines:
+        data_line = parse_whatsapp_line(line)
+
+        # Continuation line
+        if data_line is None:
+            if data is None:
+                data = {'date': '', 'time': '', 'user': '', 'message': ''}
+            data['message'] += line
+            continue
+
+        if data is not None:
+            yield data
+        data = data_line
+
+    if data is not None:
+        yield data
+
+
+def merge_whatsapp_messages(messages: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+    '''Merge consecutive messages sent by the same user.
+
+    Args
+    ----
+    messages : iterable of dictionary
+        messages structured as dictionary
+
+    Returns
+    -------
+    iterator of dictionary
+        merged messages
+    '''
+    data: Optional[Dict[str, str]] = None
+
+    for data_line in messages:
+        if data is not None and data['user'] == data_line['user']:
+            data['message'] += data_line['message']
+            continue
+
+        if data is not None:
+            yield data
+        data = data_line
+
+    if data is not None:
+        yield data
 
 
 def read_whatsapp_chat(path: str,
@@ -59,66 +132,163 @@ def read_whatsapp_chat(path: str,
     path : str
         path to WhatsApp chat history file
     length : optional, int
-        number of messages to extract. If -1, extract all messages.
+        number of lines to read. If -1, read all lines.
         Default is -1.
 
     Returns
     -------
     list of dictionary
         list of messages structured as dictionary.
-        See parse_line function for further information on dictionary structure.
+        See parse_whatsapp_line function for further information on dictionary structure.
     '''
-    result = []
     with open(path, 'r', encoding='utf8') as f:
-        line = f.readline()
-        data: Dict[str, str] = {}
-
-        while line and length:
-            # New message line
-            if line[0] == '[':
-
-                data_line = parse_whatsapp_line(line)
-                if not data:
-                    data = data_line
-                else:
-                    if data['user'] == data_line['user']:
-                        data['message'] += data_line['message']
-                    else:
-                        result.append(data)
-                        data = data_line
-
-            # Continuation line
-            else:
-                data['message'] += line
+        lines = f if length < 0 else itertools.islice(f, length)
+        return list(merge_whatsapp_messages(iter_whatsapp_lines(lines)))
+
 
-            line = f.readline()
-            length -= 1
+def split_whatsapp_chat(path: str,
+                        chunk_size: int = 1 << 22) -> List[Tuple[int, int]]:
+    '''Split a WhatsApp chat history file at message boundaries.
+
+    Args
+    ----
+    path : str
+        path to WhatsApp chat history file
+    chunk_size : optional, int
+        approximate size (in bytes) of each chunk.
+        Default is 4 MB.
+
+    Returns
+    -------
+    list of tuple
+        start and end offsets of each chunk
+    '''
+    size = os.path.getsize(path)
+    if not size:
+        return []
+
+    bounds = [0]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = chunk_size
+        while pos < size:
+            # A new message starts with a header line, continuation lines may start with '[' too
+            pos = mm.find(b'\n', pos)
+            if pos < 0:
+                break
+            pos += 1
+            end = mm.find(b'\n', pos)
+            line = mm[pos:end if end >= 0 else size].decode('utf8', errors='replace')
+            if WHATSAPP_HEADER.match(line):
+                bounds.append(pos)
+                pos += chunk_size
+
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_whatsapp_chunk(path: str,
+                         start: int,
+                         end: int) -> List[Tuple[str, str, str, str]]:
+    '''Parse a chunk of a WhatsApp chat history file.
+
+    Messages are returned as tuples, which are much cheaper to send back from
+    a worker process than dictionaries.
+
+    Args
+    ----
+    path : str
+        path to WhatsApp chat history file
+    start : int
+        offset of the chunk's first byte
+    end : int
+        offset following the chunk's last byte
+
+    Returns
+    -------
+    list of tuple
+        date, time, user and message of each message of the chunk.
+        Consecutive messages of the same user are merged within the chunk only.
+    '''
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        chunk = io.TextIOWrapper(io.BytesIO(mm[start:end]), encoding='utf8')
+        return [(x['date'], x['time'], x['user'], x['message'])
+                for x in merge_whatsapp_messages(iter_whatsapp_lines(chunk))]
+
+
+def iter_whatsapp_chat(path: str,
+                       jobs: int = 1,
+                       chunk_size: int = 1 << 22) -> Iterator[Dict[str, str]]:
+    '''Parse WhatsApp chat history, possibly in parallel.
+
+    With several jobs, the memory-mapped file is split at message boundaries
+    and chunks are parsed by worker processes. Only a few chunks are in flight
+    at once, so memory use does not depend on the file size.
+
+    Args
+    ----
+    path : str
+        path to WhatsApp chat history file
+    jobs : optional, int
+        number of worker processes. If 1, the file is parsed sequentially.
+        If 0, uses the number of CPUs.
+        Default is 1.
+    chunk_size : optional, int
+        approximate size (in bytes) of each chunk.
+        Default is 4 MB.
+
+    Returns
+    -------
+    iterator of dictionary
+        messages structured as dictionary.
+    '''
+    jobs = jobs if jobs > 0 else os.cpu_count() or 1
+    if jobs == 1:
+        with open(path, 'r', encoding='utf8') as f:
+            yield from merge_whatsapp_messages(iter_whatsapp_lines(f))
+        return
 
-        if data:
-            result.append(data)
+    chunks = split_whatsapp_chat(path, chunk_size)
+    with ProcessPoolExecutor(jobs) as executor:
+        parsed = ordered_map(executor, parse_whatsapp_chunk,
+                             [(path, start, end) for start, end in chunks],
+                             2 * jobs)
+        messages = ({'date': date, 'time': time, 'user': user, 'message': message}
+                    for date, time, user, message in itertools.chain.from_iterable(parsed))
 
-    return result
+        # Messages of the same user may still be split between 2 chunks
+        yield from merge_whatsapp_messages(messages)
 
 
 def convert_whatsapp_chat(srcfile: str,
                           outfile: str,
-                          length: int = -1) -> None:
+                          length: int = -1,
+                          jobs: int = 1) -> None:
     '''Converts txt archive file to JSON file.
 
+    Messages are written as soon as they are parsed. Output is a JSON lines
+    file if outfile ends with '.jsonl', a JSON array otherwise.
+
     Args
     ----
     srcfile : str
         path to WhatsApp chat history file
     outfile : str
-        JSON file to extract messages to
+        JSON or JSON lines file to extract messages to
     length : optional, int
-        number of messages to extract. If -1, extract all messages.
+        number of lines to read. If -1, read all lines. Only used by sequential parsing.
         Default is -1.
+    jobs : optional, int
+        number of worker processes.
+        Default is 1.
     '''
-    data = read_whatsapp_chat(srcfile, length)
+    if length < 0:
+        data: Iterable[Dict[str, str]] = iter_whatsapp_chat(srcfile, jobs)
+    else:
+        data = read_whatsapp_chat(srcfile, length)
 
-    with open(outfile, 'w') as f:
-        json.dump(data, f, indent=4)
+    with open_json_writer(outfile) as writer:
+        for elem in data:
+            writer.append(elem)
 
 
 # ---- #
@@ -189,6 +359,289 @@ class RondeHTML(HTMLParser):
         self.pseudo_stack = []
 
 
+# ---- #
+# JSON #
+# ---- #
+def json_array_end(path: str) -> Tuple[int, bool]:
+    '''Returns where a JSON array written by JsonArrayWriter can be continued.
+
+    The closing bracket may be missing and the last element incomplete, as when
+    the writer was killed. An incomplete element is dropped.
+
+    Args
+    ----
+    path : str
+        path to the JSON file
+
+    Returns
+    -------
+    int
+        offset following the last element (or the opening bracket)
+    bool
+        True if the array has no element
+    '''
+    with open(path, 'rb') as f:
+        if f.read(1) != b'[':
+            raise ValueError('{}: JSON file is not an array'.format(path))
+        size = f.seek(0, os.SEEK_END)
+        start = max(size - 4096, 0)
+        f.seek(start)
+        tail = f.read().rstrip()
+
+    if tail.endswith(b']'):
+        tail = tail[:-1].rstrip()
+
+    # Elements are written one per line: the last line is checked
+    lines = tail.rsplit(b'\n', 1)
+    if len(lines) == 2:
+        try:
+            json.loads(lines[1].rstrip(b',').decode('utf8'))
+        except ValueError:
+            tail = lines[0].rstrip()
+
+    # Separator of an element which was not written
+    if tail.endswith(b','):
+        tail = tail[:-1].rstrip()
+
+    return start + len(tail), start + len(tail) == 1
+
+
+class JsonArrayWriter():
+    '''Writes a JSON array one element at a time.
+
+    Elements are written as soon as they are appended, one per line, so the
+    file never has to be held in memory or rewritten. The closing bracket is
+    written by close, hence the writer should be used as a context manager.
+
+    An existing array can be continued, for instance when a capture restarts.
+    Its closing bracket, if any, is removed and written again by close.
+
+    Attributes
+    ----------
+    path : str
+        path to the JSON file
+    count : int
+        number of elements written so far
+    flush_every : int
+        number of elements written between two flushes on disk
+    empty : bool
+        True while the array has no element
+    '''
+
+    def __init__(self,
+                 path: str,
+                 flush_every: int = 1,
+                 resume: bool = False) -> None:
+        '''Open the JSON file and write the opening bracket.
+
+        Args
+        ----
+        path : str
+            path to the JSON file
+        flush_every : int, optional
+            number of elements written between two flushes on disk.
+            Default is 1.
+        resume : bool, optional
+            if True and the file exists, elements are added to its array.
+            Otherwise, the file is overwritten.
+            Default is False.
+        '''
+        self.path = path
+        self.count = 0
+        self.flush_every = flush_every
+        self.empty = True
+
+        if resume and os.path.isfile(path) and os.path.getsize(path):
+            end, self.empty = json_array_end(path)
+            with open(path, 'rb+') as f:
+                f.truncate(end)
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write('[')
+
+    def append(self,
+               elem: Any) -> None:
+        '''Write an element at the end of the array.
+
+        Args
+        ----
+        elem : any
+            JSON serializable element
+        '''
+        self.file.write('\n' if self.empty else ',\n')
+        self.file.write(json.dumps(elem))
+        self.count += 1
+        self.empty = False
+
+        if self.count % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self) -> None:
+        '''Write the closing bracket and close the file.
+        '''
+        if not self.file.closed:
+            self.file.write(']\n' if self.empty else '\n]\n')
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class JsonLinesWriter(JsonArrayWriter):
+    '''Writes a JSON lines file, i.e. one JSON element per line.
+    '''
+
+    def __init__(self,
+                 path: str,
+                 flush_every: int = 1) -> None:
+        self.path = path
+        self.count = 0
+        self.flush_every = flush_every
+
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def append(self,
+               elem: Any) -> None:
+        self.file.write(json.dumps(elem))
+        self.file.write('\n')
+        self.count += 1
+
+        if self.count % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def open_json_writer(path: str,
+                     flush_every: int = 1000) -> JsonArrayWriter:
+    '''Returns a JSON lines writer if path ends with '.jsonl', a JSON array writer otherwise.
+    '''
+    if path.endswith('.jsonl'):
+        return JsonLinesWriter(path, flush_every)
+    return JsonArrayWriter(path, flush_every)
+
+
+def ordered_map(executor: Executor,
+                fn: Callable,
+                args: Iterable[Tuple],
+                window: int) -> Iterator[Any]:
+    '''Map a function on an executor, keeping results in order.
+
+    At most window calls are in flight at once, so results waiting to be
+    consumed do not pile up in memory.
+
+    Args
+    ----
+    executor : Executor
+        executor running the calls
+    fn : callable
+        function to call
+    args : iterable of tuple
+        arguments of each call
+    window : int
+        maximal number of calls in flight
+
+    Returns
+    -------
+    iterator
+        results of each call
+    '''
+    pending: Deque[Future] = collections.deque()
+
+    for arg in args:
+        pending.append(executor.submit(fn, *arg))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_json_array(path: str,
+                    chunk_size: int = 1 << 16) -> Iterator[Any]:
+    '''Reads the elements of a JSON array one at a time.
+
+    The file is read by chunks, so only the current element is held in memory.
+    An array which is not closed, as left by a killed capture, is read up to
+    its last complete element.
+
+    Args
+    ----
+    path : str
+        path to a JSON file containing an array
+    chunk_size : int, optional
+        number of characters read at once.
+        Default is 64k.
+
+    Returns
+    -------
+    iterator
+        elements of the array
+    '''
+    decoder = json.JSONDecoder()
+
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        eof = not buffer
+        pos = 0
+        started = False
+
+        while True:
+            # Skip whitespaces and separators
+            while pos < len(buffer) and (buffer[pos].isspace() or
+                                         (started and buffer[pos] == ',')):
+                pos += 1
+
+            if pos == len(buffer):
+                if eof and not started:
+                    raise ValueError('{}: unexpected end of JSON array'.format(path))
+                if eof:
+                    # Capture stopped before writing the closing bracket
+                    print('{}: JSON array is not closed, read up to its end'.format(path))
+                    return
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+                continue
+
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('{}: JSON file is not an array'.format(path))
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == ']':
+                return
+
+            try:
+                elem, end = decoder.raw_decode(buffer, pos)
+                # A number may continue in the next chunk
+                complete = eof or (end < len(buffer) and
+                                   (buffer[end].isspace() or buffer[end] in ',]'))
+            except json.JSONDecodeError:
+                if eof and started and not buffer[pos:].strip().endswith(']'):
+                    # Capture stopped while writing its last element
+                    print('{}: JSON array is not closed, its last element is incomplete'.format(path))
+                    return
+                if eof:
+                    raise
+                complete = False
+
+            if not complete:
+                more = f.read(chunk_size)
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+
+            yield elem
+            pos = end
+
+
 # ---------- #
 # Formatting #
 # ---------- #
@@ -215,10 +668,14 @@ def json2csv(jsonfile: str,
             * label: the label of the message
             * score: the confidence score
 
+    The JSON file is read incrementally and the CSV file is written through a
+    single writer, so memory use does not depend on the file size.
+    A columnar store (.parquet or .arrow) can be given instead of a JSON file.
+
     Args
     ----
     jsonfile : str
-        input JSON file
+        input JSON file or store
 
     csvfile : str
         output CSV file
@@ -227,14 +684,12 @@ def json2csv(jsonfile: str,
         minimum (exclusive) length of a message (in number of characters).
         Default is 3.
     '''
-    with open(jsonfile, encoding='utf-8') as f:
-        jsondata = json.load(f)
+    jsondata = iter_store(jsonfile) if is_store(jsonfile) else iter_json_array(jsonfile)
+    first = next(jsondata, None)
 
     header = ['channel', 'message']
-    names = list(jsondata[0].keys())
-    for x in header:
-        if x in names:
-            names.remove(x)
+    names = [x for x, value in (first or {}).items()
+             if isinstance(value, dict) and 'label' in value]
 
     for name in names:
         header.append('{} label'.format(name))
@@ -244,17 +699,344 @@ def json2csv(jsonfile: str,
         csvwriter = csv.writer(f, delimiter=',')
         csvwriter.writerow(header)
 
-    for elem in jsondata:
-        msg = remove_irc_formatting(elem['message'])
-        msg = ftfy.ftfy(msg)
-        if len(msg) > threshold:
-            # data = [elem['channel'], msg]
-            data = [msg]
+        if first is None:
+            return
 
-            for name in names:
-                data.append(elem[name]['label'])
-                data.append(elem[name]['score'])
+        for elem in itertools.chain([first], jsondata):
+            msg = remove_irc_formatting(elem['message'])
+            msg = ftfy.ftfy(msg)
+            if len(msg) > threshold:
+                # data = [elem['channel'], msg]
+                data = [msg]
+
+                for name in names:
+                    # Cells are left empty for messages not analyzed by this model
+                    result = elem.get(name, {})
+                    data.append(result.get('label', ''))
+                    data.append(result.get('score', ''))
 
-            with open(csvfile, 'a', encoding="utf-8", newline='') as f:
-                csvwriter = csv.writer(f, delimiter=',')
                 csvwriter.writerow(data)
+
+
+def find_files(path: str,
+               extensions: Tuple[str, ...]) -> List[str]:
+    '''Returns the files designated by a path, a folder or a glob pattern.
+
+    Args
+    ----
+    path : str
+        path to a file, to a folder or glob pattern
+    extensions : tuple of str
+        extensions of the files to look for in a folder, such as ('.json',)
+
+    Returns
+    -------
+    list of str
+        sorted list of files
+    '''
+    if os.path.isdir(path):
+        return sorted(x for ext in extensions
+                      for x in glob.glob(os.path.join(path, '*' + ext)))
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    return [path]
+
+
+def convert_json_files(path: str,
+                       output: str,
+                       threshold: int = 3,
+                       jobs: int = 0) -> None:
+    '''Converts one or several JSON files to CSV files.
+
+    When several files are given, each one is converted in a separate process
+    into a CSV file with the same name in the output folder.
+
+    Args
+    ----
+    path : str
+        JSON file or store, folder containing such files or glob pattern
+    output : str
+        CSV file if a single JSON file is given, output folder otherwise
+    threshold : optional, int
+        minimum (exclusive) length of a message (in number of characters).
+        Default is 3.
+    jobs : optional, int
+        number of processes. If 0, uses the number of CPUs.
+        Default is 0.
+    '''
+    files = find_files(path, ('.json',) + STORE_EXTENSIONS)
+    if not files:
+        raise ValueError('{}: no file found'.format(path))
+    if len(files) == 1 and not os.path.isdir(output):
+        json2csv(files[0], output, threshold)
+        return
+
+    os.makedirs(output, exist_ok=True)
+    csvfiles = [os.path.join(output, os.path.splitext(os.path.basename(x))[0] + '.csv')
+                for x in files]
+
+    with ProcessPoolExecutor(jobs or None) as executor:
+        futures = [executor.submit(json2csv, jsonfile, csvfile, threshold)
+                   for jsonfile, csvfile in zip(files, csvfiles)]
+        for future in futures:
+            future.result()
+
+
+# ------- #
+# Readers #
+# ------- #
+READERS: Dict[str, Dict[str, Any]] = {}
+
+# Number of lines read to sniff the format of a source
+SNIFF_LINES = 10
+
+
+def register_reader(name: str,
+                    extensions: Tuple[str, ...],
+                    sniff: Optional[Callable[[str], bool]] = None) -> Callable:
+    '''Register a reader of a source format.
+
+    A reader takes a path (or url) and yields messages structured as
+    dictionary with at least a 'message' key, and optionally 'pseudo',
+    'channel', 'date', 'time' and model results.
+
+    Args
+    ----
+    name : str
+        name of the format
+    extensions : tuple of str
+        file extensions of the format
+    sniff : callable, optional
+        function telling if the beginning of a file is in this format.
+        It is used to choose between formats sharing an extension. Readers
+        of such formats take the lines of the source as optional second
+        argument, once opened to sniff it (see read_sniffed).
+        Default is None.
+
+    Returns
+    -------
+    callable
+        decorator registering the reader
+    '''
+    def decorator(reader: Callable[[str], Iterator[Dict[str, Any]]]) -> Callable:
+        READERS[name] = {'read': reader, 'extensions': extensions, 'sniff': sniff}
+        return reader
+    return decorator
+
+
+def is_url(path: str) -> bool:
+    '''Returns if a path is an url.
+    '''
+    return path.startswith(('http://', 'https://'))
+
+
+def open_text(path: str) -> IO[str]:
+    '''Opens a local or online text file for streamed reading.
+
+    Args
+    ----
+    path : str
+        path or url to the file
+
+    Returns
+    -------
+    file
+        text file object
+    '''
+    if not is_url(path):
+        return open(path, 'r', encoding='utf8')
+
+    r = requests.get(path, stream=True, allow_redirects=True, timeout=30)
+    r.raise_for_status()
+    r.raw.decode_content = True
+    # Otherwise the response closes at its end, before the text file has read its last lines
+    r.raw.auto_close = False
+    return io.TextIOWrapper(r.raw, encoding=r.encoding or 'utf8')
+
+
+def format_candidates(path: str) -> List[str]:
+    '''Returns the formats a source may be in, from its extension.
+
+    Args
+    ----
+    path : str
+        path or url to the source
+
+    Returns
+    -------
+    list of str
+        names of the formats. The content of the source chooses between several ones.
+    '''
+    ext = os.path.splitext(path.split('?')[0])[1].lower()
+    candidates = [x for x, reader in READERS.items() if ext in reader['extensions']]
+
+    # Web pages are La Ronde de Nuit HTML tables by default
+    if not candidates and is_url(path):
+        return ['html']
+    if not candidates:
+        raise ValueError('{}: unknown format'.format(path))
+    return candidates
+
+
+def sniff_format(candidates: List[str],
+                 head: str) -> str:
+    '''Returns the format of a source among candidates, from its first lines.
+    '''
+    for name in candidates:
+        if READERS[name]['sniff'] and READERS[name]['sniff'](head):
+            return name
+    return next(x for x in candidates if not READERS[x]['sniff'])
+
+
+def detect_format(path: str) -> str:
+    '''Detect the format of a source from its extension and its content.
+
+    Args
+    ----
+    path : str
+        path or url to the source
+
+    Returns
+    -------
+    str
+        name of the format
+    '''
+    candidates = format_candidates(path)
+    if len(candidates) == 1:
+        return candidates[0]
+
+    with open_text(path) as f:
+        head = ''.join(itertools.islice(f, SNIFF_LINES))
+    return sniff_format(candidates, head)
+
+
+def read_sniffed(path: str,
+                 candidates: List[str]) -> Iterator[Dict[str, Any]]:
+    '''Reads a source whose format is sniffed, opening it only once.
+
+    The lines read to sniff the format are given back to the reader, so that
+    an online source is not downloaded twice.
+    '''
+    with open_text(path) as f:
+        head = list(itertools.islice(f, SNIFF_LINES))
+        fmt = sniff_format(candidates, ''.join(head))
+        yield from READERS[fmt]['read'](path, itertools.chain(head, f))
+
+
+def read_messages(path: str,
+                  fmt: str = '') -> Iterator[Dict[str, Any]]:
+    '''Reads messages of a source with the reader of its format.
+
+    Args
+    ----
+    path : str
+        path or url to the source
+    fmt : str, optional
+        name of the format. If empty, it is detected.
+        Default is ''.
+
+    Returns
+    -------
+    iterator of dict
+        messages structured as dictionary
+    '''
+    if fmt:
+        return READERS[fmt]['read'](path)
+
+    candidates = format_candidates(path)
+    if len(candidates) > 1 and is_url(path):
+        return read_sniffed(path, candidates)
+    return READERS[detect_format(path)]['read'](path)
+
+
+def sniff_whatsapp(head: str) -> bool:
+    '''Returns if a text starts with a WhatsApp message header.
+    '''
+    return any(WHATSAPP_HEADER.match(x) for x in head.splitlines()[:3])
+
+
+@register_reader('whatsapp', ('.txt',), sniff_whatsapp)
+def read_whatsapp(path: str,
+                  lines: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+    '''Reads a WhatsApp chat history export.
+    '''
+    if lines is None:
+        messages = iter_whatsapp_chat(path)
+    else:
+        messages = merge_whatsapp_messages(iter_whatsapp_lines(lines))
+    for elem in messages:
+        yield {'message': elem['message'], 'pseudo': elem['user'],
+               'date': elem['date'], 'time': elem['time']}
+
+
+@register_reader('txt', ('.txt',))
+def read_txt(path: str,
+             lines: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+    '''Reads a text file, one message per line.
+    '''
+    if lines is None:
+        with open_text(path) as f:
+            yield from read_txt(path, f)
+        return
+
+    for line in lines:
+        yield {'message': line.rstrip('\n')}
+
+
+@register_reader('json', ('.json',))
+def read_json(path: str) -> Iterator[Dict[str, Any]]:
+    '''Reads a JSON array of messages, such as the ones written by the extraction scripts.
+    '''
+    for elem in iter_json_array(path):
+        if 'user' in elem and 'pseudo' not in elem:
+            elem['pseudo'] = elem.pop('user')
+        yield elem
+
+
+@register_reader('jsonl', ('.jsonl',))
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    '''Reads a JSON lines file of messages.
+    '''
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                elem = json.loads(line)
+                if 'user' in elem and 'pseudo' not in elem:
+                    elem['pseudo'] = elem.pop('user')
+                yield elem
+
+
+@register_reader('store', STORE_EXTENSIONS)
+def read_columnar(path: str) -> Iterator[Dict[str, Any]]:
+    '''Reads a columnar store (Parquet or Arrow).
+    '''
+    return iter_store(path)
+
+
+@register_reader('html', ('.html', '.htm', '.php'))
+def read_html(path: str) -> Iterator[Dict[str, Any]]:
+    '''Reads a La Ronde de Nuit HTML table (see RondeHTML).
+    '''
+    parser = RondeHTML()
+
+    pending = ''
+
+    with open_text(path) as f:
+        for chunk in iter(lambda: f.read(1 << 16), ''):
+            # Complete rows only are fed, so that no text is split
+            pending += chunk
+            cut = pending.rfind('</tr>') + len('</tr>')
+            if cut < len('</tr>'):
+                continue
+            parser.feed(pending[:cut])
+            pending = pending[cut:]
+
+            size = min(len(parser.stack), len(parser.pseudo_stack))
+            for msg, pseudo in zip(parser.stack[:size], parser.pseudo_stack[:size]):
+                yield {'message': msg, 'pseudo': pseudo}
+            del parser.stack[:size], parser.pseudo_stack[:size]
+
+    parser.feed(pending)
+    parser.close()
+    for msg, pseudo in itertools.zip_longest(parser.stack, parser.pseudo_stack[:len(parser.stack)]):
+        yield {'message': msg, 'pseudo': pseudo} if pseudo else {'message': msg}
@@ -6,22 +6,31 @@ import tkinter as tk
 from tkinter import Misc, filedialog, ttk
 from typing import Any, Dict, List, Optional
 
-from pythonosc import udp_client
 import mido
 
-import yaml
-from transformers import logging
-
+from .bus import Publisher
+from .config import RESTART_SECTIONS, ConfigWatcher, RondeConfig, load_config
+from .engine import run_headless
+from .metrics import METRICS, report_metrics, serve_metrics
 from .manager import AbstractMsgManager, JsonMsgManager, OnlineMsgManager
+from .output import OutputThread
+from .scheduler import FrameClock
 
 
 class RondeGUI():
     def __init__(self,
                  config: Dict[str, Any],
                  parent: Optional[Misc] = None,
-                 url: str = ''):
+                 url: str = '',
+                 publish: bool = False,
+                 configpath: str = '',
+                 analyzer: Optional[Any] = None):
         # Time to wait between actions
         self.config = config
+        # Typed configuration, read on every frame
+        self.settings = RondeConfig.from_dict(config)
+        # Changes of the configuration file are applied while running
+        self.watcher = ConfigWatcher(configpath) if configpath else None
 
         # Data extracted from a JSON file
         self.data: List[Any] = []
@@ -38,26 +47,48 @@ class RondeGUI():
 
         if self.url == '' or os.path.isfile(self.url):
             print( '######## JSON MANAGER ########')
-            self.manager: AbstractMsgManager = JsonMsgManager(config)
+            self.manager: AbstractMsgManager = JsonMsgManager(config, analyzer)
         else:
             print( '######## ONLINE MANAGER ########')
-            self.manager = OnlineMsgManager(config)
+            self.manager = OnlineMsgManager(config, analyzer)
+
+        # Frames are paced on monotonic deadlines, late ones are skipped
+        self.clock = FrameClock(config['manager']['transition'] / 1000,
+                                config['manager'].get('report', 0))
+        # Values currently displayed, to skip redundant Tk updates
+        self.shown: Dict[str, Any] = {'text': None, 'fg': None, 'bg': None}
 
         if self.root:
             self.create_window()
 
-        self.osc_clients, self.midi_outports = [], []
-        for ip, port in zip( config[ 'osc' ][ 'ip' ], config[ 'osc' ][ 'port' ] ) : 
-            self.osc_clients.append( udp_client.SimpleUDPClient( ip, port ) ) 
-            
-        for port in range( config[ 'midi' ][ 'nb_port' ] ) :
+        self.midi_outports = self.open_midi_ports(self.settings.midi.nb_port)
+
+        # OSC and MIDI are sent by a dedicated thread
+        self.output = OutputThread(config, self.midi_outports)
+        self.output.start()
+
+        # Frames shared with renderers (see renderer.py)
+        self.publisher = Publisher(config.get('bus')) if publish else None
+
+        # Metrics endpoint and summary (see src.metrics)
+        self.metrics_server = None
+        if self.settings.metrics.port:
+            self.metrics_server = serve_metrics(self.settings.metrics.port)
+            print('Metrics served on http://127.0.0.1:{}/metrics'.format(self.metrics_server.server_port))
+        if self.settings.metrics.summary:
+            report_metrics(self.settings.metrics.summary)
+
+    def open_midi_ports(self, nb_port):
+        '''Returns nb_port MIDI output ports, or less if some could not be opened.
+        '''
+        midi_outports = []
+        for port in range( nb_port ) :
             try :
                 out = mido.open_output( )
-                self.midi_outports.append( out )
+                midi_outports.append( out )
             except OSError :
                 print( 'No output port availble - Receiving apps should be launched first so that output_port() can connect to the created MIDI ports.') 
-
-        
+        return midi_outports
 
     def create_window(self):
         # Frame containing the text and a selection button (for the messages and their labels)
@@ -95,8 +126,8 @@ class RondeGUI():
         ## Loop to obtain last messages
         #while(1):
         self.manager.parse_data(self.url)
-        if( self.config[ 'manager' ][ 'last_messages' ] > -1 ) :
-            self.manager.set_start( self.config[ 'manager' ][ 'last_messages' ] )
+        if( self.settings.manager.last_messages > -1 ) :
+            self.manager.set_start( self.settings.manager.last_messages )
 
         self.button.pack_forget()
         self.root.after(100, self.update)
@@ -104,17 +135,28 @@ class RondeGUI():
     def update(self):
         '''Update the text with the next message and the background with color corresponding to message sentiment.
         '''
-        
-        if self.manager.has_messages():
+        self.reload()
+
+        if self.manager.has_messages() or self.manager.stack:
+            frames = self.clock.tick()
+            dropped = self.manager.skip_frames(frames - 1)
+            self.clock.drop(dropped)
+
             msg, pseudo, fg, bg, label, score = self.manager.next_data()
             #print( self.manager.get_nb_of_messages() )
-            self.sendOut( label, score )
+            with METRICS.time('output'):
+                self.sendOut(label, score, fg, bg)
+                self.publish(msg, pseudo, fg, bg, label, score)
             # Update color
-            self.update_text(msg, pseudo, label, score)
+            with METRICS.time('display'):
+                self.update_text(msg, pseudo, label, score)
 
-            if self.config['display']['colors']:
-                self.update_color(fg, bg)
+                if self.settings.display.colors:
+                    self.update_color(fg, bg)
+            self.shown_frame(dropped, self.manager.arrival)
         else:
+            # Idle time is not counted as late frames
+            self.clock.reset()
             self.manager.parse_data(self.url)
             #if( self.config[ 'manager' ][ 'toLoop' ] ) :
             #    if( self.config[ 'manager' ][ 'last_messages' ] > -1 ) :
@@ -122,6 +164,18 @@ class RondeGUI():
 
         self.wait()
 
+    def shown_frame(self, dropped, arrival=None):
+        '''Count a frame shown, and the frames dropped before it.
+
+        arrival is the time its message was read at, if the frame ends a transition:
+        the lag between the read of the message and its display is then measured.
+        '''
+        METRICS.count('frames')
+        if dropped:
+            METRICS.count('dropped', dropped)
+        if arrival is not None:
+            METRICS.set('lag', time.monotonic() - arrival)
+
     def update_text(self, msg, pseudo, label, score):
         """Update the text.
 
@@ -137,32 +191,47 @@ class RondeGUI():
             related score
         """
         if self.root:
-            if self.config['display']['text']:
-                self.label.configure(text = pseudo + ' : '+ msg)
-            else:
-                self.label.configure(text='')
+            text = pseudo + ' : ' + msg if self.settings.display.text else ''
+            if text != self.shown['text']:
+                self.label.configure(text=text)
+                self.shown['text'] = text
 
-        if self.config['print']['text']:
-            if self.config['print']['mode'] == 'demo':
+        if self.settings.print.text:
+            if self.settings.print.mode == 'demo':
                 print(pseudo, ' : ' , msg)
-            elif self.config['print']['mode'] == 'debug':
+            elif self.settings.print.mode == 'debug':
                 print(
                     f"#### Pseudo: {pseudo} ---- Sequence: {msg} ---- Label: {label} ---- Score: {score}####")
 
     def update_color(self, fg, bg):
+        """Update background and text colors, only if they changed.
+
+        Args
+        ----
+        fg : str or Color
+            text color
+        bg : str or Color
+            background color
         """
-        """
-        self.frame.configure(background=bg)
-        self.label.configure(background=bg)
-        self.label.configure(foreground=fg)
+        if not self.root:
+            # Started without window: display can not be turned on while running
+            return
+        fg, bg = str(fg), str(bg)
+        if bg != self.shown['bg']:
+            self.frame.configure(background=bg)
+            self.label.configure(background=bg)
+            self.shown['bg'] = bg
+        if fg != self.shown['fg']:
+            self.label.configure(foreground=fg)
+            self.shown['fg'] = fg
 
     def wait(self):
         """Make the process wait.
         """
         if self.root:
-            self.root.after(self.config['manager']['transition'], self.update)
+            self.root.after(int(self.clock.delay() * 1000), self.update)
         else:
-            time.sleep(self.config['manager']['transition']/1000)
+            time.sleep(self.clock.delay())
 
     def getLastMessages( self ) :
         while( 1 ) :
@@ -179,59 +248,94 @@ class RondeGUI():
 
         if self.root:
             self.root.mainloop()
+            self.close()
         else:
-            self.manager.parse_data( self.url )
-            if( self.config[ 'manager' ][ 'last_messages' ] > -1 ) :
-                self.manager.set_start( self.config[ 'manager' ][ 'last_messages' ] )
-            while(1):
-                self.update()
+            run_headless(self)
 
-    
+    def reload(self) -> Optional[RondeConfig]:
+        '''Apply the configuration file, if it changed since the last call.
 
-    def sendOut( self, label, score ) :
+        Called between 2 frames, so a new configuration is applied at once to colors,
+        transitions, the frame clock and outputs. The model is loaded again only if
+        the 'models' section changed.
+
+        Returns
+        -------
+        RondeConfig or None
+            the new configuration, or None if the file did not change
         '''
-        Send out throught OSC and MIDI label and score outputted from model.
-        OSC sent data are /label and /score.
-        Midi data are sent as control change Midi messages whose numnber is define in the config file. 
-        There three cc number : one for the label (0 : negative, 63 : neutral, 127 : positive), one for the whole part of the score as a percentage 
-        and one for the frac part of the percentage
+        if not self.watcher:
+            return None
+        settings = self.watcher.check()
+        if settings is None:
+            return None
+
+        changed = settings.changed(self.settings)
+        if not changed:
+            return None
+
+        print('Configuration reloaded, changed: {}'.format(', '.join(changed)))
+        for name in changed:
+            if name in RESTART_SECTIONS or (name == 'display' and not self.root):
+                print('Changes of {} are applied at the next start'.format(name))
+
+        config = settings.raw
+        if 'colors' in changed or 'manager' in changed or 'models' in changed:
+            self.manager.configure(config, 'models' in changed)
+        if 'manager' in changed:
+            self.clock.set_interval(settings.manager.transition / 1000)
+            self.clock.report = settings.manager.report
+        if 'midi' in changed and settings.midi.nb_port != self.settings.midi.nb_port:
+            ports = self.open_midi_ports(settings.midi.nb_port)
+            self.output.configure(config, ports)
+            for midi_port in self.midi_outports:
+                midi_port.close()
+            self.midi_outports = ports
+        elif 'midi' in changed or 'osc' in changed:
+            self.output.configure(config, self.midi_outports)
+        if 'print' in changed:
+            set_verbosity(config['print'])
+
+        self.config = config
+        self.settings = settings
+        return settings
+
+    def is_online(self) -> bool:
+        '''Returns if messages are read from a website, which may have new messages at each read.
         '''
-        score_whole , score_frac = self.splitScoreAsInts( score ) 
-        #print( "Score ", score, " - whole : ", score_whole, ", frac : ", score_frac )
-
-        ## OSC sends
-        for client in self.osc_clients : 
-            client.send_message( "/label", label )
-            client.send_message( "/score", score )
-
-        if( label == 'positive') : 
-            value = 127
-        elif( label == 'negative' ) :
-            value = 0
-        elif( label == 'neutral' ) :
-            value = 63
-
-        for midi_port in self.midi_outports :
-            label_msg = mido.Message( 'control_change', control = self.config[ 'midi' ][ 'label_cc_nb' ], value = value )
-            score_whole_msg = mido.Message( 'control_change', control = self.config[ 'midi' ][ 'score_int_cc_nb' ], value = score_whole )   
-            score_frac_msg = mido.Message( 'control_change', control = self.config[ 'midi' ][ 'score_float_cc_nb' ], value = score_frac )   
-            midi_port.send( label_msg )
-            midi_port.send( score_whole_msg )
-            midi_port.send( score_frac_msg )
-        #score_int_cc_nb score_float_cc_nb
-
-    def splitScoreAsInts( self, score ) :
+        return isinstance(self.manager, OnlineMsgManager)
+
+    def close(self) -> None:
+        '''Send queued outputs and close MIDI output ports.
         '''
-        Rough function which splits the score taken as a percentage (between 0 and 100) into two ints representing the whole 
-        and the frac part of the percentage.
-        These two ints are used to be sent out as two separate midi control change messages.
-        This function could be refined whith the use of math.modf.
+        self.output.stop()
+        if self.publisher:
+            self.publisher.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server = None
+        for midi_port in self.midi_outports:
+            midi_port.close()
+        self.midi_outports = []
+
+    
+
+    def sendOut(self, label, score, fg=None, bg=None):
+        '''Send out through OSC and MIDI label and score outputted from model.
+
+        Frames are queued to the output thread (see src.output.OutputThread), so this never blocks.
+        OSC sent data are /label and /score, in one bundle.
+        Midi data are sent as control change Midi messages whose number is defined in the config file.
+        There are three cc numbers: one for the label (0 : negative, 63 : neutral, 127 : positive), one for the whole part
+        of the score as a percentage and one for the frac part of the percentage.
         '''
-        score = score * 100
-        whole = int( score )
-        frac = int( ( score - whole ) * 100 )
+        self.output.send(label, score, fg, bg, self.clock.interval)
 
-        return whole, frac
+    def publish(self, msg, pseudo, fg, bg, label, score):
+        '''Publish a frame on the bus (see src.bus), if enabled, for renderers.
+        '''
+        if self.publisher:
+            self.publisher.publish(msg, pseudo, fg, bg, label, score)
 
 def set_verbosity(config: Dict):
     '''Set machine learning models verbosity.
@@ -244,6 +348,8 @@ def set_verbosity(config: Dict):
           - 'mode' which defines the level of verbosity. Can either be
             'demo' (low level of verbosity) or 'debug' (highest level)
     '''
+    # Imported here so that importing the GUI does not load transformers
+    from transformers import logging
     if config['text']:
         if config['mode'] == 'demo':
             logging.set_verbosity_error()
@@ -256,7 +362,9 @@ def set_verbosity(config: Dict):
 
 
 def create_ronde_gui(configpath: str,
-                     url: str) -> RondeGUI:
+                     url: str,
+                     publish: bool = False,
+                     watch: bool = True) -> RondeGUI:
     '''Creates the GUI for 'La Ronde de nuit' project.
 
     Args
@@ -265,14 +373,19 @@ def create_ronde_gui(configpath: str,
         path to the configuration file
     filepath : str
         path to the file to run on or url to the website
+    publish : bool, optional
+        if True, frames are published on the bus for renderers.
+        Default is False.
+    watch : bool, optional
+        if True, changes of the configuration file are applied while running.
+        Default is True.
 
     Returns
     -------
     RondeGUI
         the GUI to display messages and their analysis
     '''
-    with open(configpath, 'r') as f:
-        config = yaml.load(f, yaml.FullLoader)
+    config = load_config(configpath).raw
 
     # Adapt verbosity
     set_verbosity(config['print'])
@@ -283,6 +396,6 @@ def create_ronde_gui(configpath: str,
         root = tk.Tk()
 
     # Create the process
-    ronde = RondeGUI(config, root, url)
+    ronde = RondeGUI(config, root, url, publish, configpath if watch else '')
 
     return ronde
@@ -0,0 +1,457 @@
+'''End-to-end load test of the live path against local mock chat servers.
+
+Two mock sources are fed with messages at a given rate, from a corpus (any
+messages file) or a synthetic generator:
+    * MockTableServer serves a growing HTML table, as the website read by
+      OnlineMsgManager (see src.format.RondeHTML).
+    * MockIrcServer is a minimal IRC server broadcasting messages to the
+      clients which joined its channel, as IrcBot does on a real server.
+
+run_load drives ronde.py headless (or irc_connection.py) against a mock
+source and samples its metrics endpoint (see src.metrics) and its RSS, to
+report the sustained throughput, the lag and the memory at each rate.
+'''
+import html
+import itertools
+import os
+import random
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import yaml
+
+from .format import read_messages
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Words of synthetic messages
+WORDS = ('salut', 'bonjour', 'merci', 'super', 'nul', 'triste', 'content', 'ce', 'soir',
+         'la', 'ronde', 'nuit', 'on', 'est', 'pas', 'trop', 'bien', 'mal', 'vraiment', 'je',
+         'tu', 'aime', 'déteste', 'génial', 'horrible', 'ok', 'lol', 'quoi', 'encore', 'demain')
+
+
+def message_source(corpus: str = '',
+                   seed: int = 0) -> Iterator[Tuple[str, str]]:
+    '''Yields (pseudo, message) endlessly, from a corpus or a synthetic generator.
+
+    Args
+    ----
+    corpus : str, optional
+        messages file (see src.format.read_messages) to cycle over. If empty,
+        messages are random sequences of words.
+        Default is ''.
+    seed : int, optional
+        seed of the synthetic generator.
+        Default is 0.
+    '''
+    if corpus:
+        records = [(x.get('pseudo') or 'user{}'.format(i % 50), x['message'])
+                   for i, x in enumerate(read_messages(corpus)) if x.get('message')]
+        if not records:
+            raise ValueError('{}: no message'.format(corpus))
+        yield from itertools.cycle(records)
+
+    rng = random.Random(seed)
+    while True:
+        words = rng.choices(WORDS, k=rng.randint(2, 14))
+        yield 'user{}'.format(rng.randrange(50)), ' '.join(words)
+
+
+class Feeder(threading.Thread):
+    '''Thread handing messages to a sink at a fixed rate, on monotonic deadlines.
+
+    Attributes
+    ----------
+    rate : float
+        messages per second
+    sent : int
+        number of messages handed so far
+    '''
+
+    def __init__(self,
+                 source: Iterator[Tuple[str, str]],
+                 sink: Any,
+                 rate: float) -> None:
+        super().__init__(name='feeder', daemon=True)
+        self.source = source
+        self.sink = sink
+        self.rate = rate
+        self.sent = 0
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        start = time.monotonic()
+        while not self.stopped.is_set():
+            # Messages due since the start, so a slow sink does not lower the rate
+            due = int((time.monotonic() - start) * self.rate) + 1
+            for _ in range(due - self.sent):
+                self.sink(*next(self.source))
+                self.sent += 1
+            deadline = start + self.sent / self.rate
+            self.stopped.wait(max(deadline - time.monotonic(), 0))
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+class ChatTable():
+    '''Growing table of messages, rendered as the website's HTML table.
+    '''
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.rows: List[bytes] = []
+
+    def add(self,
+            pseudo: str,
+            msg: str) -> None:
+        with self.lock:
+            self.rows.append('<tr><td>{}</td><td>{}</td><td>{}</td></tr>\n'.format(
+                len(self.rows) + 1, html.escape(pseudo), html.escape(msg)).encode('utf8'))
+
+    def render(self) -> bytes:
+        with self.lock:
+            rows = list(self.rows)
+        return b'<html><body><table><tbody>\n' + b''.join(rows) + b'</tbody></table></body></html>\n'
+
+
+class MockTableServer():
+    '''Local HTTP server of a growing RondeHTML table, fed at a fixed rate.
+
+    Attributes
+    ----------
+    table : ChatTable
+        messages served
+    url : str
+        url of the table
+    '''
+
+    def __init__(self,
+                 source: Iterator[Tuple[str, str]],
+                 rate: float,
+                 port: int = 0) -> None:
+        table = self.table = ChatTable()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = table.render()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.feeder = Feeder(source, table.add, rate)
+
+    @property
+    def sent(self) -> int:
+        return self.feeder.sent
+
+    def start(self) -> None:
+        threading.Thread(target=self.server.serve_forever, name='table', daemon=True).start()
+        self.feeder.start()
+
+    def stop(self) -> None:
+        self.feeder.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MockIrcServer():
+    '''Minimal local IRC server broadcasting messages in a channel at a fixed rate.
+
+    Only registration (NICK / USER), JOIN, PING and QUIT are handled, which is
+    what IrcBot needs.
+
+    Attributes
+    ----------
+    channel : str
+        channel messages are published in
+    port : int
+        port of the server
+    '''
+
+    def __init__(self,
+                 source: Iterator[Tuple[str, str]],
+                 rate: float,
+                 channel: str = '#accueil',
+                 port: int = 0) -> None:
+        self.channel = channel
+        self.lock = threading.Lock()
+        self.members: List[socket.socket] = []
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                nick = '*'
+                for line in self.rfile:
+                    words = line.decode('latin-1').strip().split(' ')
+                    command = words[0].upper()
+                    if command == 'NICK' and len(words) > 1:
+                        nick = words[1]
+                        self.reply(':mock 001 {} :Welcome to the mock server'.format(nick))
+                    elif command == 'PING':
+                        self.reply('PONG {}'.format(' '.join(words[1:])))
+                    elif command == 'JOIN' and len(words) > 1:
+                        self.reply(':{0}!{0}@mock JOIN {1}'.format(nick, words[1]))
+                        self.reply(':mock 366 {} {} :End of /NAMES list.'.format(nick, words[1]))
+                        with server.lock:
+                            server.members.append(self.request)
+                    elif command == 'QUIT':
+                        break
+                with server.lock:
+                    if self.request in server.members:
+                        server.members.remove(self.request)
+
+            def reply(self, text):
+                # Not interleaved with a published message
+                with server.lock:
+                    self.request.sendall((text + '\r\n').encode('latin-1', 'replace'))
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.feeder = Feeder(source, self.publish, rate)
+
+    @property
+    def sent(self) -> int:
+        return self.feeder.sent
+
+    def publish(self,
+                pseudo: str,
+                msg: str) -> None:
+        '''Send a message to every member of the channel.
+        '''
+        line = ':{0}!{0}@mock PRIVMSG {1} :{2}\r\n'.format(
+            pseudo.replace(' ', '_'), self.channel, msg.replace('\r', ' ').replace('\n', ' '))
+        data = line.encode('latin-1', 'replace')
+        with self.lock:
+            for member in list(self.members):
+                try:
+                    member.sendall(data)
+                except OSError:
+                    self.members.remove(member)
+
+    def start(self) -> None:
+        threading.Thread(target=self.server.serve_forever, name='irc', daemon=True).start()
+        self.feeder.start()
+
+    def stop(self) -> None:
+        self.feeder.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def free_port() -> int:
+    '''Returns a port currently free on localhost.
+    '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def read_rss(pid: int) -> float:
+    '''Returns the resident memory (in MB) of a process, or 0 if unknown (only Linux is supported).
+    '''
+    try:
+        with open('/proc/{}/status'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def read_metrics(url: str) -> Dict[str, float]:
+    '''Returns the counters and gauges of a metrics endpoint (histogram lines are skipped).
+    '''
+    try:
+        with urllib.request.urlopen(url, timeout=1) as r:
+            text = r.read().decode('utf8')
+    except OSError:
+        return {}
+
+    values = {}
+    for line in text.splitlines():
+        if line.startswith('#') or '{' in line:
+            continue
+        name, _, value = line.partition(' ')
+        try:
+            values[name] = float(value)
+        except ValueError:
+            pass
+    return values
+
+
+def count_captured(jsonfile: str) -> Optional[int]:
+    '''Returns the number of messages captured in a JSON file, or None while it is written.
+    '''
+    try:
+        return sum(1 for _ in read_messages(jsonfile))
+    except (OSError, ValueError):
+        return None
+
+
+def write_load_config(configpath: str,
+                      metrics_port: int) -> str:
+    '''Write a configuration running headless, with its metrics served, and returns its path.
+    '''
+    with open(configpath, 'r') as f:
+        config = yaml.load(f, yaml.FullLoader)
+    config['display'] = {'colors': False, 'text': False}
+    config['print'] = {'text': False, 'mode': 'demo'}
+    config['metrics'] = {'port': metrics_port, 'summary': 0}
+
+    fd, path = tempfile.mkstemp(prefix='ronde-load-', suffix='.yaml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.dump(config, f)
+    return path
+
+
+def run_load(mode: str,
+             rate: float,
+             duration: float,
+             configpath: str = 'config/default.yaml',
+             corpus: str = '',
+             interval: float = 1.0) -> Dict[str, Any]:
+    '''Run the live path against a mock source fed at a rate, and measure it.
+
+    Args
+    ----
+    mode : str
+        'http' runs ronde.py headless against a MockTableServer,
+        'irc' runs irc_connection.py against a MockIrcServer
+    rate : float
+        messages per second fed to the source
+    duration : float
+        duration (in seconds) of the run
+    configpath : str, optional
+        configuration of ronde.py. Display is disabled and metrics are served.
+        Default is 'config/default.yaml'.
+    corpus : str, optional
+        messages file to feed. If empty, messages are synthetic.
+        Default is ''.
+    interval : float, optional
+        delay (in seconds) between 2 samples.
+        Default is 1.0.
+
+    Returns
+    -------
+    dict
+        rate fed, sustained throughput (messages per second handled over the
+        second half of the run), lag, backlog and memory, and the samples
+    '''
+    source = message_source(corpus)
+    tmpdir = tempfile.mkdtemp(prefix='ronde-load-')
+    log = open(os.path.join(tmpdir, 'process.log'), 'w')
+
+    if mode == 'http':
+        server: Any = MockTableServer(source, rate)
+        metrics_port = free_port()
+        config = write_load_config(configpath, metrics_port)
+        command = [sys.executable, 'ronde.py', '-c', config, '-f', server.url]
+    elif mode == 'irc':
+        server = MockIrcServer(source, rate)
+        jsonfile = os.path.join(tmpdir, 'capture.json')
+        command = [sys.executable, 'irc_connection.py', '-s', '127.0.0.1', '-p', str(server.port),
+                   '-c', server.channel, '-n', 'loadtest', '-f', jsonfile]
+    else:
+        raise ValueError('unknown mode {}'.format(mode))
+
+    server.start()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    samples = []
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < duration and process.poll() is None:
+            time.sleep(interval)
+            sample = {'time': time.monotonic() - start, 'sent': server.sent, 'rss': read_rss(process.pid)}
+            if mode == 'http':
+                metrics = read_metrics('http://127.0.0.1:{}/metrics'.format(metrics_port))
+                sample['handled'] = metrics.get('ronde_analyzed_total', 0)
+                sample['lag'] = metrics.get('ronde_lag', 0)
+                sample['pending'] = metrics.get('ronde_pending', 0)
+            else:
+                captured = count_captured(jsonfile)
+                if captured is None and samples:
+                    captured = samples[-1]['handled']
+                sample['handled'] = captured or 0
+                sample['pending'] = sample['sent'] - sample['handled']
+                # Messages are captured in order: the backlog is read in backlog / rate seconds
+                sample['lag'] = sample['pending'] / rate
+            samples.append(sample)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        server.stop()
+        log.close()
+        if mode == 'http':
+            os.remove(config)
+
+    if process.returncode not in (0, -signal.SIGTERM, None) and len(samples) < 2:
+        raise RuntimeError('{} stopped, see {}'.format(command[1], log.name))
+
+    return summarize(samples, rate, mode, log.name)
+
+
+def summarize(samples: List[Dict[str, float]],
+              rate: float,
+              mode: str = 'http',
+              log: str = '') -> Dict[str, Any]:
+    '''Returns the sustained throughput, lag, backlog and memory of samples of a run.
+
+    The throughput and the backlog growth are measured over the second half of
+    the run, once the process is started (model loaded, first read done).
+    '''
+    result = {'mode': mode, 'rate': rate, 'throughput': 0.0, 'backlog_growth': 0.0,
+              'lag': 0.0, 'lag_max': 0.0, 'rss': 0.0, 'rss_max': 0.0, 'log': log, 'samples': samples}
+    if len(samples) < 2:
+        return result
+
+    # Start of the measure: second half of the samples once messages are handled
+    handling = [x for x in samples if x['handled'] > 0] or samples
+    steady = handling[len(handling) // 2:] if len(handling) > 2 else handling
+    first, last = steady[0], steady[-1]
+    elapsed = max(last['time'] - first['time'], 1e-9)
+
+    result['throughput'] = (last['handled'] - first['handled']) / elapsed
+    result['backlog_growth'] = ((last['sent'] - last['handled']) - (first['sent'] - first['handled'])) / elapsed
+    result['lag'] = last['lag']
+    result['lag_max'] = max(x['lag'] for x in samples)
+    result['rss'] = last['rss']
+    result['rss_max'] = max(x['rss'] for x in samples)
+    return result
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    '''Returns a printable line of a run's result.
+    '''
+    return ('{mode} at {rate:g} msg/s: {throughput:.2f} msg/s handled, backlog {backlog_growth:+.2f} msg/s, '
+            'lag {lag:.2f} s (max {lag_max:.2f} s), RSS {rss:.0f} MB (max {rss_max:.0f} MB)').format(**result)
+
+
+def sustained(result: Dict[str, Any],
+              tolerance: float = 0.05) -> bool:
+    '''Returns if a run kept up with its rate: its backlog grows by less than tolerance of the rate.
+    '''
+    return result['backlog_growth'] <= tolerance * result['rate']
@@ -1,14 +1,13 @@
 import abc
-import json
 from typing import Any, Dict, List, Optional
 
 import ftfy
 import requests
-from colour import Color
+from colour import Color, color_scale, hsl2hex
 import time
 
-from .analysis import SentimentAnalyzer
-from .format import RondeHTML, remove_irc_formatting
+from .format import RondeHTML, read_messages, remove_irc_formatting
+from .metrics import METRICS
 
 
 class ColorManager():
@@ -37,17 +36,34 @@ class ColorManager():
               - fg, list of foreground colors or str of unique color
               - bg, list of background colors or str of unique color
         """
-        if isinstance(colors['fg'], str):
-            colors['fg'] = [colors['fg']]
+        self.colors: Dict[str, List[str]] = {}
+        self.index: Dict[str, int] = {}
+        self.set_colors(colors)
 
-        if isinstance(colors['bg'], str):
-            colors['bg'] = [colors['bg']]
+    def set_colors(self,
+                   colors: Dict) -> None:
+        '''Replace the colors, keeping the relative position of the current ones.
 
-        self.colors = colors.copy()
-
-        self.index = {}
-        self.index['fg'] = len(self.colors['fg'])//2
-        self.index['bg'] = len(self.colors['bg'])//2
+        Args
+        ----
+        colors : dict
+            the dictionnary of colors, structured as in the initialization
+        '''
+        colors = {ctype: [colors[ctype]] if isinstance(colors[ctype], str) else list(colors[ctype])
+                  for ctype in ('fg', 'bg')}
+
+        index = {}
+        for ctype, values in colors.items():
+            if ctype not in self.index:
+                index[ctype] = len(values)//2
+            else:
+                # Same position from positive (0) to negative (last), as a ratio
+                previous = len(self.colors[ctype]) - 1
+                ratio = self.index[ctype] / previous if previous else 0.5
+                index[ctype] = int(round(ratio * (len(values) - 1)))
+
+        self.colors = colors
+        self.index = index
 
     def get_current(self,
                     ctype: str):
@@ -118,10 +134,11 @@ class ColorManager():
         Returns
         -------
         Iterator
-            iterator on colors in the range
+            iterator on colors in the range, as hexadecimal strings
         """
-        for elem in list(Color(cstart).range_to(Color(cend), steps)):
-            yield elem
+        # Same HSL scale as Color.range_to, without building a Color for every step
+        for hsl in color_scale(Color(cstart).hsl, Color(cend).hsl, steps - 1):
+            yield hsl2hex(hsl)
 
 
 class AbstractMsgManager():
@@ -156,10 +173,16 @@ class AbstractMsgManager():
         list of messages to be handled.
     previous : tuple
         tuple of previous read message. This is mainly used to handle color range.
+    arrivals : list of float
+        time (monotonic) each message of messages was read at
+    arrival : float or None
+        time the message of the last frame returned by next_data was read at, if this
+        frame ends its transition (the message is shown). None otherwise.
     '''
 
     def __init__(self,
-                 config: Dict):
+                 config: Dict,
+                 analyzer: Optional[Any] = None):
         '''Creates a MsgManager
 
         Args
@@ -172,9 +195,15 @@ class AbstractMsgManager():
               - 'colors', the color manager configuration
               - 'manager' which should contain
                 - 'steps', an int representing the number of steps for color ranging
+        analyzer : SentimentAnalyzer, optional
+            model to analyze messages with, or any object with the same analyze method
+            (see src.simulate.ReplayAnalyzer). If None, the model of the configuration is loaded.
+            Default is None.
         '''
-        self.analyzer = SentimentAnalyzer(
-            config['models']['version'], config['models']['threshold'])
+        if analyzer is None:
+            self.load_analyzer(config)
+        else:
+            self.analyzer = analyzer
         self.stack: List[Any] = [] # stack of elements used for display ()
 
         self.colors = ColorManager(config['colors'])
@@ -184,8 +213,42 @@ class AbstractMsgManager():
         self.pseudos_memory: List[Any] = []
         self.messages: List[Any] = [] # New messages from parser
         self.pseudos: List[Any] = [] # New pseudos from parser
+        self.arrivals: List[float] = [] # Time each new message was read at
         self.start_index = -1
         self.previous = None
+        # Time the message of the last frame was read at, if it ends its transition
+        self.arrival: Optional[float] = None
+        self.stack_arrival: Optional[float] = None
+
+    def load_analyzer(self,
+                      config: Dict) -> None:
+        '''Load the sentiment analysis model of a configuration.
+        '''
+        # Imported here so that managers with another analyzer do not load TensorFlow
+        from .analysis import SentimentAnalyzer
+        self.analyzer = SentimentAnalyzer(
+            config['models']['version'], config['models']['threshold'],
+            config.get('performance', {}).get('xla', False))
+
+    def configure(self,
+                  config: Dict,
+                  reload_model: bool = False) -> None:
+        '''Apply a new configuration to colors and transitions, between 2 messages.
+
+        Transitions already in the stack keep their previous colors and steps.
+
+        Args
+        ----
+        config : dict
+            dictionary of configuration, structured as in the initialization
+        reload_model : bool, optional
+            if True, the sentiment analysis model is loaded again.
+            Default is False.
+        '''
+        if reload_model:
+            self.load_analyzer(config)
+        self.colors.set_colors(config['colors'])
+        self.steps = config['manager']['steps']
 
     def set_messages(self,
                      messages: List[str]) -> None:
@@ -197,6 +260,8 @@ class AbstractMsgManager():
             list of messages to set in the stack
         '''
         self.messages = messages.copy()
+        self.arrivals = [time.monotonic()] * len(self.messages)
+        METRICS.count('fetched', len(self.messages))
     
 
     def set_messages_and_pseudos(self,
@@ -226,6 +291,8 @@ class AbstractMsgManager():
             self.pseudos_memory = pseudos.copy()
             self.messages = messages.copy()
             self.pseudos = pseudos.copy()
+            self.arrivals = [time.monotonic()] * len(self.messages)
+            METRICS.count('fetched', len(self.messages))
             
 
         if( len( messages ) > len( self.messages_memory ) and len( pseudos ) > len( self.pseudos_memory ) and len( pseudos ) == len( messages ) ) :
@@ -236,6 +303,8 @@ class AbstractMsgManager():
                 self.pseudos_memory.append( p )
                 self.messages.append( m )
                 self.pseudos.append( p )
+                self.arrivals.append( time.monotonic() )
+                METRICS.count('fetched')
     
             #return self.messages, self.pseudos
 
@@ -268,6 +337,7 @@ class AbstractMsgManager():
         '''
         self.messages = self.messages[ -last: ]
         self.pseudos = self.pseudos[ -last: ]
+        self.arrivals = self.arrivals[ -last: ]
         self.start_index = len( self.messages ) - last
 
 
@@ -287,10 +357,33 @@ class AbstractMsgManager():
         if self.stack:
             #print( 'self.stack')
             self.previous = self.stack.pop(0)
+            self.arrival = None if self.stack else self.stack_arrival
+            METRICS.set('stack', len(self.stack))
             return self.previous
         
         return None
 
+    def skip_frames(self,
+                    count: int) -> int:
+        '''Drop color transition frames which are late.
+
+        The last element of the stack, which is the new message itself, is
+        never dropped, so that late transitions end on the right color.
+
+        Args
+        ----
+        count : int
+            number of frames to drop
+
+        Returns
+        -------
+        int
+            number of frames actually dropped
+        '''
+        count = max(min(count, len(self.stack) - 1), 0)
+        del self.stack[:count]
+        return count
+
     def update_stack(self) -> None:
         '''Update the stack of handled messages.
 
@@ -301,22 +394,28 @@ class AbstractMsgManager():
             - create a range of colors between previous and current color if needed
           - add new info to the stack
         '''
-        msg = self.get_next_msg()
-        pseudo = self.get_next_pseudo()
+        self.stack_arrival = self.arrivals.pop(0) if self.arrivals else None
+        with METRICS.time('format'):
+            msg = self.get_next_msg()
+            pseudo = self.get_next_pseudo()
 
-        score, label = self.analyzer.analyze(msg)
+        with METRICS.time('analyze'):
+            score, label = self.analyzer.analyze(msg)
+        METRICS.count('analyzed')
+        METRICS.set('pending', len(self.messages))
 
-        fg = self.colors.get_next(label, 'fg')
-        bg = self.colors.get_next(label, "bg")
+        with METRICS.time('colors'):
+            fg = self.colors.get_next(label, 'fg')
+            bg = self.colors.get_next(label, "bg")
 
-        if self.previous and self.steps > 0:
-            pmsg, ppseudo, pfg, pbg, plab, psco = self.previous
-            for ifg, ibg in zip(self.colors.colorRange(pfg, fg, self.steps),
-                                self.colors.colorRange(pbg, bg, self.steps)):
-                self.stack.append(
-                    (pmsg, ppseudo, ifg, ibg, plab, psco))
+            if self.previous and self.steps > 0:
+                pmsg, ppseudo, pfg, pbg, plab, psco = self.previous
+                for ifg, ibg in zip(self.colors.colorRange(pfg, fg, self.steps),
+                                    self.colors.colorRange(pbg, bg, self.steps)):
+                    self.stack.append(
+                        (pmsg, ppseudo, ifg, ibg, plab, psco))
 
-        self.stack.append((msg, pseudo, fg, bg, label, score))
+            self.stack.append((msg, pseudo, fg, bg, label, score))
 
     def get_next_msg( self ) -> str:
         '''Collect and format the next message read.
@@ -363,17 +462,20 @@ class JsonMsgManager(AbstractMsgManager):
 
     Json file should be an array of dictionary.
     Each dictionary should have a key named 'message', which is the message to analyze.
+    Any other format with a registered reader (see src.format.READERS) is accepted too.
     '''
 
     def __init__(self,
-                 config: Dict):
-        super().__init__(config)
+                 config: Dict,
+                 analyzer: Optional[Any] = None):
+        super().__init__(config, analyzer)
 
     def parse_data(self,
                    url: str) -> None:
-        with open(url) as f:
-            msgs = [x['message'] for x in json.load(f)]
-            self.set_messages(msgs)
+        with METRICS.time('fetch'):
+            records = list(read_messages(url))
+        self.set_messages([x['message'] for x in records])
+        self.pseudos = [x.get('pseudo') or 'None' for x in records]
 
 
 class OnlineMsgManager(AbstractMsgManager):
@@ -388,16 +490,19 @@ class OnlineMsgManager(AbstractMsgManager):
     '''
 
     def __init__(self,
-                 config: Dict):
-        super().__init__(config)
+                 config: Dict,
+                 analyzer: Optional[Any] = None):
+        super().__init__(config, analyzer)
         self.parser = RondeHTML()
 
     def parse_data(self,
                    url: str) -> None:
         try : 
-            r = requests.get(url, allow_redirects=True)
-            self.parser.clean()
-            self.parser.feed(r.text)
+            with METRICS.time('fetch'):
+                r = requests.get(url, allow_redirects=True)
+            with METRICS.time('parse'):
+                self.parser.clean()
+                self.parser.feed(r.text)
             #self.set_messages(self.parser.stack)
             self.set_messages_and_pseudos(self.parser.stack, self.parser.pseudo_stack)
         
@@ -0,0 +1,239 @@
+'''Lightweight metrics of the display pipeline.
+
+Stages (fetch, parse, format, analyze, colors, display, output, send) are
+timed into fixed-bucket histograms, queue depths and lags are gauges, and
+messages and frames are counters. An observation is a few additions under a
+lock, so metrics stay on in production.
+
+Metrics are exposed in the Prometheus text format on a localhost HTTP
+endpoint (/metrics) and can be printed as a periodic summary line:
+
+    with METRICS.time('analyze'):
+        score, label = analyzer.analyze(msg)
+    METRICS.count('messages')
+    METRICS.set('lag', 1.2)
+'''
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds (in seconds) of histogram buckets, from 100 us to 30 s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prefix of exposed metric names
+PREFIX = 'ronde'
+
+
+class Histogram():
+    '''Distribution of durations in fixed buckets.
+
+    Attributes
+    ----------
+    buckets : tuple of float
+        upper bounds of buckets
+    counts : list of int
+        number of observations per bucket, the last one being above every bound
+    total : float
+        sum of observations
+    count : int
+        number of observations
+    '''
+
+    def __init__(self,
+                 buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self,
+                value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self,
+                 q: float) -> float:
+        '''Returns an estimate of a quantile: the upper bound of the bucket holding it.
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics():
+    '''Registry of histograms, counters and gauges.
+
+    Attributes
+    ----------
+    histograms : dict
+        duration histograms by stage
+    counters : dict
+        counters by name, only increasing
+    gauges : dict
+        last value by name
+    rates : dict
+        counters at the last summary, to compute rates
+    '''
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.rates: Dict[str, float] = {}
+        self.summarized = time.monotonic()
+
+    def observe(self,
+                stage: str,
+                value: float) -> None:
+        '''Add a duration (in seconds) to the histogram of a stage.
+        '''
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self,
+             stage: str) -> Iterator[None]:
+        '''Time the enclosed block into the histogram of a stage.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self,
+              name: str,
+              value: float = 1) -> None:
+        '''Increase a counter.
+        '''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self,
+            name: str,
+            value: float) -> None:
+        '''Set a gauge.
+        '''
+        with self.lock:
+            self.gauges[name] = value
+
+    def render(self) -> str:
+        '''Returns every metric in the Prometheus text format.
+        '''
+        lines: List[str] = []
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                name = '{}_{}_seconds'.format(PREFIX, stage)
+                lines.append('# TYPE {} histogram'.format(name))
+                cumulated = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulated += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, cumulated))
+                lines.append('{}_bucket{{le="+Inf"}} {}'.format(name, histogram.count))
+                lines.append('{}_sum {}'.format(name, histogram.total))
+                lines.append('{}_count {}'.format(name, histogram.count))
+            for counter, value in sorted(self.counters.items()):
+                name = '{}_{}_total'.format(PREFIX, counter)
+                lines.append('# TYPE {} counter'.format(name))
+                lines.append('{} {}'.format(name, value))
+            for gauge, value in sorted(self.gauges.items()):
+                name = '{}_{}'.format(PREFIX, gauge)
+                lines.append('# TYPE {} gauge'.format(name))
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        '''Returns a printable summary: median and 95th percentile of stages,
+        counter rates since the previous summary and gauges.
+        '''
+        now = time.monotonic()
+        elapsed = max(now - self.summarized, 1e-9)
+        parts = []
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                parts.append('{} p50 {:.1f} ms p95 {:.1f} ms'.format(
+                    stage, histogram.quantile(0.5) * 1000, histogram.quantile(0.95) * 1000))
+            for counter, value in sorted(self.counters.items()):
+                parts.append('{} {:.1f}/s'.format(counter, (value - self.rates.get(counter, 0)) / elapsed))
+                self.rates[counter] = value
+            for gauge, value in sorted(self.gauges.items()):
+                parts.append('{} {:g}'.format(gauge, round(value, 3)))
+        self.summarized = now
+        return ' | '.join(parts)
+
+
+# Metrics of the process
+METRICS = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''Serves the metrics of the process on /metrics.
+    '''
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = METRICS.render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # Scrapes are not printed
+        pass
+
+
+def serve_metrics(port: int,
+                  host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    '''Serve metrics on http://host:port/metrics from a background thread.
+
+    Args
+    ----
+    port : int
+        port of the endpoint. 0 picks a free port (see server.server_port).
+    host : str, optional
+        address of the endpoint. Only local by default.
+        Default is '127.0.0.1'.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        the server, to shutdown
+    '''
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def report_metrics(interval: float,
+                   stopped: Optional[threading.Event] = None) -> threading.Thread:
+    '''Print a summary of metrics every interval (in seconds) from a background thread.
+    '''
+    stopped = stopped or threading.Event()
+
+    def report():
+        while not stopped.wait(interval):
+            print(METRICS.summary())
+
+    thread = threading.Thread(target=report, name='metrics-report', daemon=True)
+    thread.start()
+    return thread
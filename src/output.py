@@ -0,0 +1,253 @@
+'''OSC and MIDI output, sent from a dedicated thread.
+
+Display frames only put their label, score and colors in a bounded queue, so
+slow receivers or MIDI drivers never stall the display. When the queue is full,
+the oldest frame is dropped: receivers only need the latest state.
+
+Each frame is sent as one timestamped OSC bundle per client (/label, /score),
+and MIDI control changes are built once and reused.
+
+If osc.stream is set, fg / bg colors are also streamed at this rate (in Hz)
+as /fg r g b and /bg r g b (floats between 0 and 1), interpolated between the
+2 last frames so that receivers get smooth data without polling.
+'''
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import mido
+from colour import Color
+from pythonosc import osc_bundle_builder, osc_message_builder, udp_client
+
+from .metrics import METRICS
+
+# MIDI value of each label
+LABEL_VALUES = {'negative': 0, 'neutral': 63, 'positive': 127}
+
+
+def split_score(score: float) -> Tuple[int, int]:
+    '''Split a score, taken as a percentage, in its integer and fractional parts (between 0 and 99).
+
+    Args
+    ----
+    score : float
+        score between 0 and 1
+
+    Returns
+    -------
+    tuple of int
+        integer part and 2 first decimals of the percentage
+    '''
+    score = score * 100
+    whole = int(score)
+    frac = int((score - whole) * 100)
+    return min(whole, 127), min(frac, 127)
+
+
+def osc_message(address: str,
+                *args) -> Any:
+    '''Returns a built OSC message.
+    '''
+    builder = osc_message_builder.OscMessageBuilder(address=address)
+    for arg in args:
+        builder.add_arg(arg)
+    return builder.build()
+
+
+def rgb(color: Any) -> Tuple[float, float, float]:
+    '''Returns the RGB components of a color name, hexadecimal string or Color.
+    '''
+    return tuple(color.rgb if isinstance(color, Color) else Color(str(color)).rgb)
+
+
+class OutputThread(threading.Thread):
+    '''Thread sending frames to OSC clients and MIDI ports.
+
+    Attributes
+    ----------
+    clients : list of udp_client.UDPClient
+        OSC clients
+    ports : list of mido ports
+        MIDI output ports
+    controls : dict
+        prebuilt control change messages, by name ('label', 'score_int', 'score_float') and value
+    frames : queue.Queue
+        frames waiting to be sent, as (label, score, fg, bg, transition)
+    stream : float
+        rate (in Hz) of the color stream. 0 disables the stream.
+    dropped : int
+        number of frames dropped because the queue was full
+    lock : threading.Lock
+        held while a frame is sent or the configuration is changed
+    '''
+
+    def __init__(self,
+                 config: Dict[str, Any],
+                 ports: Optional[List[Any]] = None,
+                 size: int = 16) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        config : dict
+            configuration, with 'osc' and 'midi' sections
+        ports : list of mido ports, optional
+            MIDI output ports. If None, no MIDI is sent.
+            Default is None.
+        size : int, optional
+            maximal number of frames waiting to be sent.
+            Default is 16.
+        '''
+        super().__init__(name='output', daemon=True)
+        # Held while sending, so a new configuration is never applied in the middle of a frame
+        self.lock = threading.Lock()
+        self.configure(config, ports)
+
+        self.frames: queue.Queue = queue.Queue(size)
+        self.stopped = threading.Event()
+        self.dropped = 0
+
+        # Colors streamed: previous and current frame colors, time of the current one
+        self.colors: Optional[Tuple[Any, ...]] = None
+
+    def configure(self,
+                  config: Dict[str, Any],
+                  ports: Optional[List[Any]] = None) -> None:
+        '''Apply a new configuration to OSC clients, MIDI control changes and the color stream.
+
+        Args
+        ----
+        config : dict
+            configuration, with 'osc' and 'midi' sections
+        ports : list of mido ports, optional
+            MIDI output ports. If None, no MIDI is sent.
+            Default is None.
+        '''
+        clients = [udp_client.UDPClient(ip, port)
+                   for ip, port in zip(config['osc']['ip'], config['osc']['port'])]
+        controls = {
+            name: [mido.Message('control_change', control=config['midi'][key], value=value)
+                   for value in range(128)]
+            for name, key in (('label', 'label_cc_nb'),
+                              ('score_int', 'score_int_cc_nb'),
+                              ('score_float', 'score_float_cc_nb'))}
+
+        with self.lock:
+            self.clients = clients
+            self.controls = controls
+            self.ports = ports or []
+            self.stream = config['osc'].get('stream', 0)
+
+    def send(self,
+             label: str,
+             score: float,
+             fg: Any = None,
+             bg: Any = None,
+             transition: float = 0.0) -> None:
+        '''Queue a frame, without blocking.
+
+        Args
+        ----
+        label : str
+            label of the message
+        score : float
+            score of the message
+        fg : str or Color, optional
+            text color.
+            Default is None.
+        bg : str or Color, optional
+            background color.
+            Default is None.
+        transition : float, optional
+            duration (in seconds) until the next frame, over which streamed colors are interpolated.
+            Default is 0.0.
+        '''
+        frame = (label, score, fg, bg, transition)
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                    METRICS.count('output_dropped')
+                except queue.Empty:
+                    pass
+
+    def stop(self) -> None:
+        '''Stop the thread once queued frames are sent.
+        '''
+        self.stopped.set()
+        self.join()
+
+    def run(self) -> None:
+        deadline = time.monotonic()
+
+        while not (self.stopped.is_set() and self.frames.empty()):
+            # The stream rate may be changed by configure
+            period = 1 / self.stream if self.stream else None
+            timeout = max(deadline - time.monotonic(), 0) if period else 0.1
+            try:
+                frame = self.frames.get(timeout=timeout)
+                with self.lock, METRICS.time('send'):
+                    self.send_frame(*frame)
+                METRICS.set('output_queue', self.frames.qsize())
+            except queue.Empty:
+                pass
+
+            if period and time.monotonic() >= deadline:
+                with self.lock:
+                    self.send_colors()
+                # Next deadline on the fixed grid, late ones are skipped
+                deadline += period * max(int((time.monotonic() - deadline) / period) + 1, 1)
+
+    def send_frame(self,
+                   label: str,
+                   score: float,
+                   fg: Any,
+                   bg: Any,
+                   transition: float) -> None:
+        '''Send a frame to every OSC client and MIDI port.
+        '''
+        bundle = osc_bundle_builder.OscBundleBuilder(time.time())
+        bundle.add_content(osc_message('/label', label))
+        bundle.add_content(osc_message('/score', score))
+        dgram = bundle.build()
+        for client in self.clients:
+            client.send(dgram)
+
+        whole, frac = split_score(score)
+        messages = (self.controls['label'][LABEL_VALUES.get(label, 63)],
+                    self.controls['score_int'][whole],
+                    self.controls['score_float'][frac])
+        for port in self.ports:
+            for message in messages:
+                port.send(message)
+
+        if self.stream and fg is not None and bg is not None:
+            fg, bg = rgb(fg), rgb(bg)
+            previous = self.current_colors() if self.colors else (fg, bg)
+            self.colors = (previous[0], previous[1], fg, bg, time.monotonic(), transition)
+
+    def current_colors(self) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+        '''Returns the streamed colors, interpolated between the 2 last frames.
+        '''
+        pfg, pbg, fg, bg, start, transition = self.colors
+        ratio = min((time.monotonic() - start) / transition, 1.0) if transition > 0 else 1.0
+        return (tuple(a + (b - a) * ratio for a, b in zip(pfg, fg)),
+                tuple(a + (b - a) * ratio for a, b in zip(pbg, bg)))
+
+    def send_colors(self) -> None:
+        '''Send the current colors to every OSC client.
+        '''
+        if not self.colors:
+            return
+        fg, bg = self.current_colors()
+        bundle = osc_bundle_builder.OscBundleBuilder(time.time())
+        bundle.add_content(osc_message('/fg', *fg))
+        bundle.add_content(osc_message('/bg', *bg))
+        dgram = bundle.build()
+        for client in self.clients:
+            client.send(dgram)
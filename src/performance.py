@@ -0,0 +1,340 @@
+'''CPU performance profile of TensorFlow: thread pools, XLA and CPU pinning.
+
+A profile is the 'performance' section of a YAML configuration:
+    * intra_op_threads: threads used inside an operation. 0 lets TensorFlow decide.
+    * inter_op_threads: operations run concurrently. 0 lets TensorFlow decide.
+    * xla: compile the model's forward and training step with XLA
+    * cpus: CPUs the process is pinned to. Empty means no pinning.
+
+Thread pools can only be set before TensorFlow runs its first operation, so a
+profile is applied at the very start of a program.
+'''
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+# Root of the repository, from where measures are run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PROFILE: Dict[str, Any] = {
+    'intra_op_threads': 0,
+    'inter_op_threads': 0,
+    'xla': False,
+    'cpus': [],
+}
+
+
+def load_profile(path: str = '') -> Dict[str, Any]:
+    '''Load the performance profile of a YAML configuration.
+
+    Args
+    ----
+    path : str, optional
+        path to the YAML configuration. If empty or without 'performance' section,
+        default values are used.
+        Default is ''.
+
+    Returns
+    -------
+    dict
+        performance profile
+    '''
+    profile = dict(DEFAULT_PROFILE)
+    if path and os.path.isfile(path):
+        with open(path, 'r') as f:
+            config = yaml.load(f, yaml.FullLoader) or {}
+        profile.update(config.get('performance') or {})
+    return profile
+
+
+def add_profile_args(parser: argparse.ArgumentParser) -> None:
+    '''Add arguments overriding a performance profile to a parser.
+    '''
+    parser.add_argument('--intra', type=int, default=None,
+                        help='threads used inside an operation. 0 lets TensorFlow decide.')
+    parser.add_argument('--inter', type=int, default=None,
+                        help='operations run concurrently. 0 lets TensorFlow decide.')
+    parser.add_argument('--xla', type=int, default=None, choices=[0, 1],
+                        help='compile the model with XLA (1) or not (0).')
+    parser.add_argument('--cpus', type=str, default=None,
+                        help='comma separated CPUs to pin the process to, such as 0,1,2,3. Empty disables pinning.')
+
+
+def profile_from_args(profile: Dict[str, Any],
+                      opt: argparse.Namespace) -> Dict[str, Any]:
+    '''Returns a profile overridden by command line arguments (see add_profile_args).
+    '''
+    profile = dict(profile)
+    if opt.intra is not None:
+        profile['intra_op_threads'] = opt.intra
+    if opt.inter is not None:
+        profile['inter_op_threads'] = opt.inter
+    if opt.xla is not None:
+        profile['xla'] = bool(opt.xla)
+    if opt.cpus is not None:
+        profile['cpus'] = [int(x) for x in opt.cpus.split(',') if x.strip()]
+    return profile
+
+
+def apply_profile(profile: Dict[str, Any]) -> None:
+    '''Configure the process and TensorFlow according to a profile.
+
+    The process is pinned first, so that every thread TensorFlow creates
+    afterwards inherits the affinity.
+
+    Args
+    ----
+    profile : dict
+        performance profile
+    '''
+    cpus = profile.get('cpus') or []
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    intra = profile.get('intra_op_threads') or 0
+    inter = profile.get('inter_op_threads') or 0
+    if intra:
+        # Used by oneDNN / OpenMP kernels, read when they start
+        os.environ['OMP_NUM_THREADS'] = str(intra)
+        if cpus:
+            os.environ.setdefault('KMP_AFFINITY', 'granularity=fine,compact,1,0')
+
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra)
+        tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        print('Thread pools not set, TensorFlow is already initialized: {}'.format(e))
+
+
+def write_profile(path: str,
+                  profile: Dict[str, Any]) -> None:
+    '''Write a profile in the 'performance' section of a YAML configuration.
+
+    Only this section is rewritten, so comments of other sections are kept.
+
+    Args
+    ----
+    path : str
+        path to the YAML configuration
+    profile : dict
+        performance profile
+    '''
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()
+
+    values = [('intra_op_threads', profile['intra_op_threads'],
+               'Threads used inside an operation. 0 lets TensorFlow decide.'),
+              ('inter_op_threads', profile['inter_op_threads'],
+               'Operations run concurrently. 0 lets TensorFlow decide.'),
+              ('xla', str(bool(profile['xla'])).lower(),
+               'Compile the model\'s forward and training step with XLA'),
+              ('cpus', json.dumps(list(profile['cpus'])),
+               'CPUs the process is pinned to. Empty means no pinning.')]
+    section = ['  performance:'] + [
+        '{:<28}# {}'.format('    {}: {}'.format(key, value), comment)
+        for key, value, comment in values]
+
+    start = next((i for i, x in enumerate(lines) if x.rstrip() == '  performance:'), None)
+    if start is None:
+        lines += section
+    else:
+        end = start + 1
+        while end < len(lines) and (lines[end].startswith('    ') or not lines[end].strip()):
+            end += 1
+        lines[start:end] = section
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def candidate_profiles(cpus: Optional[int] = None) -> List[Dict[str, Any]]:
+    '''Returns the profiles compared by tune_profile.
+
+    Args
+    ----
+    cpus : int, optional
+        number of available CPUs. If None, it is read from the system.
+        Default is None.
+
+    Returns
+    -------
+    list of dict
+        candidate profiles
+    '''
+    # Only CPUs allowed to the process can be pinned, such as in a container or under taskset
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else list(range(os.cpu_count() or 1))
+    if cpus is None:
+        cpus = len(allowed)
+    threads = sorted({1, max(cpus // 2, 1), cpus})
+
+    candidates = [dict(DEFAULT_PROFILE)]
+    for intra, inter, xla in itertools.product(threads, (1, 2), (False, True)):
+        candidates.append({'intra_op_threads': intra,
+                           'inter_op_threads': inter,
+                           'xla': xla,
+                           'cpus': allowed[:intra] if intra < cpus else []})
+    return candidates
+
+
+def measure_analysis(profile: Dict[str, Any],
+                     srcfile: str = 'data/pre/chaat.json',
+                     count: int = 256,
+                     batch_size: int = 32) -> float:
+    '''Returns the number of messages analyzed per second with a profile.
+
+    The first batch is not timed, as it includes graph tracing and compilation.
+
+    Args
+    ----
+    profile : dict
+        performance profile
+    srcfile : str, optional
+        JSON file of messages.
+        Default is 'data/pre/chaat.json'.
+    count : int, optional
+        number of messages analyzed.
+        Default is 256.
+    batch_size : int, optional
+        number of messages analyzed at once.
+        Default is 32.
+
+    Returns
+    -------
+    float
+        messages per second
+    '''
+    apply_profile(profile)
+    from .analysis import SentimentAnalyzer
+    from .format import iter_json_array
+
+    msgs = [x['message'] for _, x in zip(range(count + batch_size), iter_json_array(srcfile))
+            if x.get('message')]
+    analyzer = SentimentAnalyzer(xla=profile['xla'])
+    analyzer.analyze_batch(msgs[:batch_size])
+
+    msgs = msgs[batch_size:]
+    start = time.perf_counter()
+    for i in range(0, len(msgs), batch_size):
+        analyzer.analyze_batch(msgs[i:i + batch_size])
+    return len(msgs) / (time.perf_counter() - start)
+
+
+def measure_training(profile: Dict[str, Any],
+                     folder: str = 'data/sorted',
+                     steps: int = 20,
+                     batch_size: int = 16) -> float:
+    '''Returns the number of training sequences processed per second with a profile.
+
+    The first epoch of a few steps is not timed, as it includes graph tracing
+    and compilation.
+
+    Args
+    ----
+    profile : dict
+        performance profile
+    folder : str, optional
+        folder containing the train split.
+        Default is 'data/sorted'.
+    steps : int, optional
+        number of timed training steps.
+        Default is 20.
+    batch_size : int, optional
+        number of sequences per batch.
+        Default is 16.
+
+    Returns
+    -------
+    float
+        sequences per second
+    '''
+    apply_profile(profile)
+    import numpy as np
+    import tensorflow as tf
+    from transformers import TFCamembertForSequenceClassification
+
+    from .dataset import find_split, get_split
+    from .encoding import (EncodedShards, bucket_boundaries, bucketed_dataset,
+                           encode_split, length_percentile)
+    from .retrain import compile_model
+
+    texts, labels = get_split(find_split(folder, 'train'))
+    shards = EncodedShards(encode_split(texts, labels))
+    max_length = length_percentile(shards, 99)
+    boundaries = bucket_boundaries(np.minimum(shards.lengths(), max_length), 8)
+    dataset = bucketed_dataset(shards, batch_size, max_length, boundaries,
+                               shuffle=1000).repeat()
+
+    model = TFCamembertForSequenceClassification.from_pretrained('tblard/tf-allocine')
+    compile_model(model, tf.keras.optimizers.Adam(1e-5), profile['xla'])
+    model.fit(dataset, steps_per_epoch=3, epochs=1, verbose=0)
+
+    start = time.perf_counter()
+    model.fit(dataset, steps_per_epoch=steps, epochs=1, verbose=0)
+    return steps * batch_size / (time.perf_counter() - start)
+
+
+def tune_profile(config: str,
+                 task: str = 'analysis',
+                 candidates: Optional[List[Dict[str, Any]]] = None,
+                 timeout: float = 600) -> Dict[str, Any]:
+    '''Measure candidate profiles and write the fastest one in a configuration.
+
+    Each candidate runs in its own process, as thread pools can only be set
+    once per process.
+
+    Args
+    ----
+    config : str
+        path to the YAML configuration to update
+    task : str, optional
+        measured workload: 'analysis' or 'training'.
+        Default is 'analysis'.
+    candidates : list of dict, optional
+        profiles to compare. If None, candidate_profiles is used.
+        Default is None.
+    timeout : float, optional
+        maximal duration (in seconds) of a measure.
+        Default is 600.
+
+    Returns
+    -------
+    dict
+        fastest profile
+    '''
+    results = []
+    for profile in candidates or candidate_profiles():
+        command = [sys.executable, '-m', 'src.performance', task, json.dumps(profile)]
+        try:
+            output = subprocess.run(command, capture_output=True, text=True, cwd=ROOT,
+                                    timeout=timeout, check=True).stdout
+            speed = float(output.strip().splitlines()[-1])
+        except (subprocess.SubprocessError, ValueError, IndexError) as e:
+            print('{}: failed ({})'.format(profile, e))
+            continue
+
+        print('{}: {:.1f} per second'.format(profile, speed))
+        results.append((speed, profile))
+
+    if not results:
+        raise RuntimeError('No candidate profile could be measured')
+
+    speed, best = max(results, key=lambda x: x[0])
+    print('Best profile: {} ({:.1f} per second)'.format(best, speed))
+    write_profile(config, best)
+    return best
+
+
+if __name__ == '__main__':
+    # Measure of a single profile, run by tune_profile
+    task, profile = sys.argv[1], json.loads(sys.argv[2])
+    measure = measure_training if task == 'training' else measure_analysis
+    print(measure(profile))
@@ -0,0 +1,271 @@
+'''Generator stages composing a bounded-memory ingestion pipeline.
+
+Each stage takes an iterator of messages structured as dictionary and yields
+messages, so a source can go through normalization, deduplication, analysis
+and writing one message at a time:
+
+    records = read_messages('chat.txt')
+    records = normalize(records)
+    records = deduplicate(records)
+    records = analyze(prefetch(records), analyzer)
+    write(records, 'chat.csv')
+'''
+import csv
+import hashlib
+import queue
+import threading
+from typing import Any, Dict, Iterable, Iterator, List
+
+import ftfy
+
+from .dedup import NearDuplicateIndex
+from .format import open_json_writer, read_messages, remove_irc_formatting
+from .store import is_store, write_store
+
+
+def normalize(records: Iterable[Dict[str, Any]],
+              threshold: int = 3) -> Iterator[Dict[str, Any]]:
+    '''Remove IRC formatting and fix encoding of messages, skipping short ones.
+
+    Args
+    ----
+    records : iterable of dict
+        messages structured as dictionary
+    threshold : int, optional
+        minimum (exclusive) length of a message (in number of characters).
+        Default is 3.
+
+    Returns
+    -------
+    iterator of dict
+        normalized messages
+    '''
+    for elem in records:
+        msg = ftfy.ftfy(remove_irc_formatting(elem['message'])).strip()
+        if len(msg) > threshold:
+            elem['message'] = msg
+            yield elem
+
+
+def deduplicate(records: Iterable[Dict[str, Any]],
+                near: bool = False,
+                threshold: float = 0.8) -> Iterator[Dict[str, Any]]:
+    '''Skip duplicated messages.
+
+    Args
+    ----
+    records : iterable of dict
+        messages structured as dictionary
+    near : bool, optional
+        if True, near-duplicates are skipped too (see src.dedup).
+        Otherwise, only identical messages are skipped.
+        Default is False.
+    threshold : float, optional
+        Jaccard similarity above which 2 messages are near-duplicates.
+        Default is 0.8.
+
+    Returns
+    -------
+    iterator of dict
+        first message of each group of duplicates
+    '''
+    if near:
+        index = NearDuplicateIndex(threshold)
+        for elem in records:
+            if index.add(elem['message'])[1]:
+                yield elem
+        print(index.summary())
+        return
+
+    seen = set()
+    for elem in records:
+        key = hashlib.blake2b(elem['message'].encode('utf8'), digest_size=16).digest()
+        if key not in seen:
+            seen.add(key)
+            yield elem
+
+
+def analyze(records: Iterable[Dict[str, Any]],
+            analyzer: Any,
+            batch_size: int = 16) -> Iterator[Dict[str, Any]]:
+    '''Analyze messages by batches.
+
+    Messages already analyzed by the same model are left as is.
+
+    Args
+    ----
+    records : iterable of dict
+        messages structured as dictionary
+    analyzer : SentimentAnalyzer
+        model to analyze messages with
+    batch_size : int, optional
+        number of messages analyzed at once.
+        Default is 16.
+
+    Returns
+    -------
+    iterator of dict
+        messages with the model results under the model name
+    '''
+    batch: List[Dict[str, Any]] = []
+
+    def flush():
+        todo = [x for x in batch if analyzer.name not in x]
+        if todo:
+            results = analyzer.analyze_batch([x['message'] for x in todo])
+            for elem, (score, label) in zip(todo, results):
+                elem[analyzer.name] = {'label': label, 'score': score}
+        yield from batch
+        batch.clear()
+
+    for elem in records:
+        batch.append(elem)
+        if len(batch) == batch_size:
+            yield from flush()
+
+    yield from flush()
+
+
+def prefetch(records: Iterable[Dict[str, Any]],
+             size: int = 256) -> Iterator[Dict[str, Any]]:
+    '''Runs the upstream stages in a thread, through a bounded queue.
+
+    Reading and parsing then overlap with the downstream stages. The thread
+    blocks when the queue is full, so memory stays bounded.
+
+    Args
+    ----
+    records : iterable of dict
+        messages structured as dictionary
+    size : int, optional
+        maximal number of messages waiting in the queue.
+        Default is 256.
+
+    Returns
+    -------
+    iterator of dict
+        the same messages
+    '''
+    buffer: queue.Queue = queue.Queue(size)
+    end = object()
+    errors: List[BaseException] = []
+
+    def produce():
+        try:
+            for elem in records:
+                buffer.put(elem)
+        except BaseException as err:
+            errors.append(err)
+        finally:
+            buffer.put(end)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    while True:
+        elem = buffer.get()
+        if elem is end:
+            break
+        yield elem
+
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def write(records: Iterable[Dict[str, Any]],
+          path: str) -> int:
+    '''Write messages to a CSV, JSON, JSON lines or columnar file.
+
+    CSV files have a message column followed by a label and a score column for
+    each model of the first message.
+
+    Args
+    ----
+    records : iterable of dict
+        messages structured as dictionary
+    path : str
+        output file. Format depends on its extension.
+
+    Returns
+    -------
+    int
+        number of messages written
+    '''
+    if is_store(path):
+        return write_store(records, path)
+
+    count = 0
+    if not path.endswith('.csv'):
+        with open_json_writer(path) as writer:
+            for elem in records:
+                writer.append(elem)
+            return writer.count
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        csvwriter = csv.writer(f, delimiter=',')
+        names: List[str] = []
+
+        for elem in records:
+            if not count:
+                names = [x for x, value in elem.items()
+                         if isinstance(value, dict) and 'label' in value]
+                header = ['message']
+                for name in names:
+                    header += ['{} label'.format(name), '{} score'.format(name)]
+                csvwriter.writerow(header)
+
+            data = [elem['message']]
+            for name in names:
+                # Cells are left empty for messages not analyzed by this model
+                result = elem.get(name, {})
+                data += [result.get('label', ''), result.get('score', '')]
+            csvwriter.writerow(data)
+            count += 1
+
+    return count
+
+
+def ingest(srcfile: str,
+           outfile: str,
+           fmt: str = '',
+           version: int = 0,
+           threshold: float = 0.6666,
+           dedup: str = 'exact',
+           batch_size: int = 16) -> None:
+    '''Takes a source from reading to a written (and scored) output in one pass.
+
+    Args
+    ----
+    srcfile : str
+        path or url to the source
+    outfile : str
+        output file (.csv, .json, .jsonl, .parquet or .arrow)
+    fmt : str, optional
+        format of the source. If empty, it is detected.
+        Default is ''.
+    version : int, optional
+        version of the sentiment analyzer. If -1, messages are not analyzed.
+        Default is 0.
+    threshold : float, optional
+        threshold for neutral label.
+        Default is 0.6666.
+    dedup : str, optional
+        deduplication of messages. Can either be 'none', 'exact' or 'near'.
+        Default is 'exact'.
+    batch_size : int, optional
+        number of messages analyzed at once.
+        Default is 16.
+    '''
+    records = normalize(read_messages(srcfile, fmt))
+    if dedup != 'none':
+        records = deduplicate(records, near=dedup == 'near')
+
+    if version >= 0:
+        # Imported here so that messages are ingested without analysis dependencies
+        from .analysis import SentimentAnalyzer
+        analyzer = SentimentAnalyzer(version, threshold)
+        records = analyze(prefetch(records), analyzer, batch_size)
+
+    count = write(records, outfile)
+    print('{} messages written to {}'.format(count, outfile))
@@ -0,0 +1,158 @@
+'''Display and outputs of frames received from the bus, without any model.
+
+Nothing here imports TensorFlow or transformers: a renderer only needs the
+memory of its window and its OSC / MIDI outputs.
+'''
+import queue
+import threading
+import tkinter as tk
+from typing import Any, Dict, List, Optional
+
+import mido
+import yaml
+
+from .bus import Subscriber
+from .output import OutputThread
+
+
+class RondeRenderer():
+    '''Shows frames published by an analysis node.
+
+    Frames are received by a background thread. The display only applies the
+    latest frame received, so all renderers show the same frame at the same time.
+
+    Attributes
+    ----------
+    config : dict
+        configuration, with 'display', 'print', 'osc', 'midi' and 'bus' sections
+    root : tk.Tk or None
+        window showing the frames. None without display.
+    frames : queue.Queue
+        frames received and not shown yet
+    output : OutputThread
+        thread sending OSC and MIDI
+    '''
+
+    def __init__(self,
+                 config: Dict[str, Any],
+                 root: Optional[tk.Tk] = None) -> None:
+        self.config = config
+        self.root = root
+        self.frames: queue.Queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.shown: Dict[str, Any] = {'text': None, 'fg': None, 'bg': None}
+
+        self.midi_outports: List[Any] = []
+        for _ in range(config['midi']['nb_port']):
+            try:
+                self.midi_outports.append(mido.open_output())
+            except OSError:
+                print('No MIDI output port available')
+        self.output = OutputThread(config, self.midi_outports)
+        # Streamed colors are interpolated over the transition of the analysis node
+        self.transition = config.get('manager', {}).get('transition', 0) / 1000
+
+        if self.root:
+            self.frame = tk.Frame(master=self.root, background='black')
+            self.label = tk.Label(master=self.frame, text="Waiting for 'La Ronde de Nuit'...",
+                                  font=('Arial', 30), background='black', foreground='white',
+                                  wraplength=600, justify='center')
+            self.label.pack(fill=tk.BOTH, expand=True)
+            self.frame.pack(fill=tk.BOTH, side=tk.TOP, expand=True)
+
+    def receive(self) -> None:
+        '''Receive frames until stopped. Run by a background thread.
+        '''
+        subscriber = Subscriber(self.config.get('bus'), timeout=0.5)
+        while not self.stopped.is_set():
+            frame = subscriber.receive()
+            if frame is None:
+                continue
+            if self.root:
+                self.frames.put(frame)
+            else:
+                self.show(frame)
+        subscriber.close()
+
+    def poll(self) -> None:
+        '''Show the latest frame received. Scheduled by Tk.
+        '''
+        frame = None
+        while not self.frames.empty():
+            frame = self.frames.get_nowait()
+        if frame:
+            self.show(frame)
+        self.root.after(5, self.poll)
+
+    def show(self,
+             frame: Dict[str, Any]) -> None:
+        '''Show a frame and send it to OSC / MIDI.
+        '''
+        self.output.send(frame['label'], frame['score'], frame['fg'], frame['bg'], self.transition)
+
+        if self.root:
+            text = frame['pseudo'] + ' : ' + frame['msg'] if self.config['display']['text'] else ''
+            if text != self.shown['text']:
+                self.label.configure(text=text)
+                self.shown['text'] = text
+
+            if self.config['display']['colors']:
+                if frame['bg'] != self.shown['bg']:
+                    self.frame.configure(background=frame['bg'])
+                    self.label.configure(background=frame['bg'])
+                    self.shown['bg'] = frame['bg']
+                if frame['fg'] != self.shown['fg']:
+                    self.label.configure(foreground=frame['fg'])
+                    self.shown['fg'] = frame['fg']
+
+        if self.config['print']['text'] and frame['msg'] != self.shown.get('msg'):
+            self.shown['msg'] = frame['msg']
+            if self.config['print']['mode'] == 'debug':
+                print('#### Pseudo: {} ---- Sequence: {} ---- Label: {} ---- Score: {}####'.format(
+                    frame['pseudo'], frame['msg'], frame['label'], frame['score']))
+            else:
+                print(frame['pseudo'], ' : ', frame['msg'])
+
+    def mainloop(self) -> None:
+        '''Run until the window is closed or Ctrl+C.
+        '''
+        self.output.start()
+        receiver = threading.Thread(target=self.receive, name='bus', daemon=True)
+        receiver.start()
+        try:
+            if self.root:
+                self.root.after(5, self.poll)
+                self.root.mainloop()
+            else:
+                receiver.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            receiver.join()
+            self.output.stop()
+            for port in self.midi_outports:
+                port.close()
+
+
+def create_renderer(configpath: str) -> RondeRenderer:
+    '''Creates a renderer of frames received from the bus.
+
+    Args
+    ----
+    configpath : str
+        path to the configuration file
+
+    Returns
+    -------
+    RondeRenderer
+        the renderer
+    '''
+    with open(configpath, 'r') as f:
+        config = yaml.load(f, yaml.FullLoader)
+
+    root = None
+    if config['display']['colors'] or config['display']['text']:
+        root = tk.Tk()
+
+    return RondeRenderer(config, root)
@@ -1,91 +1,567 @@
+import json
+import multiprocessing
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import tensorflow as tf
+import yaml
 from sklearn.model_selection import train_test_split
-from transformers import (CamembertTokenizerFast,
-                          TFCamembertForSequenceClassification, TFTrainer,
-                          TFTrainingArguments)
+from transformers import TFCamembertForSequenceClassification, create_optimizer
 
-from .dataset import get_split
+from .dataset import find_split, get_split, read_split
+from .encoding import (EncodedShards, bucket_boundaries, bucketed_dataset,
+                       encode_split, length_percentile, padding_ratio)
+from .distributed import is_chief
+from .performance import DEFAULT_PROFILE
 
+# Default training configuration, see config/train.yaml
+TRAIN_CONFIG: Dict[str, Any] = {
+    'training': {
+        'epochs': 50,
+        'train_batch_size': 16,
+        'eval_batch_size': 64,
+        'learning_rate': 5e-5,
+        'warmup_steps': 50,
+        'weight_decay': 0.01,
+        'validation': 0.2,
+        'seed': 0,
+        'patience': 3,
+        'min_delta': 0.0,
+    },
+    'checkpoints': {
+        'folder': 'checkpoints',
+        'every': 'epoch',
+        'keep': 5,
+        'resume': True,
+        'select': True,
+        'jobs': 2,
+    },
+    'data': {
+        'cache': 'cache/encodings',
+        'length_percentile': 99,
+        'buckets': 8,
+        'shuffle': 10000,
+    },
+    'incremental': {
+        'epochs': 3,
+        'learning_rate': 2e-5,
+        'replay': 1.0,
+        'pool': 'data/pre',
+        'batch': 200,
+        'next_batch': 'data/next_batch.csv',
+    },
+    'performance': DEFAULT_PROFILE,
+    'output': 'results',
+    'logs': 'logs',
+}
 
-def compute_metrics(eval_pred):
-    """Metric used for prediction.
-    """
-    predictions, _ = eval_pred
-    predictions = np.argmax(predictions, axis=1)
-    return predictions
+
+def load_train_config(path: str = '') -> Dict[str, Any]:
+    '''Load a training configuration, completed with default values.
+
+    Args
+    ----
+    path : str, optional
+        path to the YAML configuration file. If empty, default values are used.
+        Default is ''.
+
+    Returns
+    -------
+    dict
+        training configuration
+    '''
+    config = {key: value.copy() if isinstance(value, dict) else value
+              for key, value in TRAIN_CONFIG.items()}
+    if not path:
+        return config
+
+    with open(path, 'r') as f:
+        loaded = yaml.load(f, yaml.FullLoader) or {}
+
+    for key, value in loaded.items():
+        if isinstance(value, dict):
+            config.setdefault(key, {}).update(value)
+        else:
+            config[key] = value
+    return config
 
 
 def retrain(folder,
             token_model='camembert-base',
-            sentiment_model='tblard/tf-allocine'):
+            sentiment_model='tblard/tf-allocine',
+            config: Optional[Dict[str, Any]] = None,
+            callbacks: Optional[List[tf.keras.callbacks.Callback]] = None,
+            strategy: Optional[tf.distribute.Strategy] = None):
     '''Retrain a sentiment analysis model.
 
+    Sequences are truncated to a percentile of the token lengths and batched
+    with sequences of similar length, so batches are only padded to their own
+    longest sequence.
+
+    Training stops once the validation loss stops improving and can resume
+    from its last epoch after an interruption. The retained checkpoints are
+    then evaluated on the test split and the best one is exported.
+
     Args
     ----
     folder : str
         folder to containing data to retrain from.
         Folder should contain 2 csv files named train.csv (for training) and test.csv (for testing).
+        Splits can also be stores (train.parquet or train.arrow).
     token_model : str, optional
         Model used for tokenisation. It should be a pretrained from CamembertTokenizerFast class.
         Default is 'camembert-base'.
     sentiment_model : str, optional
         Model used for retraining. It should be a pretrained from TFCamembertForSequenceClassification. 
         Default is 'tblard/tf-allocine'.
+    config : dict, optional
+        training configuration (see config/train.yaml). If None, default values are used.
+        Default is None.
+    callbacks : list of tf.keras.callbacks.Callback, optional
+        additional Keras callbacks, such as MedianPruner.
+        Default is None.
+    strategy : tf.distribute.Strategy, optional
+        distribution strategy, such as the one of create_strategy. With several workers,
+        batch sizes of the configuration are per worker and only the chief writes files.
+        Default is None.
 
     Returns
     -------
-    TFTrainer
-        trained model. Model is also saved in results folder.
+    TFCamembertForSequenceClassification
+        trained model, with the weights of the best checkpoint. Model is also saved in results folder.
     '''
+    config = config or load_train_config()
+    params, data = config['training'], config['data']
+    strategy = strategy or tf.distribute.get_strategy()
+    chief = is_chief(strategy)
+
+    # Datasets are batched globally, then split between replicas
+    train_batch_size = params['train_batch_size'] * strategy.num_replicas_in_sync
+    eval_batch_size = params['eval_batch_size'] * strategy.num_replicas_in_sync
 
-    train_texts, train_labels = get_split(os.path.join(folder, 'train.csv'))
+    train_texts, train_labels = get_split(find_split(folder, 'train'))
 
     train_texts, val_texts, train_labels, val_labels = train_test_split(
-        train_texts, train_labels, test_size=.2)
-
-    tokenizer = CamembertTokenizerFast.from_pretrained(token_model)
-
-    train_encodings = tokenizer(train_texts, truncation=True, padding=True)
-    val_encodings = tokenizer(val_texts, truncation=True, padding=True)
-
-    train_dataset = tf.data.Dataset.from_tensor_slices((
-        dict(train_encodings),
-        train_labels
-    ))
-    val_dataset = tf.data.Dataset.from_tensor_slices((
-        dict(val_encodings),
-        val_labels
-    ))
-
-    training_args = TFTrainingArguments(
-        output_dir='./results',          # output directory
-        num_train_epochs=50,             # total number of training epochs
-        per_device_train_batch_size=16,  # batch size per device during training
-        per_device_eval_batch_size=64,   # batch size for evaluation
-        warmup_steps=50,                 # number of warmup steps for learning rate scheduler
-        weight_decay=0.01,               # strength of weight decay
-        logging_dir='./logs',            # directory for storing logs
-        logging_steps=10,
-        save_strategy='steps',
-        save_steps=10,
-        save_total_limit=5,
-        debug=True
-    )
-
-    with training_args.strategy.scope():
+        train_texts, train_labels, test_size=params['validation'], random_state=params['seed'])
+
+    train_shards = EncodedShards(encode_split(
+        train_texts, train_labels, token_model, data['cache']))
+    val_shards = EncodedShards(encode_split(
+        val_texts, val_labels, token_model, data['cache']))
+
+    # Lengths are computed on training data only
+    max_length = length_percentile(train_shards, data['length_percentile'])
+    lengths = np.minimum(train_shards.lengths(), max_length)
+    boundaries = bucket_boundaries(lengths, data['buckets'])
+
+    stats = report_padding(train_shards, max_length, boundaries,
+                           train_batch_size, params['seed'])
+
+    # Generated data can not be sharded by file: each worker keeps its share of the elements
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    train_dataset = bucketed_dataset(train_shards, train_batch_size, max_length,
+                                     boundaries, data['shuffle'], params['seed']).with_options(options)
+    val_dataset = bucketed_dataset(val_shards, eval_batch_size, max_length,
+                                   boundaries).with_options(options)
+
+    checkpoints = config['checkpoints']
+    backup = os.path.join(checkpoints['folder'], 'backup')
+    if chief and not (checkpoints['resume'] and os.path.isdir(backup)):
+        # Checkpoints of a previous, completed training are not mixed with new ones
+        shutil.rmtree(checkpoints['folder'], ignore_errors=True)
+
+    with strategy.scope():
         model = TFCamembertForSequenceClassification.from_pretrained(
             sentiment_model)
+        optimizer, _ = create_optimizer(
+            init_lr=params['learning_rate'],
+            num_train_steps=stats['batches'] * params['epochs'],
+            num_warmup_steps=params['warmup_steps'],
+            weight_decay_rate=params['weight_decay'])
+        compile_model(model, optimizer, config['performance']['xla'])
+
+    callbacks = list(callbacks or [])
+    if chief:
+        callbacks += [tf.keras.callbacks.TensorBoard(log_dir=config['logs']),
+                      RetainedCheckpoints(checkpoints['folder'], checkpoints['every'], checkpoints['keep'])]
+    if params['patience']:
+        callbacks.append(tf.keras.callbacks.EarlyStopping(
+            monitor='val_loss', patience=params['patience'], min_delta=params['min_delta'],
+            restore_best_weights=True, verbose=1))
+    if checkpoints['resume']:
+        # Restores weights, optimizer and epoch after an interruption. Removed once training ends.
+        callbacks.append(tf.keras.callbacks.BackupAndRestore(backup))
+
+    history = model.fit(train_dataset,
+                        validation_data=val_dataset,
+                        epochs=params['epochs'],
+                        callbacks=callbacks)
+    stats['epochs'] = len(history.history.get('loss', []))
+
+    if not chief:
+        return model
+
+    os.makedirs(config['output'], exist_ok=True)
+    with open(os.path.join(config['output'], 'data_stats.json'), 'w') as f:
+        json.dump(stats, f, indent=4)
+
+    if checkpoints['select']:
+        select_best_checkpoint(folder, token_model, sentiment_model, config, model)
+
+    return model
+
+
+def compile_model(model: TFCamembertForSequenceClassification,
+                  optimizer: Any = 'adam',
+                  xla: bool = False) -> None:
+    '''Compile a model with the loss and metrics used for training and evaluation.
+
+    If xla is True, the training step (forward, loss and gradients) is compiled with XLA.
+    '''
+    model.compile(optimizer=optimizer,
+                  loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                  metrics=['accuracy'],
+                  jit_compile=xla)
+
+
+class RetainedCheckpoints(tf.keras.callbacks.Callback):
+    '''Keras callback saving weights at a given cadence and keeping the last ones.
+
+    Checkpoints are named after the optimizer step, so their names stay
+    consistent when training is resumed. They are listed in checkpoints.json.
+
+    Attributes
+    ----------
+    folder : str
+        folder of the checkpoints
+    every : int or None
+        number of steps between checkpoints. None means at the end of each epoch.
+    keep : int
+        number of retained checkpoints. Older ones are removed.
+    manifest : list of dict
+        path, step, epoch and validation loss of each retained checkpoint
+    '''
+
+    def __init__(self,
+                 folder: str,
+                 every: Any = 'epoch',
+                 keep: int = 5) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        folder : str
+            folder of the checkpoints
+        every : int or str, optional
+            number of steps between checkpoints, or 'epoch'.
+            Default is 'epoch'.
+        keep : int, optional
+            number of retained checkpoints.
+            Default is 5.
+        '''
+        super().__init__()
+        self.folder = folder
+        self.every = None if every == 'epoch' else int(every)
+        self.keep = keep
+        self.epoch = 0
+        self.manifest = read_checkpoints(folder)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        step = int(self.model.optimizer.iterations)
+        if self.every and step % self.every == 0:
+            self.save(step)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.every is None:
+            self.save(int(self.model.optimizer.iterations), (logs or {}).get('val_loss'))
+
+    def save(self,
+             step: int,
+             val_loss: Optional[float] = None) -> None:
+        '''Save the weights of the model and remove old checkpoints.
+        '''
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, 'ckpt-{:07d}.h5'.format(step))
+        self.model.save_weights(path)
+
+        self.manifest = [x for x in self.manifest if x['path'] != path]
+        self.manifest.append({'path': path,
+                              'step': step,
+                              'epoch': self.epoch + 1,
+                              'val_loss': None if val_loss is None else float(val_loss)})
+
+        while len(self.manifest) > self.keep:
+            old = self.manifest.pop(0)
+            if os.path.isfile(old['path']):
+                os.remove(old['path'])
+
+        with open(os.path.join(self.folder, 'checkpoints.json'), 'w') as f:
+            json.dump(self.manifest, f, indent=4)
+
+
+def read_checkpoints(folder: str) -> List[Dict[str, Any]]:
+    '''Returns the retained checkpoints of a folder, oldest first.
+    '''
+    path = os.path.join(folder, 'checkpoints.json')
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return [x for x in json.load(f) if os.path.isfile(x['path'])]
+
+
+class MedianPruner(tf.keras.callbacks.Callback):
+    '''Keras callback stopping a trial whose validation loss is worse than the median of other trials.
+
+    Trials of a sweep share a folder, each one in its own subfolder. After each
+    epoch, a trial writes its validation losses in progress.json and compares
+    its loss to the losses of the other trials at the same epoch. This works
+    across processes without any coordinator.
+
+    Attributes
+    ----------
+    folder : str
+        folder of the trial, inside the folder of the sweep
+    warmup : int
+        number of epochs before a trial can be pruned
+    min_trials : int
+        minimal number of other trials having reached an epoch to compare with them
+    losses : list of float
+        validation loss of each epoch
+    pruned : bool
+        True if the trial was stopped by the pruner
+    '''
+
+    def __init__(self,
+                 folder: str,
+                 warmup: int = 1,
+                 min_trials: int = 2) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        folder : str
+            folder of the trial, inside the folder of the sweep
+        warmup : int, optional
+            number of epochs before a trial can be pruned.
+            Default is 1.
+        min_trials : int, optional
+            minimal number of other trials having reached an epoch.
+            Default is 2.
+        '''
+        super().__init__()
+        self.folder = folder
+        self.warmup = warmup
+        self.min_trials = min_trials
+        self.losses: List[float] = []
+        self.pruned = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        loss = (logs or {}).get('val_loss')
+        if loss is None:
+            return
+        self.losses.append(float(loss))
+
+        # Written atomically as other trials read it at any time
+        path = os.path.join(self.folder, 'progress.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.losses, f)
+        os.replace(path + '.tmp', path)
+
+        others = []
+        for name in os.listdir(os.path.dirname(os.path.abspath(self.folder))):
+            other = os.path.join(os.path.dirname(os.path.abspath(self.folder)), name, 'progress.json')
+            if os.path.abspath(other) == os.path.abspath(path) or not os.path.isfile(other):
+                continue
+            with open(other) as f:
+                values = json.load(f)
+            if len(values) > epoch:
+                others.append(values[epoch])
+
+        if epoch + 1 >= self.warmup and len(others) >= self.min_trials \
+                and loss > np.median(others):
+            print('Trial pruned at epoch {}: validation loss {:.4f} above median {:.4f}'.format(
+                epoch + 1, loss, np.median(others)))
+            self.pruned = True
+            self.model.stop_training = True
+
+
+def evaluate_checkpoint(path: str,
+                        shards_path: str,
+                        sentiment_model: str,
+                        batch_size: int,
+                        buckets: int,
+                        threads: int = 0) -> Tuple[float, float]:
+    '''Evaluate a checkpoint on an encoded split. Run in a separate process.
+
+    Args
+    ----
+    path : str
+        path to the checkpoint weights
+    shards_path : str
+        folder of the encoded split
+    sentiment_model : str
+        model the checkpoint was trained from
+    batch_size : int
+        number of sequences per batch
+    buckets : int
+        number of length buckets
+    threads : int, optional
+        number of threads used by TensorFlow. If 0, TensorFlow decides.
+        Default is 0.
 
-    trainer = TFTrainer(model=model,
-                        args=training_args,
-                        train_dataset=train_dataset,
-                        eval_dataset=val_dataset,
-                        compute_metrics=compute_metrics
-                        )
+    Returns
+    -------
+    float
+        loss on the split
+    float
+        accuracy on the split
+    '''
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    shards = EncodedShards(shards_path)
+    max_length = max(shards.meta['longest'], 2)
+    dataset = bucketed_dataset(shards, batch_size, max_length,
+                               bucket_boundaries(shards.lengths(), buckets))
+
+    model = TFCamembertForSequenceClassification.from_pretrained(sentiment_model)
+    compile_model(model)
+    model.load_weights(path)
+
+    loss, accuracy = model.evaluate(dataset, verbose=0)
+    return float(loss), float(accuracy)
+
+
+def select_best_checkpoint(folder: str,
+                           token_model: str = 'camembert-base',
+                           sentiment_model: str = 'tblard/tf-allocine',
+                           config: Optional[Dict[str, Any]] = None,
+                           model: Optional[TFCamembertForSequenceClassification] = None
+                           ) -> Optional[Dict[str, Any]]:
+    '''Evaluate the retained checkpoints on the test split and export the best one.
+
+    Checkpoints are evaluated in parallel processes. The best accuracy wins,
+    ties are broken by the lowest loss. The best checkpoint is saved in the
+    output folder with save_pretrained, with the scores of every checkpoint in
+    checkpoints.json and the hashes of the train split annotations in seen.json.
+
+    Args
+    ----
+    folder : str
+        folder containing the test split (test.csv or a store)
+    token_model : str, optional
+        model used for tokenisation.
+        Default is 'camembert-base'.
+    sentiment_model : str, optional
+        model the checkpoints were trained from.
+        Default is 'tblard/tf-allocine'.
+    config : dict, optional
+        training configuration (see config/train.yaml). If None, default values are used.
+        Default is None.
+    model : TFCamembertForSequenceClassification, optional
+        model in which the best weights are loaded. If None, it is created from sentiment_model.
+        Default is None.
+
+    Returns
+    -------
+    dict or None
+        best checkpoint with its scores. None if there is no checkpoint.
+    '''
+    config = config or load_train_config()
+    params, data = config['training'], config['data']
+    checkpoints = read_checkpoints(config['checkpoints']['folder'])
+    if not checkpoints:
+        print('No checkpoint to select from in {}'.format(config['checkpoints']['folder']))
+        return None
+
+    test_texts, test_labels = get_split(find_split(folder, 'test'))
+    test_shards = encode_split(test_texts, test_labels, token_model, data['cache'])
+
+    jobs = max(min(config['checkpoints']['jobs'], len(checkpoints)), 1)
+    threads = max((os.cpu_count() or 1) // jobs, 1)
+    # TensorFlow is not fork-safe
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(evaluate_checkpoint, x['path'], test_shards, sentiment_model,
+                                   params['eval_batch_size'], data['buckets'], threads)
+                   for x in checkpoints]
+        for checkpoint, future in zip(checkpoints, futures):
+            checkpoint['test_loss'], checkpoint['test_accuracy'] = future.result()
+            print('{}: loss {:.4f}, accuracy {:.2%}'.format(
+                checkpoint['path'], checkpoint['test_loss'], checkpoint['test_accuracy']))
+
+    best = max(checkpoints, key=lambda x: (x['test_accuracy'], -x['test_loss']))
+    print('Best checkpoint: {} (epoch {}, step {})'.format(best['path'], best['epoch'], best['step']))
+
+    if model is None:
+        model = TFCamembertForSequenceClassification.from_pretrained(sentiment_model)
+        compile_model(model)
+    model.load_weights(best['path'])
+    model.save_pretrained(config['output'])
+
+    # Annotations of the train split are replayed, not trained on again, by incremental rounds
+    from .active import annotation_hash, write_seen
+    train = read_split(find_split(folder, 'train'))
+    write_seen(os.path.join(config['output'], 'seen.json'),
+               (annotation_hash(x, y) for x, y in zip(train['sequence'], train['label'])))
+
+    with open(os.path.join(config['output'], 'checkpoints.json'), 'w') as f:
+        json.dump({'best': best, 'checkpoints': checkpoints}, f, indent=4)
+
+    return best
+
+
+def report_padding(shards: EncodedShards,
+                   max_length: int,
+                   boundaries,
+                   batch_size: int,
+                   seed: int = 0) -> Dict[str, Any]:
+    '''Print the share of padding tokens before and after length bucketing.
+
+    Before means every sequence padded to the longest one, as a whole split
+    tokenized with padding=True.
+
+    Args
+    ----
+    shards : EncodedShards
+        encoded training split
+    max_length : int
+        maximal number of tokens of a sequence
+    boundaries : list of int
+        bucket boundaries
+    batch_size : int
+        number of sequences per batch
+    seed : int, optional
+        seed of the shuffling.
+        Default is 0.
+
+    Returns
+    -------
+    dict
+        padding statistics and number of batches per epoch
+    '''
+    lengths = shards.lengths()
+    before, _ = padding_ratio(lengths, [], len(lengths) or 1)
+    after, batches = padding_ratio(np.minimum(lengths, max_length), boundaries,
+                                   batch_size, seed)
 
-    trainer.train()
-    trainer.save_model('results')
-    return trainer
+    stats = {
+        'sequences': len(lengths),
+        'longest': int(lengths.max()) if len(lengths) else 0,
+        'max_length': max_length,
+        'bucket_boundaries': list(boundaries),
+        'padding_before': float(before),
+        'padding_after': float(after),
+        'batches': batches,
+    }
+    print('Padding: {:.1%} of tokens when padded to the longest sequence ({}), '
+          '{:.1%} with length buckets (max length {})'.format(
+              before, stats['longest'], after, max_length))
+    return stats
@@ -0,0 +1,119 @@
+'''Frame clock based on monotonic deadlines.
+
+Frame i is due at start + i * interval, whatever the time spent handling the
+previous frames. When handling a frame takes longer than the interval (such as
+during an analysis), the clock tells how many frames are due at once, so that
+late frames are skipped instead of slowing the whole transition down.
+'''
+import time
+from typing import Optional
+
+
+class FrameClock():
+    '''Clock giving the frames due at each tick.
+
+    Attributes
+    ----------
+    interval : float
+        duration (in seconds) of a frame
+    report : float
+        delay (in seconds) between 2 reports of the achieved frame rate. 0 disables reports.
+    start : float or None
+        time of frame 0. None until the first tick.
+    frame : int
+        index of the last frame shown
+    shown : int
+        number of frames shown since the last report
+    dropped : int
+        number of frames skipped since the clock was created
+    '''
+
+    def __init__(self,
+                 interval: float,
+                 report: float = 0.0) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        interval : float
+            duration (in seconds) of a frame
+        report : float, optional
+            delay (in seconds) between 2 reports of the achieved frame rate. 0 disables reports.
+            Default is 0.0.
+        '''
+        self.interval = interval
+        self.report = report
+        self.start: Optional[float] = None
+        self.frame = 0
+        self.shown = 0
+        self.dropped = 0
+        self.reported = time.monotonic()
+
+    def set_interval(self,
+                     interval: float) -> None:
+        '''Change the duration of a frame. Deadlines restart from the next tick.
+        '''
+        self.interval = interval
+        self.start = None
+
+    def reset(self) -> None:
+        '''Restart the clock at the next tick, such as after an idle period.
+        '''
+        self.start = None
+
+    def tick(self) -> int:
+        '''Register a frame about to be shown.
+
+        Returns
+        -------
+        int
+            number of frames due since the previous tick (at least 1).
+            All of them but the last one should be skipped.
+        '''
+        now = time.monotonic()
+        self.shown += 1
+
+        if self.start is None or self.interval <= 0:
+            self.start = now
+            self.frame = 0
+            frames = 1
+        else:
+            due = int((now - self.start) / self.interval)
+            frames = max(due - self.frame, 1)
+            self.frame += frames
+
+        if self.report and now - self.reported >= self.report:
+            print(self.summary(now))
+            self.shown = 0
+            self.reported = now
+
+        return frames
+
+    def drop(self,
+             count: int) -> None:
+        '''Register frames skipped after a tick.
+        '''
+        self.dropped += count
+
+    def delay(self) -> float:
+        '''Returns the time (in seconds) until the next frame is due.
+        '''
+        if self.start is None:
+            return self.interval
+        deadline = self.start + (self.frame + 1) * self.interval
+        return max(deadline - time.monotonic(), 0.0)
+
+    def fps(self,
+            now: Optional[float] = None) -> float:
+        '''Returns the frame rate achieved since the last report.
+        '''
+        elapsed = (now or time.monotonic()) - self.reported
+        return self.shown / elapsed if elapsed > 0 else 0.0
+
+    def summary(self,
+                now: Optional[float] = None) -> str:
+        '''Returns a printable summary of the achieved frame rate.
+        '''
+        target = 1 / self.interval if self.interval > 0 else float('inf')
+        return '{:.1f} FPS (target {:.1f}), {} frames dropped'.format(
+            self.fps(now), target, self.dropped)
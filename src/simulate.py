@@ -0,0 +1,360 @@
+'''Offline render of a recorded source, faster than real time.
+
+The manager and its ColorManager run over a recorded source with no waits and
+no model: a ReplayAnalyzer gives back the analysis recorded in a JSON file
+(as written by analyze_file.py). Sources are either a messages file, read
+once, or a captured sequence of HTML pages of the website, read one page per
+poll as OnlineMsgManager would.
+
+Every frame the display would show is kept in a timeline:
+    fg, bg : (frames, 3) float32, RGB colors between 0 and 1
+    label : (frames,) int8, index in LABELS
+    score : (frames,) float32
+    key : (frames,) bool, True for the frame of a new message (end of a transition)
+    transition : duration (in ms) of a frame
+It can be saved as a NumPy archive, an image strip or a video.
+'''
+import glob
+import os
+import shutil
+import subprocess
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import ftfy
+import numpy as np
+from colour import Color, hex2rgb
+
+from .format import RondeHTML, read_messages, remove_irc_formatting
+from .manager import AbstractMsgManager, JsonMsgManager
+
+# Labels of the timeline, in the order of their index
+LABELS = ('negative', 'neutral', 'positive')
+
+# Colors of labels in the image strip
+LABEL_RGB = np.array([[0.8, 0.1, 0.1], [0.5, 0.5, 0.5], [0.1, 0.7, 0.2]], dtype=np.float32)
+
+
+class ReplayAnalyzer():
+    '''Analyzer giving back recorded analyses instead of running a model.
+
+    Attributes
+    ----------
+    name : str
+        model whose recorded analyses are used, such as 'camembert' or 'default'
+    threshold : float
+        score under which a label is set to 'neutral'. Can differ from the recorded one.
+    results : dict
+        recorded score and label of each message
+    missing : int
+        number of messages analyzed without recorded analysis, set to neutral
+    '''
+
+    def __init__(self,
+                 records: Iterable[Dict[str, Any]],
+                 name: str = 'camembert',
+                 threshold: float = 0.66) -> None:
+        '''Initialization.
+
+        Args
+        ----
+        records : iterable of dict
+            analyzed messages, with a 'message' key and a name key holding 'label' and 'score'
+        name : str, optional
+            model whose recorded analyses are used.
+            Default is 'camembert'.
+        threshold : float, optional
+            score under which a label is set to 'neutral'.
+            Default is 0.66.
+        '''
+        self.name = name
+        self.threshold = threshold
+        self.missing = 0
+        self.results: Dict[str, Tuple[float, str]] = {}
+        for elem in records:
+            analysis = elem.get(name)
+            if 'message' in elem and isinstance(analysis, dict):
+                # Keyed as messages are formatted by the manager before analysis
+                msg = ftfy.ftfy(remove_irc_formatting(elem['message']))
+                self.results[msg] = (float(analysis['score']), analysis['label'].lower())
+
+    def analyze(self,
+                msg: str) -> Tuple[float, str]:
+        '''Returns the recorded score and label of a message, as SentimentAnalyzer.analyze.
+        '''
+        if msg not in self.results:
+            self.missing += 1
+            return 0.0, 'neutral'
+        score, label = self.results[msg]
+        return score, 'neutral' if score < self.threshold else label
+
+
+class CapturedMsgManager(AbstractMsgManager):
+    '''Class to handle a captured sequence of HTML pages, one page per read.
+
+    Attributes
+    ----------
+    pages : list of str
+        paths to the HTML pages not read yet, in capture order
+    parser : RondeHTML
+        HTML parser used to handle data from the HTML table
+    '''
+
+    def __init__(self,
+                 config: Dict,
+                 pages: List[str],
+                 analyzer: Optional[Any] = None):
+        super().__init__(config, analyzer)
+        self.pages = list(pages)
+        self.parser = RondeHTML()
+
+    def parse_data(self,
+                   url: str) -> None:
+        if not self.pages:
+            return
+        with open(self.pages.pop(0), 'r', encoding='utf8', errors='replace') as f:
+            text = f.read()
+        self.parser.clean()
+        self.parser.feed(text)
+        self.set_messages_and_pseudos(self.parser.stack, self.parser.pseudo_stack)
+
+
+def captured_pages(source: str) -> List[str]:
+    '''Returns the HTML pages of a capture, given as a folder or a glob pattern, sorted by name.
+    '''
+    if os.path.isdir(source):
+        source = os.path.join(source, '*.html')
+    return sorted(glob.glob(source))
+
+
+def create_manager(config: Dict[str, Any],
+                   source: str,
+                   analyzer: Any) -> Tuple[AbstractMsgManager, int]:
+    '''Creates the manager of a recorded source.
+
+    Args
+    ----
+    config : dict
+        configuration, with 'colors' and 'manager' sections
+    source : str
+        messages file, or folder / glob pattern of captured HTML pages
+    analyzer : ReplayAnalyzer
+        analyzer of messages
+
+    Returns
+    -------
+    AbstractMsgManager
+        the manager
+    int
+        number of reads of the source
+    '''
+    if os.path.isfile(source) and not source.endswith(('.html', '.htm')):
+        return JsonMsgManager(config, analyzer), 1
+
+    pages = captured_pages(source)
+    if not pages:
+        raise ValueError('{}: no messages file nor HTML pages'.format(source))
+    return CapturedMsgManager(config, pages, analyzer), len(pages)
+
+
+def simulate(manager: AbstractMsgManager,
+             reads: int = 1,
+             source: str = '') -> Dict[str, Any]:
+    '''Run a manager over its source with no waits and returns the timeline of frames.
+
+    Args
+    ----
+    manager : AbstractMsgManager
+        manager of the recorded source
+    reads : int, optional
+        number of reads of the source. Frames are handled after each read, as
+        when the display runs out of messages.
+        Default is 1.
+    source : str, optional
+        path given to the manager's parse_data.
+        Default is ''.
+
+    Returns
+    -------
+    dict
+        timeline of frames (see module documentation)
+    '''
+    rgb_cache: Dict[str, Tuple[float, float, float]] = {}
+
+    def rgb(color):
+        # Transition colors are hexadecimal strings, key colors are those of the configuration
+        if isinstance(color, Color):
+            return color.rgb
+        if color not in rgb_cache:
+            rgb_cache[color] = hex2rgb(color) if color.startswith('#') else Color(color).rgb
+        return rgb_cache[color]
+
+    label_index = {x: i for i, x in enumerate(LABELS)}
+    fg, bg, label, score, key = [], [], [], [], []
+    for _ in range(reads):
+        manager.parse_data(source)
+        while manager.has_messages() or manager.stack:
+            data = manager.next_data()
+            if data is None:
+                break
+            _, _, dfg, dbg, dlabel, dscore = data
+            fg.append(rgb(dfg))
+            bg.append(rgb(dbg))
+            label.append(label_index.get(dlabel, 1))
+            score.append(dscore)
+            # The new message ends its transition and empties the stack
+            key.append(not manager.stack)
+
+    return {
+        'fg': np.array(fg, dtype=np.float32).reshape(-1, 3),
+        'bg': np.array(bg, dtype=np.float32).reshape(-1, 3),
+        'label': np.array(label, dtype=np.int8),
+        'score': np.array(score, dtype=np.float32),
+        'key': np.array(key, dtype=bool),
+    }
+
+
+def save_timeline(timeline: Dict[str, Any],
+                  path: str) -> None:
+    '''Save a timeline as a compressed NumPy archive (.npz).
+    '''
+    np.savez_compressed(path, **timeline)
+
+
+def strip_image(timeline: Dict[str, Any],
+                width: int = 1920,
+                height: int = 120) -> np.ndarray:
+    '''Returns the timeline as an image strip, time going from left to right.
+
+    The top of the strip is the background color, then the text color, then the label.
+    Longer timelines are sampled down to the width.
+
+    Returns
+    -------
+    np.ndarray
+        (height, width, 3) uint8 image
+    '''
+    frames = len(timeline['label'])
+    if frames == 0:
+        return np.zeros((height, 0, 3), dtype=np.uint8)
+    columns = np.linspace(0, frames - 1, min(width, frames)).astype(np.int64)
+
+    bands = (
+        (timeline['bg'][columns], height * 3 // 5),
+        (timeline['fg'][columns], height // 5),
+        (LABEL_RGB[timeline['label'][columns]], height - height * 3 // 5 - height // 5),
+    )
+    image = np.concatenate([np.repeat(colors[None], rows, axis=0) for colors, rows in bands])
+    return (np.clip(image, 0, 1) * 255).round().astype(np.uint8)
+
+
+def save_strip(timeline: Dict[str, Any],
+               path: str,
+               width: int = 1920,
+               height: int = 120) -> None:
+    '''Save a timeline as an image strip (see strip_image).
+    '''
+    from skimage import io
+    io.imsave(path, strip_image(timeline, width, height), check_contrast=False)
+
+
+def save_video(timeline: Dict[str, Any],
+               path: str,
+               fps: float = 30,
+               speed: float = 1.0,
+               size: Tuple[int, int] = (320, 180)) -> int:
+    '''Save a timeline as a video with ffmpeg, the text color as a band below the background.
+
+    Args
+    ----
+    timeline : dict
+        timeline of frames
+    path : str
+        path to the video. Its format depends on its extension.
+    fps : float, optional
+        frame rate of the video. Frames of the timeline are sampled down to it.
+        Default is 30.
+    speed : float, optional
+        playback speed compared to the display.
+        Default is 1.0.
+    size : tuple of int, optional
+        width and height of the video.
+        Default is (320, 180).
+
+    Returns
+    -------
+    int
+        number of frames of the video
+    '''
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise RuntimeError('ffmpeg is needed to write a video')
+
+    frames = len(timeline['label'])
+    duration = frames * float(timeline['transition']) / 1000 / speed
+    count = max(int(duration * fps), 1)
+    indices = np.minimum((np.arange(count) * frames / count).astype(np.int64), frames - 1)
+
+    width, height = size
+    band = height // 6
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-',
+               '-pix_fmt', 'yuv420p', path]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    bg = (timeline['bg'] * 255).round().astype(np.uint8)
+    fg = (timeline['fg'] * 255).round().astype(np.uint8)
+    try:
+        for i in indices:
+            image[:height - band] = bg[i]
+            image[height - band:] = fg[i]
+            process.stdin.write(image.tobytes())
+    finally:
+        process.stdin.close()
+        process.wait()
+    if process.returncode:
+        raise RuntimeError('ffmpeg failed to write {}'.format(path))
+    return count
+
+
+def render(config: Dict[str, Any],
+           source: str,
+           labels: str = '',
+           model: str = 'camembert') -> Dict[str, Any]:
+    '''Render a recorded source and print its throughput.
+
+    Args
+    ----
+    config : dict
+        configuration, with 'colors', 'manager' and 'models' sections. The model
+        threshold is applied to the recorded scores.
+    source : str
+        messages file, or folder / glob pattern of captured HTML pages
+    labels : str, optional
+        analyzed messages file whose analyses are replayed. If empty, the source itself.
+        Default is ''.
+    model : str, optional
+        model whose recorded analyses are replayed.
+        Default is 'camembert'.
+
+    Returns
+    -------
+    dict
+        timeline of frames
+    '''
+    analyzer = ReplayAnalyzer(read_messages(labels or source), model, config['models']['threshold'])
+    manager, reads = create_manager(config, source, analyzer)
+
+    start = time.perf_counter()
+    timeline = simulate(manager, reads, source)
+    elapsed = time.perf_counter() - start
+
+    timeline['transition'] = np.float32(config['manager']['transition'])
+    frames = len(timeline['label'])
+    duration = frames * config['manager']['transition'] / 1000
+    print('{} messages, {} frames ({:.0f} s of display) rendered in {:.2f} s: {:.0f} frames/s, {:.0f}x real time'.format(
+        int(timeline['key'].sum()), frames, duration, elapsed,
+        frames / elapsed if elapsed > 0 else 0, duration / elapsed if elapsed > 0 else 0))
+    if analyzer.missing:
+        print('{} messages without recorded {} analysis were set to neutral'.format(analyzer.missing, model))
+    return timeline
@@ -0,0 +1,307 @@
+'''Long-running soak test of the headless pipeline, tracking memory growth.
+
+The headless engine runs in this process against a local mock website (see
+src.loadtest.MockTableServer), served by a child process so that its growing
+table is not measured, for hours. At each interval, the RSS, the memory
+traced by tracemalloc and the size of the state which may grow (messages and
+pseudos memories, display stack, HTML parser buffers) are sampled.
+
+Growth per hour is the least squares slope of samples taken after a warmup.
+Memory growth is attributed to allocation sites by comparing a tracemalloc
+snapshot taken at the end of the warmup with one taken at the end of the run.
+The test fails when the RSS growth per hour is over a budget.
+'''
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from .config import load_config
+from .format import read_messages
+from .loadtest import MockTableServer, message_source, read_rss
+
+MB = 1024 * 1024
+
+# Allocations of the soak test itself, not counted
+IGNORED = ('*/tracemalloc.py', '*/src/soak.py', '*/src/loadtest.py', '*/http/server.py', '*/socketserver.py')
+
+
+def serve_table(corpus: str,
+                rate: float,
+                urls: Any,
+                stopped: Any) -> None:
+    '''Run a MockTableServer until stopped. Target of the child process of run_soak.
+    '''
+    server = MockTableServer(message_source(corpus), rate)
+    server.start()
+    urls.put(server.url)
+    stopped.wait()
+    server.stop()
+
+
+def state_sizes(ronde: Any) -> Dict[str, int]:
+    '''Returns the number of elements of the state of an application which may grow.
+    '''
+    manager = ronde.manager
+    sizes = {
+        'messages_memory': len(manager.messages_memory),
+        'pseudos_memory': len(manager.pseudos_memory),
+        'messages': len(manager.messages),
+        'arrivals': len(manager.arrivals),
+        'stack': len(manager.stack),
+    }
+    parser = getattr(manager, 'parser', None)
+    if parser is not None:
+        sizes['parser_stack'] = len(parser.stack)
+        sizes['parser_pseudo_stack'] = len(parser.pseudo_stack)
+        sizes['parser_rawdata'] = len(parser.rawdata)
+    return sizes
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    '''Returns a tracemalloc snapshot, without allocations of the soak test itself.
+    '''
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, pattern) for pattern in IGNORED])
+
+
+def slope(samples: List[Dict[str, Any]],
+          key: str,
+          start: float = 0.0) -> float:
+    '''Returns the least squares slope per hour of a sampled value, over samples taken after start.
+
+    key is either a key of the samples or of their 'sizes'.
+    '''
+    points = [(x['time'], x[key] if key in x else x['sizes'].get(key, 0))
+              for x in samples if x['time'] >= start]
+    if len(points) < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in points) / len(points)
+    mean_v = sum(v for _, v in points) / len(points)
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if var == 0:
+        return 0.0
+    return 3600 * sum((t - mean_t) * (v - mean_v) for t, v in points) / var
+
+
+class MemorySampler(threading.Thread):
+    '''Thread sampling memory and state sizes of an application at intervals.
+
+    Attributes
+    ----------
+    samples : list of dict
+        time (in seconds since start), rss and traced memory (in MB) and state sizes
+    baseline : tracemalloc.Snapshot or None
+        snapshot taken at the end of the warmup
+    final : tracemalloc.Snapshot or None
+        snapshot taken when stopped
+    '''
+
+    def __init__(self,
+                 ronde: Any,
+                 interval: float = 60,
+                 warmup: float = 300) -> None:
+        super().__init__(name='soak', daemon=True)
+        self.ronde = ronde
+        self.interval = interval
+        self.warmup = warmup
+        self.samples: List[Dict[str, Any]] = []
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.final: Optional[tracemalloc.Snapshot] = None
+        self.stopped = threading.Event()
+        self.start_time = time.monotonic()
+
+    def sample(self) -> Dict[str, Any]:
+        sample = {
+            'time': time.monotonic() - self.start_time,
+            'rss': read_rss(os.getpid()),
+            'traced': tracemalloc.get_traced_memory()[0] / MB,
+            'sizes': state_sizes(self.ronde),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            sample = self.sample()
+            if self.baseline is None and sample['time'] >= self.warmup:
+                self.baseline = take_snapshot()
+            print('Soak {:.0f} s: RSS {:.1f} MB, traced {:.1f} MB, {}'.format(
+                sample['time'], sample['rss'], sample['traced'],
+                ', '.join('{} {}'.format(k, v) for k, v in sample['sizes'].items())))
+
+    def stop(self) -> None:
+        '''Stop sampling and take the final snapshot.
+        '''
+        self.stopped.set()
+        self.join()
+        self.sample()
+        self.final = take_snapshot()
+        if self.baseline is None:
+            # Run shorter than the warmup: growth is measured from the first sample
+            self.baseline = self.final
+
+
+def growth_report(sampler: MemorySampler,
+                  budget: float,
+                  top: int = 15) -> Dict[str, Any]:
+    '''Returns memory growth per hour, its allocation sites and if it is within budget.
+
+    Args
+    ----
+    sampler : MemorySampler
+        stopped sampler
+    budget : float
+        maximal RSS growth (in MB per hour)
+    top : int, optional
+        number of allocation sites reported.
+        Default is 15.
+
+    Returns
+    -------
+    dict
+        duration, growth of RSS and traced memory (MB per hour), growth of each
+        state size (elements per hour), top allocation sites and 'passed'
+    '''
+    samples = sampler.samples
+    duration = samples[-1]['time'] if samples else 0.0
+    start = sampler.warmup if duration > sampler.warmup else 0.0
+    elapsed = max(duration - start, 1e-9) / 3600
+
+    sites = []
+    for stat in sampler.final.compare_to(sampler.baseline, 'lineno')[:top]:
+        frame = stat.traceback[0]
+        sites.append({
+            'site': '{}:{}'.format(frame.filename, frame.lineno),
+            'size_diff': stat.size_diff / MB,
+            'count_diff': stat.count_diff,
+            'per_hour': stat.size_diff / MB / elapsed,
+            'size': stat.size / MB,
+        })
+
+    rss_growth = slope(samples, 'rss', start)
+    return {
+        'duration': duration,
+        'warmup': start,
+        'budget': budget,
+        'rss_growth': rss_growth,
+        'traced_growth': slope(samples, 'traced', start),
+        'state_growth': {key: slope(samples, key, start) for key in (samples[-1]['sizes'] if samples else {})},
+        'sites': sites,
+        'passed': rss_growth <= budget,
+        'samples': samples,
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    '''Returns a printable report of memory growth.
+    '''
+    lines = ['Soak test of {:.0f} s (warmup {:.0f} s)'.format(report['duration'], report['warmup']),
+             'RSS growth: {:+.2f} MB/h (budget {:.2f} MB/h)'.format(report['rss_growth'], report['budget']),
+             'Traced growth: {:+.2f} MB/h'.format(report['traced_growth']),
+             'State growth (elements/h):']
+    for key, value in report['state_growth'].items():
+        lines.append('  {:<20} {:+.0f}'.format(key, value))
+    lines.append('Allocation sites growing the most:')
+    for site in report['sites']:
+        lines.append('  {:+9.3f} MB ({:+.3f} MB/h, {:+d} blocks) {}'.format(
+            site['size_diff'], site['per_hour'], site['count_diff'], site['site']))
+    lines.append('PASSED' if report['passed'] else 'FAILED: RSS grows over budget')
+    return '\n'.join(lines)
+
+
+def run_soak(configpath: str = 'config/default.yaml',
+             duration: float = 3600,
+             interval: float = 60,
+             rate: float = 1.0,
+             corpus: str = '',
+             warmup: float = 300,
+             budget: float = 10.0,
+             replay: bool = False,
+             outfile: str = '') -> Dict[str, Any]:
+    '''Run the headless pipeline against a local mock website and track its memory.
+
+    Args
+    ----
+    configpath : str, optional
+        configuration of the pipeline. Display and printing are disabled.
+        Default is 'config/default.yaml'.
+    duration : float, optional
+        duration (in seconds) of the run.
+        Default is 3600.
+    interval : float, optional
+        delay (in seconds) between 2 samples.
+        Default is 60.
+    rate : float, optional
+        messages per second fed to the mock website.
+        Default is 1.0.
+    corpus : str, optional
+        messages file fed to the mock website. If empty, messages are synthetic.
+        Default is ''.
+    warmup : float, optional
+        time (in seconds) before growth is measured, such as caches filling up.
+        Default is 300.
+    budget : float, optional
+        maximal RSS growth (in MB per hour).
+        Default is 10.0.
+    replay : bool, optional
+        if True, analyses recorded in the corpus are replayed instead of loading the model
+        (see src.simulate.ReplayAnalyzer).
+        Default is False.
+    outfile : str, optional
+        JSON file to write the report and samples to.
+        Default is ''.
+
+    Returns
+    -------
+    dict
+        report of memory growth (see growth_report)
+    '''
+    # Imported here so that reports can be read without the GUI dependencies
+    from .engine import HeadlessEngine
+    from .gui import RondeGUI
+    from .simulate import ReplayAnalyzer
+
+    config = load_config(configpath).raw
+    config['display'] = {'colors': False, 'text': False}
+    config['print'] = {'text': False, 'mode': 'demo'}
+
+    analyzer = None
+    if replay:
+        analyzer = ReplayAnalyzer(read_messages(corpus) if corpus else [],
+                                  threshold=config['models']['threshold'])
+
+    # Spawned, so the child does not inherit the state of this process
+    context = multiprocessing.get_context('spawn')
+    urls, stopped = context.Queue(), context.Event()
+    server = context.Process(target=serve_table, args=(corpus, rate, urls, stopped), daemon=True)
+    server.start()
+    ronde = RondeGUI(config, None, urls.get(timeout=60), analyzer=analyzer)
+    engine = HeadlessEngine(ronde, config['manager'])
+
+    # Started once the model is loaded, so only the pipeline is traced
+    tracemalloc.start()
+    sampler = MemorySampler(ronde, interval, warmup)
+    sampler.start()
+    timer = threading.Timer(duration, engine.shutdown)
+    timer.start()
+    try:
+        asyncio.run(engine.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        timer.cancel()
+        sampler.stop()
+        stopped.set()
+        server.join(10)
+        tracemalloc.stop()
+
+    report = growth_report(sampler, budget)
+    if outfile:
+        with open(outfile, 'w') as f:
+            json.dump(report, f, indent=4)
+    return report
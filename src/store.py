@@ -0,0 +1,203 @@
+'''Columnar storage of messages and their analysis (Parquet or Arrow IPC).
+
+A store has one row per message and the columns:
+    * message, channel, pseudo: strings, empty values are null
+    * <name>_label, <name>_score: label and score of each model <name>
+
+Files are memory-mapped when read and only the requested columns are loaded,
+so reading labels and scores does not parse the messages.
+'''
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+STORE_EXTENSIONS = ('.parquet', '.arrow')
+TEXT_COLUMNS = ['message', 'channel', 'pseudo']
+
+
+def is_store(path: str) -> bool:
+    '''Returns if a path designates a columnar store, based on its extension.
+    '''
+    return path.endswith(STORE_EXTENSIONS)
+
+
+def model_names(columns: Iterable[str]) -> List[str]:
+    '''Returns the names of the models stored in a list of columns.
+
+    Args
+    ----
+    columns : iterable of str
+        column names of a store
+
+    Returns
+    -------
+    list of str
+        model names, in column order
+    '''
+    columns = list(columns)
+    return [x[:-len('_label')] for x in columns
+            if x.endswith('_label') and x[:-len('_label')] + '_score' in columns]
+
+
+def store_schema(models: Iterable[str]) -> pa.Schema:
+    '''Returns the schema of a store.
+
+    Args
+    ----
+    models : iterable of str
+        names of the models
+
+    Returns
+    -------
+    pa.Schema
+        schema of the store
+    '''
+    fields = [pa.field(x, pa.string()) for x in TEXT_COLUMNS]
+    for name in models:
+        fields.append(pa.field('{}_label'.format(name), pa.string()))
+        fields.append(pa.field('{}_score'.format(name), pa.float64()))
+    return pa.schema(fields)
+
+
+def records_to_batch(records: List[Dict[str, Any]],
+                     schema: pa.Schema) -> pa.RecordBatch:
+    '''Converts messages structured as dictionary to a record batch.
+
+    Args
+    ----
+    records : list of dict
+        messages, with model results structured as {<name>: {'label': ..., 'score': ...}}
+    schema : pa.Schema
+        schema of the store
+
+    Returns
+    -------
+    pa.RecordBatch
+        batch of rows
+    '''
+    columns = {x: [elem.get(x) or None for elem in records] for x in TEXT_COLUMNS}
+    for name in model_names(schema.names):
+        results = [elem.get(name) or {} for elem in records]
+        columns['{}_label'.format(name)] = [x.get('label') for x in results]
+        columns['{}_score'.format(name)] = [x.get('score') for x in results]
+
+    return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def write_store(records: Iterable[Dict[str, Any]],
+                path: str,
+                models: Optional[List[str]] = None,
+                batch_size: int = 10000) -> int:
+    '''Writes messages into a store by batches.
+
+    Args
+    ----
+    records : iterable of dict
+        messages structured as dictionary, such as in JSON files
+    path : str
+        path to the store. Should end with '.parquet' or '.arrow'.
+    models : list of str, optional
+        names of the models to store. If None, models of the first message are used.
+        Default is None.
+    batch_size : int, optional
+        number of messages written at once.
+        Default is 10000.
+
+    Returns
+    -------
+    int
+        number of messages written
+    '''
+    records = iter(records)
+    batch = [x for _, x in zip(range(batch_size), records)]
+
+    if models is None:
+        models = [x for x in (batch[0] if batch else {})
+                  if isinstance(batch[0][x], dict) and 'label' in batch[0][x]]
+    schema = store_schema(models)
+
+    # Written in a temporary file, as the source may be the memory-mapped store itself
+    tmp = path + '.tmp'
+    if path.endswith('.parquet'):
+        writer = pq.ParquetWriter(tmp, schema)
+    else:
+        writer = pa.ipc.new_file(tmp, schema)
+
+    count = 0
+    with writer:
+        while batch:
+            writer.write_batch(records_to_batch(batch, schema))
+            count += len(batch)
+            batch = [x for _, x in zip(range(batch_size), records)]
+
+    os.replace(tmp, path)
+    return count
+
+
+def store_columns(path: str) -> List[str]:
+    '''Returns the column names of a store, without reading its data.
+    '''
+    if path.endswith('.parquet'):
+        return pq.read_schema(path).names
+
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def read_store(path: str,
+               columns: Optional[List[str]] = None) -> pa.Table:
+    '''Reads a store, memory-mapped.
+
+    Args
+    ----
+    path : str
+        path to the store
+    columns : list of str, optional
+        columns to read. If None, all columns are read.
+        Default is None.
+
+    Returns
+    -------
+    pa.Table
+        table of the store
+    '''
+    if path.endswith('.parquet'):
+        return pq.read_table(path, columns=columns, memory_map=True)
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns is not None else table
+
+
+def iter_store(path: str,
+               columns: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    '''Reads messages of a store, structured as dictionary such as in JSON files.
+
+    Args
+    ----
+    path : str
+        path to the store
+    columns : list of str, optional
+        columns to read. If None, all columns are read.
+        Default is None.
+
+    Returns
+    -------
+    iterator of dict
+        messages with model results structured as {<name>: {'label': ..., 'score': ...}}.
+        Null values are skipped.
+    '''
+    table = read_store(path, columns)
+    models = model_names(table.column_names)
+
+    for batch in table.to_batches():
+        for row in batch.to_pylist():
+            elem = {x: row[x] for x in TEXT_COLUMNS if row.get(x) is not None}
+            for name in models:
+                if row['{}_label'.format(name)] is not None:
+                    elem[name] = {'label': row['{}_label'.format(name)],
+                                  'score': row['{}_score'.format(name)]}
+            yield elem
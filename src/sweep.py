@@ -0,0 +1,347 @@
+'''Hyperparameter sweep of retrain, with trials run as isolated processes.
+
+A sweep samples trials from a search space (see config/sweep.yaml). Each
+trial runs retrain in its own process, with a share of the CPU cores, and
+writes its results in its own folder, inside the folder of the sweep (named
+after its start time, such as <output>/20240131-093000):
+    <sweep>/trial-<n>/config.yaml: training configuration of the trial
+    <sweep>/trial-<n>/progress.json: validation loss of each epoch
+    <sweep>/trial-<n>/result.json: status, scores and model of the trial
+    <sweep>/trial-<n>/trial.log: output of the trial process
+
+Trials whose validation loss is above the median of other trials of the sweep
+at the same epoch are pruned (see MedianPruner). Results of every trial are
+gathered in <sweep>/leaderboard.csv.
+'''
+import copy
+import csv
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import yaml
+
+# Root of the repository, from where trials are run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_sweep_config(path: str) -> Dict[str, Any]:
+    '''Load a sweep configuration.
+    '''
+    with open(path, 'r') as f:
+        return yaml.load(f, yaml.FullLoader)
+
+
+def sample_value(space: Any,
+                 rng: np.random.Generator) -> Any:
+    '''Sample a value of a search space dimension.
+
+    Args
+    ----
+    space : list or dict
+        list of values to choose from, or dictionary with:
+          - 'type': 'uniform', 'log' or 'int'
+          - 'low' and 'high': bounds of the values
+        A single value is returned as is.
+    rng : np.random.Generator
+        random generator
+
+    Returns
+    -------
+    any
+        sampled value
+    '''
+    if isinstance(space, list):
+        return space[rng.integers(len(space))]
+    if not isinstance(space, dict):
+        return space
+
+    low, high = space['low'], space['high']
+    if space['type'] == 'log':
+        return float(math.exp(rng.uniform(math.log(low), math.log(high))))
+    if space['type'] == 'int':
+        return int(rng.integers(low, high + 1))
+    return float(rng.uniform(low, high))
+
+
+def set_key(config: Dict[str, Any],
+            key: str,
+            value: Any) -> None:
+    '''Set a value of a nested configuration from a dotted key, such as 'training.epochs'.
+    '''
+    *parents, name = key.split('.')
+    for parent in parents:
+        config = config.setdefault(parent, {})
+    config[name] = value
+
+
+def sample_trials(space: Dict[str, Any],
+                  count: int,
+                  seed: int = 0) -> List[Dict[str, Any]]:
+    '''Sample distinct trials of a search space.
+
+    Args
+    ----
+    space : dict
+        search space, by dotted key of the training configuration
+    count : int
+        number of trials
+    seed : int, optional
+        seed of the sampling.
+        Default is 0.
+
+    Returns
+    -------
+    list of dict
+        value of each key, for each trial
+    '''
+    rng = np.random.default_rng(seed)
+    trials: List[Dict[str, Any]] = []
+    for _ in range(count * 100):
+        params = {key: sample_value(value, rng) for key, value in space.items()}
+        if params not in trials:
+            trials.append(params)
+        if len(trials) == count:
+            break
+    return trials
+
+
+def trial_config(base: Dict[str, Any],
+                 params: Dict[str, Any],
+                 folder: str,
+                 cpus: List[int]) -> Dict[str, Any]:
+    '''Returns the training configuration of a trial.
+
+    Outputs of the trial are written in its folder and the trial is pinned
+    to its CPUs, with one intra-op thread per CPU.
+
+    Args
+    ----
+    base : dict
+        training configuration shared by all trials
+    params : dict
+        sampled values, by dotted key
+    folder : str
+        folder of the trial
+    cpus : list of int
+        CPUs of the trial
+
+    Returns
+    -------
+    dict
+        training configuration
+    '''
+    config = copy.deepcopy(base)
+    for key, value in params.items():
+        set_key(config, key, value)
+
+    config['output'] = os.path.join(folder, 'model')
+    config['logs'] = os.path.join(folder, 'logs')
+    config['checkpoints'].update({'folder': os.path.join(folder, 'checkpoints'),
+                                  'resume': False,
+                                  'select': False,
+                                  'jobs': 1})
+    config['performance'].update({'intra_op_threads': len(cpus),
+                                  'inter_op_threads': 1,
+                                  'cpus': cpus})
+    return config
+
+
+def folder_size(path: str) -> int:
+    '''Returns the size (in bytes) of the files of a folder.
+    '''
+    return sum(os.path.getsize(os.path.join(root, x))
+               for root, _, files in os.walk(path) for x in files)
+
+
+def run_trial(folder: str,
+              datafolder: str,
+              token_model: str = 'camembert-base',
+              sentiment_model: str = 'tblard/tf-allocine',
+              warmup: int = 1,
+              min_trials: int = 2) -> Dict[str, Any]:
+    '''Run a trial in the current process. Called by the trial process.
+
+    Args
+    ----
+    folder : str
+        folder of the trial, containing its config.yaml
+    datafolder : str
+        folder containing the train and test splits
+    token_model : str, optional
+        model used for tokenisation.
+        Default is 'camembert-base'.
+    sentiment_model : str, optional
+        model to retrain from.
+        Default is 'tblard/tf-allocine'.
+    warmup : int, optional
+        number of epochs before the trial can be pruned.
+        Default is 1.
+    min_trials : int, optional
+        minimal number of other trials having reached an epoch to prune.
+        Default is 2.
+
+    Returns
+    -------
+    dict
+        result of the trial, also written in result.json
+    '''
+    from .performance import apply_profile
+    from .retrain import load_train_config
+
+    config = load_train_config(os.path.join(folder, 'config.yaml'))
+    apply_profile(config['performance'])
+
+    from .retrain import MedianPruner, retrain, select_best_checkpoint
+    pruner = MedianPruner(folder, warmup, min_trials)
+    model = retrain(datafolder, token_model, sentiment_model, config, [pruner])
+
+    result: Dict[str, Any] = {'status': 'pruned' if pruner.pruned else 'complete',
+                              'epochs': len(pruner.losses),
+                              'val_loss': min(pruner.losses) if pruner.losses else None,
+                              'accuracy': None}
+    # Pruned trials are not worth the evaluation on test data
+    if not pruner.pruned:
+        best = select_best_checkpoint(datafolder, token_model, sentiment_model, config, model)
+        if best:
+            result['accuracy'] = best['test_accuracy']
+    exported = os.path.isfile(os.path.join(config['output'], 'config.json'))
+    result['model_size'] = folder_size(config['output']) if exported else None
+
+    with open(os.path.join(folder, 'result.json'), 'w') as f:
+        json.dump(result, f, indent=4)
+    return result
+
+
+def write_leaderboard(path: str,
+                      rows: List[Dict[str, Any]],
+                      keys: List[str]) -> None:
+    '''Write the results of the trials, best accuracy first.
+
+    Args
+    ----
+    path : str
+        path to the CSV file
+    rows : list of dict
+        result and parameters of each trial
+    keys : list of str
+        dotted keys of the search space
+    '''
+    rows = sorted(rows, key=lambda x: (x.get('accuracy') is None, -(x.get('accuracy') or 0),
+                                       x.get('val_loss') or float('inf')))
+    columns = ['trial', 'status', 'accuracy', 'val_loss', 'epochs', 'wall_time', 'model_size'] + keys
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def new_run_folder(output: str) -> str:
+    '''Create and returns the folder of a new sweep, named after its start time.
+
+    Each sweep has its own folder, as the pruner compares every trial folder of a sweep.
+    '''
+    name = time.strftime('%Y%m%d-%H%M%S')
+    for i in itertools.count():
+        folder = os.path.join(output, name if not i else '{}-{}'.format(name, i))
+        try:
+            os.makedirs(folder)
+            return folder
+        except FileExistsError:
+            continue
+
+
+def run_sweep(config: Dict[str, Any],
+              token_model: str = 'camembert-base',
+              sentiment_model: str = 'tblard/tf-allocine') -> List[Dict[str, Any]]:
+    '''Run the trials of a sweep, several at once, and write the leaderboard.
+
+    Cores are split into one slot per concurrent trial. Each trial is pinned to
+    the cores of its slot, so trials do not compete for the same cores.
+
+    Args
+    ----
+    config : dict
+        sweep configuration (see config/sweep.yaml)
+    token_model : str, optional
+        model used for tokenisation.
+        Default is 'camembert-base'.
+    sentiment_model : str, optional
+        model to retrain from.
+        Default is 'tblard/tf-allocine'.
+
+    Returns
+    -------
+    list of dict
+        result and parameters of each trial
+    '''
+    from .retrain import load_train_config
+
+    base = load_train_config(config['base'])
+    trials = sample_trials(config['space'], config['trials'], config.get('seed', 0))
+    output = new_run_folder(config['output'])
+    print('Sweep results are written in {}'.format(output))
+
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else list(range(os.cpu_count() or 1))
+    jobs = max(min(config['jobs'], len(trials), len(cpus)), 1)
+    threads = config.get('threads') or len(cpus) // jobs
+    slots = [cpus[i * threads:(i + 1) * threads] or cpus for i in range(jobs)]
+
+    pending = list(enumerate(trials))
+    running: Dict[int, Any] = {}
+    rows: List[Dict[str, Any]] = []
+
+    while pending or running:
+        # Start trials on free slots
+        for slot in range(jobs):
+            if slot in running or not pending:
+                continue
+            index, params = pending.pop(0)
+            folder = os.path.join(output, 'trial-{:03d}'.format(index))
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, 'config.yaml'), 'w') as f:
+                yaml.dump(trial_config(base, params, folder, slots[slot]), f)
+
+            command = [sys.executable, '-m', 'src.sweep', folder, config['folder'],
+                       token_model, sentiment_model,
+                       str(config['pruning']['warmup']), str(config['pruning']['min_trials'])]
+            log = open(os.path.join(folder, 'trial.log'), 'w')
+            process = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+            running[slot] = (index, params, folder, process, log, time.perf_counter())
+            print('Trial {} started on CPUs {}: {}'.format(index, slots[slot], params))
+
+        time.sleep(1)
+
+        for slot, (index, params, folder, process, log, start) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log.close()
+            del running[slot]
+
+            row: Dict[str, Any] = {'trial': index, 'status': 'failed'}
+            resultfile = os.path.join(folder, 'result.json')
+            if process.returncode == 0 and os.path.isfile(resultfile):
+                with open(resultfile) as f:
+                    row.update(json.load(f))
+            row['wall_time'] = round(time.perf_counter() - start, 1)
+            row.update(params)
+            rows.append(row)
+            print('Trial {} {}: accuracy {}, validation loss {}, {}s'.format(
+                index, row['status'], row.get('accuracy'), row.get('val_loss'), row['wall_time']))
+
+            write_leaderboard(os.path.join(output, 'leaderboard.csv'), rows, list(config['space']))
+
+    return rows
+
+
+if __name__ == '__main__':
+    # Trial process, started by run_sweep
+    folder, datafolder, token_model, sentiment_model, warmup, min_trials = sys.argv[1:7]
+    run_trial(folder, datafolder, token_model, sentiment_model, int(warmup), int(min_trials))
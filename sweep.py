@@ -0,0 +1,43 @@
+'''File used to run a hyperparameter sweep of the retraining.
+'''
+import argparse
+
+from src.sweep import load_sweep_config, run_sweep
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Run retraining trials sampled from a search space and write a leaderboard.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/sweep.yaml',
+                        help='path to sweep configuration.')
+    parser.add_argument('-t', '--token', type=str,
+                        default='camembert-base',
+                        help='model for tokenisation.')
+    parser.add_argument('-s', '--sentiment', type=str,
+                        default='tblard/tf-allocine',
+                        help='sentiment analysis model to retrain from.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=0,
+                        help='number of trials running at once. 0 uses the configuration.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters
+    opt = parse_args()
+
+    config = load_sweep_config(opt.config)
+    if opt.jobs:
+        config['jobs'] = opt.jobs
+
+    run_sweep(config, opt.token, opt.sentiment)
@@ -1,8 +1,12 @@
 '''File used to retrain a sentiment analysis model.
 '''
 import argparse
+import sys
 
-from src.retrain import retrain
+from src.active import incremental_retrain, next_annotation_batch
+from src.distributed import create_strategy, launch_workers, strip_launch_args
+from src.performance import add_profile_args, apply_profile, profile_from_args
+from src.retrain import load_train_config, retrain, select_best_checkpoint
 
 
 def parse_args():
@@ -23,6 +27,23 @@ def parse_args():
     parser.add_argument('-s', '--sentiment', type=str,
                         default='tblard/tf-allocine',
                         help='sentiment analysis model to retrain from.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/train.yaml',
+                        help='path to training configuration.')
+    parser.add_argument('-b', '--best', action='store_true',
+                        help='only select the best retained checkpoint on test data and export it.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='update the exported model with new annotations of folder (such as data/annotated) and write the next messages to annotate.')
+    parser.add_argument('-w', '--workers', type=str,
+                        default='',
+                        help='comma separated list of workers (host:port), the same on every worker. Training is split between workers.')
+    parser.add_argument('--index', type=int,
+                        default=0,
+                        help='index of this worker in the list of workers. Worker 0 saves checkpoints and the model.')
+    parser.add_argument('-l', '--launch', type=int,
+                        default=0,
+                        help='start this number of workers on localhost and wait for them.')
+    add_profile_args(parser)
     opt = parser.parse_args()
 
     return opt
@@ -32,4 +53,18 @@ if __name__ == '__main__':
     # Load parameters
     opt = parse_args()
 
-    retrain(opt.folder, opt.token, opt.sentiment)
+    if opt.launch:
+        sys.exit(launch_workers(opt.launch, strip_launch_args(sys.argv[1:])))
+
+    config = load_train_config(opt.config)
+    config['performance'] = profile_from_args(config['performance'], opt)
+    apply_profile(config['performance'])
+    strategy = create_strategy(opt.workers, opt.index)
+
+    if opt.incremental:
+        incremental_retrain(opt.folder, opt.token, opt.sentiment, config)
+        next_annotation_batch(opt.folder, opt.token, config)
+    elif opt.best:
+        select_best_checkpoint(opt.folder, opt.token, opt.sentiment, config)
+    else:
+        retrain(opt.folder, opt.token, opt.sentiment, config, strategy=strategy)
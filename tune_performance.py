@@ -0,0 +1,36 @@
+'''File used to find the fastest performance profile on the bundled data.
+'''
+import argparse
+
+from src.performance import tune_profile
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Measure candidate thread and XLA settings and write the fastest one in a configuration.')
+    parser.add_argument('-c', '--config', type=str,
+                        default='config/default.yaml',
+                        help='configuration file whose performance section is updated.')
+    parser.add_argument('-t', '--task', type=str,
+                        default='analysis', choices=['analysis', 'training'],
+                        help='measured workload: sentiment analysis of data/pre/chaat.json or training on data/sorted.')
+    parser.add_argument('--timeout', type=float,
+                        default=600,
+                        help='maximal duration (in seconds) of a measure.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters
+    opt = parse_args()
+
+    tune_profile(opt.config, opt.task, timeout=opt.timeout)
@@ -0,0 +1,35 @@
+'''Converts a WhatsApp chat history export to a JSON file.
+'''
+import argparse
+
+from src.format import convert_whatsapp_chat
+
+
+def parse_args():
+    '''Define an argument parser and returns the corresponding dictionary.
+
+    Returns
+    -------
+    dict
+        dictionary of input arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='Converts a WhatsApp chat history (txt export) into a JSON or JSON lines file.')
+    parser.add_argument('path', type=str,
+                        help='path to WhatsApp chat history file.')
+    parser.add_argument('-f', '--file', type=str,
+                        default='output.json',
+                        help='output file. A JSON lines file is written if it ends with .jsonl.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=1,
+                        help='number of worker processes. If 0, uses the number of CPUs. Parsing is sequential by default, as it is mostly bound by disk reads.')
+    opt = parser.parse_args()
+
+    return opt
+
+
+if __name__ == '__main__':
+    # Load parameters
+    opt = parse_args()
+
+    convert_whatsapp_chat(opt.path, opt.file, jobs=opt.jobs)